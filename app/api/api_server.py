@@ -1,15 +1,43 @@
-﻿from typing import Any, Dict, List, Optional
+﻿import asyncio
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
-from app.generation.rag_llm import run_rag
+from app.generation.circuit_breaker import circuit_breaker_stats
+from app.generation.hf_llm import close_async_transport, is_fallback_answer
+from app.generation.rag_llm import (
+    answer_cache_stats,
+    filter_values,
+    query_cache_stats,
+    run_rag_async,
+    stream_rag_async,
+    warm_answer_cache,
+    warm_up,
+)
+from app.retrieval.chunk_store import normalize_filters
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    # Map the keyword index before serving so the first request does not pay for it.
+    warm_up()
+    # Answers for ANSWER_CACHE_WARMUP are generated in the background while serving.
+    warming = asyncio.create_task(warm_answer_cache())
+    yield
+    warming.cancel()
+    await close_async_transport()
+
 
 app = FastAPI(
     title="SEBI Compliance RAG API",
     description="SEBI regulatory retrieval + answer generation service.",
     version="3.0.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -29,6 +57,10 @@ class ChatTurn(BaseModel):
 class QueryRequest(BaseModel):
     question: str = Field(..., min_length=2, description="User question about SEBI regulations")
     history: List[ChatTurn] = Field(default_factory=list)
+    filters: Dict[str, List[str]] = Field(
+        default_factory=dict,
+        description="Restrict retrieval to these doc_type / source_file values, e.g. {\"doc_type\": [\"master\"]}",
+    )
 
 
 class EvidenceItem(BaseModel):
@@ -38,6 +70,8 @@ class EvidenceItem(BaseModel):
     doc_type: Optional[str] = None
     text: str
     score: Optional[float] = None
+    # Other chunks whose text was collapsed into this one at corpus build time.
+    duplicates: List[Dict[str, Any]] = []
 
 
 class QueryResponse(BaseModel):
@@ -54,40 +88,30 @@ class HealthResponse(BaseModel):
 
 
 def _detect_mode(answer: str) -> str:
-    if "Generation provider unavailable" in answer or "Failure detail:" in answer:
+    if is_fallback_answer(answer):
         return "fallback"
     return "llm"
 
 
-@app.get("/", response_model=HealthResponse)
-def root() -> HealthResponse:
-    return HealthResponse(
-        status="ok",
-        service="sebi-rag-api",
-        version=app.version,
-    )
-
-
-@app.get("/health", response_model=HealthResponse)
-def health() -> HealthResponse:
-    return HealthResponse(
-        status="ok",
-        service="sebi-rag-api",
-        version=app.version,
-    )
-
+def _duplicate_refs(duplicates_raw: Any) -> List[Dict[str, Any]]:
+    # The parquet metadata path yields an array of dicts with numpy values.
+    if duplicates_raw is None:
+        return []
+    refs: List[Dict[str, Any]] = []
+    for ref in duplicates_raw:
+        try:
+            chunk_index = int(ref.get("chunk_index", -1))
+        except (TypeError, ValueError):
+            chunk_index = -1
+        entry = {"id": ref.get("id"), "source_file": str(ref.get("source_file", "unknown")), "chunk_index": chunk_index}
+        # Present when the collapsed chunk's wording differs from this one's.
+        if isinstance(ref.get("text"), str) and ref["text"]:
+            entry["text"] = ref["text"]
+        refs.append(entry)
+    return refs
 
-@app.post("/query", response_model=QueryResponse)
-def query_rag(request: QueryRequest) -> QueryResponse:
-    history: List[Dict[str, str]] = [turn.model_dump() for turn in request.history]
 
-    try:
-        result: Dict[str, Any] = run_rag(request.question, history=history)
-    except Exception as exc:  # pragma: no cover
-        raise HTTPException(status_code=500, detail=f"RAG execution failed: {exc}") from exc
-
-    answer = str(result.get("answer", ""))
-    evidence_raw = result.get("evidence", [])
+def _evidence_items(evidence_raw: List[Dict[str, Any]]) -> List[EvidenceItem]:
     evidence: List[EvidenceItem] = []
 
     for item in evidence_raw:
@@ -110,12 +134,104 @@ def query_rag(request: QueryRequest) -> QueryResponse:
                 doc_type=item.get("doc_type"),
                 text=str(item.get("text", "")),
                 score=score,
+                duplicates=_duplicate_refs(item.get("duplicates")),
             )
         )
 
+    return evidence
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.get("/", response_model=HealthResponse)
+def root() -> HealthResponse:
+    return HealthResponse(
+        status="ok",
+        service="sebi-rag-api",
+        version=app.version,
+    )
+
+
+@app.get("/health", response_model=HealthResponse)
+def health() -> HealthResponse:
+    return HealthResponse(
+        status="ok",
+        service="sebi-rag-api",
+        version=app.version,
+    )
+
+
+@app.get("/filters")
+def filters() -> Dict[str, List[str]]:
+    return filter_values()
+
+
+@app.get("/cache/stats")
+def cache_stats() -> Dict[str, Any]:
+    return {"query_embeddings": query_cache_stats(), "answers": answer_cache_stats()}
+
+
+@app.get("/breaker/stats")
+def breaker_stats() -> Dict[str, Any]:
+    return circuit_breaker_stats()
+
+
+@app.post("/query", response_model=QueryResponse)
+async def query_rag(request: QueryRequest) -> QueryResponse:
+    history: List[Dict[str, str]] = [turn.model_dump() for turn in request.history]
+    try:
+        normalize_filters(request.filters)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    try:
+        result: Dict[str, Any] = await run_rag_async(request.question, history=history, filters=request.filters)
+    except Exception as exc:  # pragma: no cover
+        raise HTTPException(status_code=500, detail=f"RAG execution failed: {exc}") from exc
+
+    answer = str(result.get("answer", ""))
+    evidence = _evidence_items(result.get("evidence", []))
+
     return QueryResponse(
         question=request.question,
         answer=answer,
         evidence=evidence,
         mode=_detect_mode(answer),
+    )
+
+
+@app.post("/query/stream")
+async def query_rag_stream(request: QueryRequest) -> StreamingResponse:
+    """
+    /query as server-sent events: `evidence` (list of EvidenceItem) as soon
+    as retrieval is done, `token` events carrying answer text as it is
+    generated, then `done` with the answer mode, or `error`.
+    """
+    history: List[Dict[str, str]] = [turn.model_dump() for turn in request.history]
+    try:
+        normalize_filters(request.filters)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+
+    async def events() -> AsyncIterator[str]:
+        answer: List[str] = []
+        try:
+            async for kind, data in stream_rag_async(request.question, history=history, filters=request.filters):
+                if kind == "evidence":
+                    yield _sse("evidence", [item.model_dump() for item in _evidence_items(data)])
+                else:
+                    answer.append(data)
+                    yield _sse("token", {"text": data})
+        except Exception as exc:
+            yield _sse("error", {"detail": f"RAG execution failed: {exc}"})
+            return
+        yield _sse("done", {"mode": _detect_mode("".join(answer))})
+
+    # X-Accel-Buffering stops nginx from holding the events back until the response ends.
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
@@ -18,10 +18,189 @@ def get_hf_model() -> str:
     return os.getenv("HF_MODEL", "google/flan-t5-large")
 
 
+def get_hf_http_config() -> dict:
+    """
+    HF router connection pool: up to HF_POOL_SIZE kept-alive connections;
+    with HF_POOL_BLOCK=1 callers wait for a free one instead of opening extras.
+    The async client of the API server opens at most HF_MAX_CONNECTIONS
+    concurrent connections and keeps HF_POOL_SIZE of them alive.
+    """
+    return {
+        "pool_size": max(1, int(os.getenv("HF_POOL_SIZE", "16"))),
+        "pool_block": os.getenv("HF_POOL_BLOCK", "0").strip().lower() in {"1", "true", "yes"},
+        "max_connections": max(1, int(os.getenv("HF_MAX_CONNECTIONS", "256"))),
+    }
+
+
+def get_hf_breaker_config() -> dict:
+    """
+    Generation circuit breaker (see generation/circuit_breaker.py) and the
+    total time one request may spend on the provider, HF_DEADLINE seconds
+    (default 0 = unbounded: each attempt keeps only its own timeout).
+    HF_BREAKER_ERROR_RATE=0 and HF_BREAKER_SLOW_RATE=0 never open the breaker.
+    """
+    return {
+        "deadline_seconds": float(os.getenv("HF_DEADLINE", "0")),
+        "window_seconds": float(os.getenv("HF_BREAKER_WINDOW", "60")),
+        "min_calls": max(1, int(os.getenv("HF_BREAKER_MIN_CALLS", "5"))),
+        "error_rate": float(os.getenv("HF_BREAKER_ERROR_RATE", "0.5")),
+        "slow_seconds": float(os.getenv("HF_BREAKER_SLOW_SECONDS", "20")),
+        "slow_rate": float(os.getenv("HF_BREAKER_SLOW_RATE", "0.5")),
+        "open_seconds": float(os.getenv("HF_BREAKER_OPEN_SECONDS", "5")),
+        "max_open_seconds": float(os.getenv("HF_BREAKER_MAX_OPEN_SECONDS", "120")),
+    }
+
+
 def get_embed_model() -> str:
     return os.getenv("EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
 
 
+def get_embed_backend() -> str:
+    """Query-encoder runtime: `torch` (default), `int8` or `onnx`."""
+    return os.getenv("EMBED_BACKEND", "torch").strip().lower()
+
+
+def get_onnx_file() -> str:
+    """Optional ONNX file inside the model repo, e.g. onnx/model_qint8_avx512_vnni.onnx."""
+    return os.getenv("EMBED_ONNX_FILE", "").strip()
+
+
+def get_query_cache_config() -> dict:
+    """Query-embedding cache sizing; QUERY_CACHE_SIZE=0 disables it."""
+    return {
+        "max_entries": int(os.getenv("QUERY_CACHE_SIZE", "4096")),
+        "ttl_seconds": float(os.getenv("QUERY_CACHE_TTL", "86400")),
+        "path": os.getenv("QUERY_CACHE_PATH", ""),
+    }
+
+
+def get_answer_cache_config() -> dict:
+    """
+    Answer cache in front of run_rag; ANSWER_CACHE_SIZE=0 disables it. The
+    semantic tier is off (ANSWER_CACHE_SIMILARITY=0) unless a threshold is
+    set. ANSWER_CACHE_WARMUP names a JSONL file of {"question": ...}
+    requests answered at API startup.
+    """
+    return {
+        "max_entries": int(os.getenv("ANSWER_CACHE_SIZE", "1024")),
+        "ttl_seconds": float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+        "similarity": float(os.getenv("ANSWER_CACHE_SIMILARITY", "0")),
+        "warmup_path": os.getenv("ANSWER_CACHE_WARMUP", "").strip(),
+    }
+
+
+def get_rag_engine_backend() -> str:
+    """`langchain` (default), `native` (direct sentence-transformers + FAISS) or `sharded`."""
+    return os.getenv("RAG_ENGINE", "langchain").strip().lower()
+
+
+def get_shard_config() -> dict:
+    """
+    Sharded index layout. SHARD_BY=source puts each source document in its
+    own shard; SHARD_BY=hash spreads chunks over NUM_SHARDS shards by id.
+    SHARD_WORKERS caps the search thread pool (0 = one thread per shard).
+    """
+    return {
+        "scheme": os.getenv("SHARD_BY", "source").strip().lower(),
+        "num_shards": int(os.getenv("NUM_SHARDS", "4")),
+        "workers": int(os.getenv("SHARD_WORKERS", "0")),
+    }
+
+
+def get_retrieval_workers() -> int:
+    """Threads the async API server runs retrieval on (0 = one per CPU)."""
+    return int(os.getenv("RETRIEVAL_WORKERS", "0"))
+
+
+def get_index_load_mode() -> str:
+    """`mmap` maps index files read-only and shares pages across workers; `pickle` loads them into RAM."""
+    return os.getenv("INDEX_LOAD_MODE", "mmap").strip().lower()
+
+
+def get_index_type() -> str:
+    return os.getenv("INDEX_TYPE", "flat").strip().lower()
+
+
+def get_index_params() -> dict:
+    """
+    ANN tuning knobs set in the environment. Unset knobs are omitted so the
+    index builder can pick size-appropriate defaults.
+    """
+    env_keys = {
+        "nlist": "IVF_NLIST",
+        "nprobe": "IVF_NPROBE",
+        "hnsw_m": "HNSW_M",
+        "ef_construction": "HNSW_EF_CONSTRUCTION",
+        "ef_search": "HNSW_EF_SEARCH",
+        "pq_m": "PQ_M",
+        "pq_nbits": "PQ_NBITS",
+    }
+    params = {}
+    for name, env_key in env_keys.items():
+        value = os.getenv(env_key)
+        if value:
+            params[name] = int(value)
+    return params
+
+
+def get_vector_storage() -> str:
+    """`float32` (default), `float16` or `sq8` codes for flat / ivf_flat / hnsw indexes."""
+    return os.getenv("VECTOR_STORAGE", "float32").strip().lower()
+
+
+def get_rescore_factor() -> int:
+    """Re-rank RESCORE_FACTOR * k candidates exactly from the float32 copy of a lossy index; 0 disables."""
+    return int(os.getenv("RESCORE_FACTOR", "0"))
+
+
+def get_parse_config() -> dict:
+    """PDF parsing pool: PARSE_WORKERS processes (0 = one per CPU), PARSE_PAGES_PER_TASK pages per task."""
+    return {
+        "workers": int(os.getenv("PARSE_WORKERS", "0")),
+        "pages_per_task": max(1, int(os.getenv("PARSE_PAGES_PER_TASK", "16"))),
+    }
+
+
+def get_embed_build_config() -> dict:
+    """
+    Index builds embed EMBED_BATCH_SIZE chunks per checkpointed batch on
+    EMBED_WORKERS processes (0 = one per CPU), reusing vectors from the
+    embedding cache in EMBED_CACHE_DIR (empty disables it).
+    """
+    return {
+        "batch_size": max(1, int(os.getenv("EMBED_BATCH_SIZE", "256"))),
+        "workers": int(os.getenv("EMBED_WORKERS", "0")),
+        "cache_dir": os.getenv("EMBED_CACHE_DIR", "faiss_index/embedding_cache").strip(),
+    }
+
+
+def get_chunking_config() -> dict:
+    """
+    Corpus chunker: CHUNKER=chars (CHUNK_SIZE characters with OVERLAP) or
+    clauses (clause-aware chunks of at most CHUNK_TOKENS tokens, counted with
+    the TOKENIZER_ENCODING tiktoken encoding).
+    """
+    return {
+        "chunker": os.getenv("CHUNKER", "chars").strip().lower(),
+        "max_tokens": int(os.getenv("CHUNK_TOKENS", "512")),
+        "min_tokens": int(os.getenv("CHUNK_MIN_TOKENS", "128")),
+        "overlap_tokens": int(os.getenv("CHUNK_OVERLAP_TOKENS", "0")),
+        "encoding": os.getenv("TOKENIZER_ENCODING", "cl100k_base"),
+    }
+
+
+def get_dedup_config() -> dict:
+    """
+    Near-duplicate collapsing in the corpus build: chunks whose word-shingle
+    Jaccard similarity reaches DEDUP_THRESHOLD are merged. Off (0) unless
+    set, since near-identical clauses can differ in a number that matters.
+    """
+    return {
+        "threshold": float(os.getenv("DEDUP_THRESHOLD", "0")),
+        "num_perm": int(os.getenv("DEDUP_NUM_PERM", "64")),
+    }
+
+
 def disable_broken_local_proxy() -> None:
     """
     Remove known-bad localhost proxy placeholders that break HF/network calls.
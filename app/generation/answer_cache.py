@@ -0,0 +1,209 @@
+# app/generation/answer_cache.py
+"""
+Answer cache in front of run_rag.
+
+Every answer is scoped to the conversation history (as a digest), the
+retrieval filters, the generation model and the version of the index it was
+retrieved from. Within a scope there are two tiers:
+
+    exact      the question after case and whitespace normalization
+    semantic   the question's query embedding; a cached answer is served
+               when its question's embedding has cosine similarity of at
+               least ANSWER_CACHE_SIMILARITY with the new one (off unless
+               set: MiniLM puts questions about different regulations or
+               categories, "Category I AIF" against "Category II AIF",
+               above 0.95)
+
+The semantic tier reuses the vector the retrieval engine computes for the
+query anyway (and caches, see retrieval/embedding_cache.py), so a miss costs
+one matrix-vector product over the cached questions. Entries are evicted
+least-recently-used beyond ANSWER_CACHE_SIZE and expire after
+ANSWER_CACHE_TTL seconds. When the index version changes, i.e. the index was
+rebuilt or updated, the whole cache is dropped.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Mapping, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from app.retrieval.chunk_store import normalize_filters
+from app.retrieval.embedding_cache import normalize_query
+
+Scope = Tuple[Hashable, ...]
+
+
+def history_digest(history: List[Dict[str, str]]) -> str:
+    if not history:
+        return ""
+    return hashlib.sha256(json.dumps(history, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _unit(vector: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if vector is None:
+        return None
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / (np.linalg.norm(vector) or 1.0)
+
+
+class AnswerLookup(NamedTuple):
+    """Outcome of AnswerCache.lookup, passed back to AnswerCache.store on a miss."""
+
+    result: Optional[Dict[str, Any]]
+    tier: Optional[str]
+    key: Tuple[Scope, str]
+    index_version: str
+    vector: Optional[np.ndarray]
+
+
+class _Entry(NamedTuple):
+    result: Dict[str, Any]
+    vector: Optional[np.ndarray]
+    created: float
+
+
+class AnswerCache:
+    """Thread-safe LRU/TTL cache of run_rag results with exact and semantic lookup."""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0, similarity: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity = similarity
+        self.index_version: Optional[str] = None
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: "OrderedDict[Tuple[Scope, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Unit vectors of the entries that have one, rebuilt after the entries change.
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[Tuple[Scope, str]] = []
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl_seconds > 0 and time.monotonic() - entry.created > self.ttl_seconds
+
+    def _check_version(self, index_version: str) -> None:
+        if index_version != self.index_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+            self.index_version = index_version
+
+    def lookup(
+        self,
+        question: str,
+        history: List[Dict[str, str]],
+        filters: Optional[Mapping[str, Any]],
+        model: str,
+        index_version: str,
+        embed: Optional[Callable[[str], Optional[np.ndarray]]] = None,
+    ) -> AnswerLookup:
+        """
+        The cached result for this question and scope, if any. `embed` gives
+        the question's query embedding (or None when it is unavailable) and is
+        only called when the exact tier misses.
+        """
+        scope = (history_digest(history), normalize_filters(filters), model)
+        key = (scope, normalize_query(question))
+        if not self.enabled:
+            return AnswerLookup(None, None, key, index_version, None)
+
+        with self._lock:
+            self._check_version(index_version)
+            entry = self._live(key)
+            if entry is not None:
+                self.hits["exact"] += 1
+                return AnswerLookup(entry.result, "exact", key, index_version, entry.vector)
+
+        vector = None
+        if self.similarity > 0 and embed is not None:
+            vector = _unit(embed(question))
+
+        with self._lock:
+            if vector is not None:
+                match = self._nearest(scope, vector)
+                if match is not None:
+                    self.hits["semantic"] += 1
+                    return AnswerLookup(match.result, "semantic", key, index_version, vector)
+            self.misses += 1
+        return AnswerLookup(None, None, key, index_version, vector)
+
+    def store(self, lookup: AnswerLookup, result: Dict[str, Any], vector: Optional[np.ndarray] = None) -> None:
+        """
+        Cache `result` under the key of a missed lookup. `vector` is the
+        question's query embedding, for lookups that were made without one.
+        """
+        if not self.enabled or lookup.result is not None:
+            return
+        if lookup.vector is None and self.similarity > 0:
+            vector = _unit(vector)
+        else:
+            vector = lookup.vector
+        with self._lock:
+            if lookup.index_version != self.index_version:
+                # The index changed while this answer was being generated.
+                return
+            self._entries[lookup.key] = _Entry(result, vector, time.monotonic())
+            self._entries.move_to_end(lookup.key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def _live(self, key: Tuple[Scope, str]) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            del self._entries[key]
+            self._matrix = None
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _nearest(self, scope: Scope, vector: np.ndarray) -> Optional[_Entry]:
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry.vector is not None]
+            self._matrix = (
+                np.stack([self._entries[key].vector for key in self._matrix_keys])
+                if self._matrix_keys
+                else np.zeros((0, len(vector)), dtype=np.float32)
+            )
+        if not len(self._matrix_keys) or self._matrix.shape[1] != len(vector):
+            return None
+        similarities = self._matrix @ vector
+        for i in np.argsort(-similarities):
+            if similarities[i] < self.similarity:
+                break
+            key = self._matrix_keys[i]
+            if key[0] != scope:
+                continue
+            entry = self._live(key)
+            if entry is not None:
+                return entry
+        return None
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            hits = sum(self.hits.values())
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "similarity": self.similarity,
+                "index_version": self.index_version,
+                "exact_hits": self.hits["exact"],
+                "semantic_hits": self.hits["semantic"],
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,234 @@
+# app/generation/bench_transport.py
+"""
+Benchmark the pooled HF transport against a fresh connection per request.
+
+Starts a local stub of the HF router chat-completions endpoint (HTTPS with
+a throwaway self-signed certificate when the `openssl` CLI is available,
+plain HTTP otherwise) and sends the same requests two ways: `requests.post`
+per call, as hf_call used to, and through the shared keep-alive pool. It
+reports per-request latency sequentially and from concurrent threads, plus
+how many connections the stub had to accept, i.e. how many TCP/TLS
+handshakes were paid. Then hf_call itself is run against the stub.
+
+Finally the stub is slowed down to a generation-like latency and `requests`
+calls are started at once, through hf_call on `threads` threads and through
+hf_call_async on one event loop, to show how many upstream calls each keeps
+in flight.
+
+    python -m app.generation.bench_transport [requests] [threads] [latency ms]
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from app.generation import hf_llm
+
+COMPLETION = {"choices": [{"message": {"role": "assistant", "content": "Stub answer."}}]}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without TCP_NODELAY,
+    # delayed ACKs add ~40 ms to every kept-alive response.
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        if hasattr(self.request, "do_handshake"):
+            # Handshake on this connection's thread, not in the accept loop.
+            self.request.do_handshake()
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            with self.server.lock:
+                self.server.active += 1
+                self.server.peak = max(self.server.peak, self.server.active)
+            time.sleep(self.server.latency)
+            with self.server.lock:
+                self.server.active -= 1
+        body = json.dumps(COMPLETION).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for every simultaneous connection of the in-flight run.
+    request_queue_size = 1024
+
+
+def _self_signed_cert(directory: Path) -> Optional[Tuple[Path, Path]]:
+    if not shutil.which("openssl"):
+        return None
+    cert, key = directory / "cert.pem", directory / "key.pem"
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+            "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1",
+            "-keyout", str(key), "-out", str(cert),
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+def start_stub(directory: Path) -> Tuple[ThreadingHTTPServer, str, Optional[Path]]:
+    server = _StubServer(("127.0.0.1", 0), _StubHandler)
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.latency = 0.0
+    server.active = server.peak = 0
+    scheme, cert = "http", None
+    pair = _self_signed_cert(directory)
+    if pair is not None:
+        cert, key = pair
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+        scheme = "https"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"{scheme}://localhost:{server.server_address[1]}/v1/chat/completions", cert
+
+
+def _measure(server, post: Callable[[], requests.Response], count: int, threads: int) -> Dict[str, float]:
+    before = server.connections
+
+    def one(_: int) -> float:
+        start = time.perf_counter()
+        response = post()
+        response.raise_for_status()
+        response.json()
+        return (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    if threads == 1:
+        latencies = [one(i) for i in range(count)]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = list(pool.map(one, range(count)))
+    wall = time.perf_counter() - started
+    return {
+        "mean_ms": round(float(np.mean(latencies)), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+        "requests_per_s": round(count / wall, 1),
+        "connections": server.connections - before,
+    }
+
+
+def _in_flight(server, count: int, threads: int) -> List[Dict[str, object]]:
+    """Wall time of `count` simultaneous generations and the most the stub served at once, threaded and async."""
+    prompt = "What are the disclosure requirements?"
+    rows = []
+
+    server.peak = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda _: hf_llm.hf_call(prompt, model="stub/model"), range(count)))
+    rows.append({"caller": f"hf_call, {threads} threads", "wall_s": time.perf_counter() - started, "peak": server.peak})
+
+    async def gather() -> float:
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(hf_llm.hf_call_async(prompt, model="stub/model") for _ in range(count)))
+        finally:
+            await hf_llm.close_async_transport()
+        return time.perf_counter() - started
+
+    server.peak = 0
+    rows.append({"caller": "hf_call_async", "wall_s": asyncio.run(gather()), "peak": server.peak})
+    for row in rows:
+        row["wall_s"] = round(row["wall_s"], 2)
+    return rows
+
+
+def run(count: int = 200, threads: int = 8, latency_ms: int = 500) -> List[Dict[str, object]]:
+    directory = Path(tempfile.mkdtemp(prefix="hf-stub-"))
+    server, url, cert = start_stub(directory)
+    verify = str(cert) if cert else True
+    payload = hf_llm._build_chat_payload("What are the disclosure requirements?", "stub/model")
+    headers = hf_llm._build_headers("stub-key")
+    transport = hf_llm.HFTransport(pool_size=max(threads, 1))
+
+    def fresh() -> requests.Response:
+        return requests.post(url, json=payload, headers=headers, timeout=hf_llm.TIMEOUT, verify=verify)
+
+    def pooled() -> requests.Response:
+        return transport.post(url, json=payload, headers=headers, timeout=hf_llm.TIMEOUT, verify=verify)
+
+    rows = []
+    try:
+        for label, concurrency in (("sequential", 1), (f"{threads} threads", threads)):
+            for name, post in (("new connection", fresh), ("pooled", pooled)):
+                rows.append({"transport": name, "load": label, **_measure(server, post, count, concurrency)})
+
+        # End to end through hf_call on the shared transport.
+        os.environ.setdefault("HF_API_KEY", "stub-key")
+        if cert:
+            os.environ["REQUESTS_CA_BUNDLE"] = str(cert)
+            os.environ["SSL_CERT_FILE"] = str(cert)
+        hf_llm.HF_CHAT_URL = url
+        before = server.connections
+        started = time.perf_counter()
+        for _ in range(count):
+            answer = hf_llm.hf_call("What are the disclosure requirements?", model="stub/model")
+        elapsed = (time.perf_counter() - started) * 1000 / count
+        rows.append(
+            {
+                "transport": "hf_call",
+                "load": "sequential",
+                "mean_ms": round(elapsed, 3),
+                "connections": server.connections - before,
+                "answer": answer,
+            }
+        )
+
+        server.latency = latency_ms / 1000
+        in_flight = _in_flight(server, count, threads)
+    finally:
+        transport.close()
+        server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"Stub: {url} ({count} requests per row)")
+    print(f"{'transport':<16}{'load':<12}{'mean ms':>9}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}{'conns':>7}")
+    for row in rows:
+        print(
+            f"{row['transport']:<16}{row['load']:<12}{row['mean_ms']:>9}{row.get('p50_ms', ''):>9}"
+            f"{row.get('p99_ms', ''):>9}{row.get('requests_per_s', ''):>9}{row['connections']:>7}"
+        )
+    print(f"\n{count} simultaneous calls, {latency_ms} ms upstream latency")
+    print(f"{'caller':<22}{'wall s':>9}{'peak in flight':>16}")
+    for row in in_flight:
+        print(f"{row['caller']:<22}{row['wall_s']:>9}{row['peak']:>16}")
+    return rows + in_flight
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:4]]
+    run(*args)
@@ -0,0 +1,215 @@
+# app/generation/circuit_breaker.py
+"""
+Circuit breaker and per-request deadline for the generation provider.
+
+The breaker watches the outcomes of recent upstream calls (the last
+HF_BREAKER_WINDOW seconds). Once at least HF_BREAKER_MIN_CALLS have been
+made, it opens when the share of failed calls reaches HF_BREAKER_ERROR_RATE
+or the share of calls slower than HF_BREAKER_SLOW_SECONDS reaches
+HF_BREAKER_SLOW_RATE. While open, calls are refused outright, so requests
+go straight to the local fallback. After the open interval one probe call
+is let through (half-open): success closes the breaker, failure opens it
+again for twice as long, up to HF_BREAKER_MAX_OPEN_SECONDS. Open intervals
+and retry delays are jittered so that workers do not probe and retry in
+lockstep.
+
+allow() hands out a Permit that the caller passes back to record(). Every
+state change starts a new generation, and outcomes are only counted for
+permits of the current one: a slow call admitted before the breaker opened
+can neither close nor re-open it, and in half-open only the probe decides.
+
+A Deadline bounds the total time one request spends on the provider across
+all its attempts (HF_DEADLINE seconds; unbounded unless set).
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, NamedTuple, Optional, Tuple
+
+from app.config import get_hf_breaker_config
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**(attempt - 1))]."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class Deadline:
+    """Time budget of one request; None seconds means unbounded."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.expires = time.monotonic() + seconds if seconds else None
+
+    @property
+    def remaining(self) -> float:
+        if self.expires is None:
+            return float("inf")
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining <= 0
+
+    def timeout(self, limit: float) -> float:
+        """A per-call timeout of at most `limit` that ends by the deadline."""
+        return min(limit, self.remaining)
+
+
+class Permit(NamedTuple):
+    """Admission of one call by CircuitBreaker.allow, passed back to record."""
+
+    generation: int
+    # Sequence number of the half-open probe this call is; 0 for ordinary calls.
+    probe: int = 0
+
+
+class CircuitBreaker:
+    """Thread-safe closed / open / half-open breaker over a sliding window of call outcomes."""
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60.0,
+        min_calls: int = 5,
+        error_rate: float = 0.5,
+        slow_seconds: float = 20.0,
+        slow_rate: float = 0.5,
+        open_seconds: float = 5.0,
+        max_open_seconds: float = 120.0,
+        probe_timeout: float = 60.0,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_timeout = probe_timeout
+        self.state = CLOSED
+        self.trips = 0
+        self.rejected = 0
+        self._opened_until = 0.0
+        self._generation = 0
+        self._probes = 0
+        self._probe_started: Optional[float] = None
+        # (finished at, succeeded, latency seconds)
+        self._calls: Deque[Tuple[float, bool, float]] = deque()
+        self._lock = threading.Lock()
+
+    def allow(self) -> Optional[Permit]:
+        """A permit when a call may go upstream now, else None. In half-open, only one probe at a time."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now >= self._opened_until:
+                self._enter(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # A probe whose outcome never arrived stops blocking after probe_timeout.
+                if self._probe_started is None or now - self._probe_started > self.probe_timeout:
+                    self._probe_started = now
+                    self._probes += 1
+                    return Permit(self._generation, self._probes)
+            elif self.state == CLOSED:
+                return Permit(self._generation)
+            self.rejected += 1
+            return None
+
+    def release(self, permit: Permit) -> None:
+        """Give up a permit without an outcome, e.g. when the caller went away; a probe can then go again."""
+        with self._lock:
+            if self._is_probe(permit):
+                self._probe_started = None
+
+    def record(self, permit: Permit, ok: bool, latency: float) -> None:
+        with self._lock:
+            if permit.generation != self._generation:
+                # Admitted before the last state change: its outcome says nothing about the current state.
+                return
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                if not self._is_probe(permit):
+                    return
+                if ok and latency < self.slow_seconds:
+                    self._enter(CLOSED)
+                    self.trips = 0
+                else:
+                    self._open(now)
+                return
+            if self.state == OPEN:
+                return
+            self._calls.append((now, ok, latency))
+            while self._calls and now - self._calls[0][0] > self.window_seconds:
+                self._calls.popleft()
+            if len(self._calls) < self.min_calls:
+                return
+            errors = sum(1 for _, succeeded, _ in self._calls if not succeeded)
+            slow = sum(1 for _, _, took in self._calls if took >= self.slow_seconds)
+            too_many_errors = self.error_rate > 0 and errors >= self.error_rate * len(self._calls)
+            too_slow = self.slow_rate > 0 and slow >= self.slow_rate * len(self._calls)
+            if too_many_errors or too_slow:
+                self._open(now)
+
+    def _is_probe(self, permit: Permit) -> bool:
+        return (
+            self.state == HALF_OPEN
+            and permit.generation == self._generation
+            and permit.probe == self._probes
+            and self._probe_started is not None
+        )
+
+    def _enter(self, state: str) -> None:
+        self.state = state
+        self._generation += 1
+        self._probe_started = None
+        self._calls.clear()
+
+    def _open(self, now: float) -> None:
+        self.trips += 1
+        interval = min(self.max_open_seconds, self.open_seconds * 2 ** (self.trips - 1))
+        self._enter(OPEN)
+        self._opened_until = now + random.uniform(0.5, 1.0) * interval
+        print(f"[CircuitBreaker] {self.name} open for {self._opened_until - now:.1f}s (trip {self.trips}).")
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "name": self.name,
+                "state": self.state,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "window_calls": len(self._calls),
+                "open_for_seconds": max(0.0, round(self._opened_until - time.monotonic(), 3)) if self.state == OPEN else 0.0,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """The breaker of one upstream (e.g. one model), configured from the environment."""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            config = get_hf_breaker_config()
+            breaker = _breakers[name] = CircuitBreaker(
+                name,
+                window_seconds=config["window_seconds"],
+                min_calls=config["min_calls"],
+                error_rate=config["error_rate"],
+                slow_seconds=config["slow_seconds"],
+                slow_rate=config["slow_rate"],
+                open_seconds=config["open_seconds"],
+                max_open_seconds=config["max_open_seconds"],
+            )
+        return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, Dict[str, object]]:
+    with _breakers_lock:
+        return {name: breaker.stats() for name, breaker in _breakers.items()}
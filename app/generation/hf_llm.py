@@ -1,16 +1,131 @@
-﻿import re
+﻿import asyncio
+import json
+import re
+import threading
 import time
-from typing import Optional
+import weakref
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 
+import httpx
 import requests
-from huggingface_hub import InferenceClient
-
-from app.config import disable_broken_local_proxy, get_hf_key, get_hf_model
+from huggingface_hub import AsyncInferenceClient, InferenceClient
+from requests.adapters import HTTPAdapter
+
+from app.config import (
+    disable_broken_local_proxy,
+    get_hf_breaker_config,
+    get_hf_http_config,
+    get_hf_key,
+    get_hf_model,
+)
+from app.generation.circuit_breaker import Deadline, Permit, backoff_delay, get_circuit_breaker
 
 HF_CHAT_URL = "https://router.huggingface.co/v1/chat/completions"
 HF_INFERENCE_URL = "https://router.huggingface.co/hf-inference/models/{model}"
 MAX_RETRIES = 3
 TIMEOUT = 60
+# Full-jitter exponential backoff between attempts: up to 0.5 s, 1 s, 2 s, ... capped at 8 s.
+RETRY_BACKOFF_BASE = 0.5
+RETRY_BACKOFF_MAX = 8.0
+
+
+class HFTransport:
+    """
+    Keep-alive HTTP connection pool for the HF router, shared by all threads.
+
+    Every thread gets its own requests.Session (sessions carry mutable state
+    such as cookies), but all sessions mount the same HTTPAdapter, whose
+    urllib3 pools are thread-safe. A connection opened by one request is
+    returned to the pool and reused by the next one on any thread, so only
+    the first few requests pay for the TCP and TLS handshakes.
+    """
+
+    def __init__(self, pool_size: int = 16, pool_block: bool = False):
+        # Retries stay in hf_call, which also decides when to fall back.
+        self.adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=pool_block, max_retries=0)
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self._local.session = session
+        return session
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.session.post(url, **kwargs)
+
+    def close(self) -> None:
+        self.adapter.close()
+
+
+@lru_cache(maxsize=1)
+def get_transport() -> HFTransport:
+    config = get_hf_http_config()
+    return HFTransport(config["pool_size"], config["pool_block"])
+
+
+class AsyncHFTransport:
+    """
+    Keep-alive httpx.AsyncClient for the HF router, used from an event loop.
+
+    A call waiting on the upstream holds no thread, so one process can keep
+    up to `max_connections` generations in flight; `keepalive` of those
+    connections stay open between calls. httpx clients are bound to the
+    event loop they first ran on, so each loop gets its own transport (see
+    get_async_transport).
+    """
+
+    def __init__(self, max_connections: int = 256, keepalive: int = 16):
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=keepalive),
+            timeout=TIMEOUT,
+        )
+        self._inference_clients: Dict[Tuple[str, str], AsyncInferenceClient] = {}
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.client.post(url, **kwargs)
+
+    def stream(self, url: str, **kwargs):
+        """POST whose response body is read incrementally; use as `async with`."""
+        return self.client.stream("POST", url, **kwargs)
+
+    def inference_client(self, model: str, api_key: str) -> AsyncInferenceClient:
+        key = (model, api_key)
+        client = self._inference_clients.get(key)
+        if client is None:
+            client = self._inference_clients[key] = AsyncInferenceClient(model=model, token=api_key, timeout=TIMEOUT)
+        return client
+
+    async def aclose(self) -> None:
+        for client in self._inference_clients.values():
+            await client.close()
+        self._inference_clients.clear()
+        await self.client.aclose()
+
+
+_async_transports: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncHFTransport]" = weakref.WeakKeyDictionary()
+
+
+def get_async_transport() -> AsyncHFTransport:
+    """The AsyncHFTransport of the running event loop."""
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        config = get_hf_http_config()
+        transport = _async_transports[loop] = AsyncHFTransport(config["max_connections"], config["pool_size"])
+    return transport
+
+
+async def close_async_transport() -> None:
+    """Close the running loop's transport, e.g. on API server shutdown."""
+    transport = _async_transports.pop(asyncio.get_running_loop(), None)
+    if transport is not None:
+        await transport.aclose()
 
 
 def _build_headers(api_key: str) -> dict:
@@ -45,10 +160,29 @@ def _extract_chat_text(data) -> str:
     raise RuntimeError(f"Unexpected Hugging Face chat response shape: {data}")
 
 
-def _hf_inference_generation(prompt: str, model: str, api_key: str) -> str:
-    """Run text generation via Hugging Face SDK for text2text models like FLAN."""
-    client = InferenceClient(model=model, token=api_key)
-    text = client.text_generation(
+def _hf_inference_generation(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> str:
+    """
+    Run text generation via Hugging Face SDK for text2text models like FLAN.
+    The client is made per call so that it carries the request's remaining
+    deadline as its timeout; it is cheap, and its connections come from the
+    SDK's shared session.
+    """
+    with InferenceClient(model=model, token=api_key, timeout=timeout) as client:
+        text = client.text_generation(
+            prompt,
+            max_new_tokens=700,
+            temperature=0.2,
+            return_full_text=False,
+        )
+    if not isinstance(text, str):
+        raise RuntimeError(f"Unexpected HF SDK response shape: {text}")
+    return text
+
+
+async def _hf_inference_generation_async(prompt: str, model: str, api_key: str) -> str:
+    """_hf_inference_generation on the async SDK client."""
+    client = get_async_transport().inference_client(model, api_key)
+    text = await client.text_generation(
         prompt,
         max_new_tokens=700,
         temperature=0.2,
@@ -59,10 +193,9 @@ def _hf_inference_generation(prompt: str, model: str, api_key: str) -> str:
     return text
 
 
-def _hf_inference_generation_http(prompt: str, model: str, api_key: str) -> str:
-    """Run text generation via HF router inference endpoint (SDK fallback)."""
-    url = HF_INFERENCE_URL.format(model=model)
-    payload = {
+def _build_inference_payload(prompt: str) -> dict:
+    """Text-generation payload for the HF router inference endpoint."""
+    return {
         "inputs": prompt,
         "parameters": {
             "temperature": 0.2,
@@ -74,12 +207,9 @@ def _hf_inference_generation_http(prompt: str, model: str, api_key: str) -> str:
             "use_cache": True,
         },
     }
-    headers = _build_headers(api_key)
-    response = requests.post(url, json=payload, headers=headers, timeout=TIMEOUT)
-    if response.status_code != 200:
-        raise RuntimeError(f"HF inference HTTP {response.status_code}: {response.text}")
 
-    data = response.json()
+
+def _extract_generated_text(data) -> str:
     if isinstance(data, list) and data and isinstance(data[0], dict):
         generated = data[0].get("generated_text")
         if isinstance(generated, str):
@@ -95,6 +225,217 @@ def _hf_inference_generation_http(prompt: str, model: str, api_key: str) -> str:
     raise RuntimeError(f"Unexpected HF inference response shape: {data}")
 
 
+def _hf_inference_generation_http(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> str:
+    """Run text generation via HF router inference endpoint (SDK fallback)."""
+    url = HF_INFERENCE_URL.format(model=model)
+    payload = _build_inference_payload(prompt)
+    headers = _build_headers(api_key)
+    response = get_transport().post(url, json=payload, headers=headers, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"HF inference HTTP {response.status_code}: {response.text}")
+    return _extract_generated_text(response.json())
+
+
+async def _hf_inference_generation_http_async(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> str:
+    """_hf_inference_generation_http on the async transport."""
+    url = HF_INFERENCE_URL.format(model=model)
+    payload = _build_inference_payload(prompt)
+    headers = _build_headers(api_key)
+    response = await get_async_transport().post(url, json=payload, headers=headers, timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"HF inference HTTP {response.status_code}: {response.text}")
+    return _extract_generated_text(response.json())
+
+
+def _chat_completion(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> str:
+    """One chat completion through the HF router."""
+    payload = _build_chat_payload(prompt, model)
+    response = get_transport().post(HF_CHAT_URL, json=payload, headers=_build_headers(api_key), timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"Upstream error -> HTTP {response.status_code}: {response.text}")
+    return _extract_chat_text(response.json())
+
+
+async def _chat_completion_async(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> str:
+    """_chat_completion on the async transport."""
+    payload = _build_chat_payload(prompt, model)
+    response = await get_async_transport().post(HF_CHAT_URL, json=payload, headers=_build_headers(api_key), timeout=timeout)
+    if response.status_code != 200:
+        raise RuntimeError(f"Upstream error -> HTTP {response.status_code}: {response.text}")
+    return _extract_chat_text(response.json())
+
+
+async def _chat_completion_stream(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> AsyncIterator[str]:
+    """Content deltas of a streamed chat completion (OpenAI-style server-sent events)."""
+    payload = {**_build_chat_payload(prompt, model), "stream": True}
+    headers = _build_headers(api_key)
+    async with get_async_transport().stream(HF_CHAT_URL, json=payload, headers=headers, timeout=timeout) as response:
+        if response.status_code != 200:
+            body = (await response.aread()).decode("utf-8", "replace")
+            raise RuntimeError(f"HTTP {response.status_code}: {body}")
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                return
+            event = json.loads(data)
+            if isinstance(event, dict) and "error" in event:
+                raise RuntimeError(f"Hugging Face API error: {event['error']}")
+            for choice in event.get("choices") or []:
+                content = (choice.get("delta") or {}).get("content")
+                if content:
+                    yield content
+
+
+async def _text_generation_stream(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> AsyncIterator[str]:
+    """Tokens of _hf_inference_generation_async as the SDK receives them."""
+    client = get_async_transport().inference_client(model, api_key)
+    tokens = await asyncio.wait_for(
+        client.text_generation(
+            prompt,
+            max_new_tokens=700,
+            temperature=0.2,
+            return_full_text=False,
+            stream=True,
+        ),
+        timeout,
+    )
+    async for token in tokens:
+        yield token
+
+
+async def _text_generation_http_stream(prompt: str, model: str, api_key: str, timeout: float = TIMEOUT) -> AsyncIterator[str]:
+    """The inference endpoint does not stream; its whole answer is one piece."""
+    yield await _hf_inference_generation_http_async(prompt, model, api_key, timeout)
+
+
+class _Attempts:
+    """
+    The upstream attempts of one request. Each must be admitted by the
+    model's circuit breaker and start before the request's deadline, and
+    waits between attempts back off exponentially with jitter.
+    """
+
+    def __init__(self, model: str):
+        self.model = model
+        self.breaker = get_circuit_breaker(model)
+        self.deadline = Deadline(get_hf_breaker_config()["deadline_seconds"])
+        # Why an attempt was not allowed upstream; the request then falls back at once.
+        self.refused: Optional[str] = None
+        # The breaker's permit for the attempt in progress.
+        self.permit: Optional[Permit] = None
+
+    def admit(self) -> bool:
+        if self.deadline.expired:
+            self.refused = f"Request deadline exceeded for model '{self.model}'"
+        else:
+            self.permit = self.breaker.allow()
+            if self.permit is None:
+                self.refused = f"Circuit breaker open for model '{self.model}'"
+        return self.refused is None
+
+    def timeout(self) -> float:
+        return self.deadline.timeout(TIMEOUT)
+
+    def backoff(self, attempt: int) -> Optional[float]:
+        """Wait before the attempt after `attempt`; None when none is left or it would not fit the deadline."""
+        if attempt >= MAX_RETRIES:
+            return None
+        delay = backoff_delay(attempt, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX)
+        return delay if delay < self.deadline.remaining else None
+
+    def succeeded(self, started: float) -> None:
+        self.breaker.record(self.permit, True, time.monotonic() - started)
+
+    def abandoned(self) -> None:
+        """The attempt ended without an outcome, e.g. the client disconnected."""
+        self.breaker.release(self.permit)
+
+    def failed(self, label: str, attempt: int, started: float, exc: Exception) -> None:
+        self.breaker.record(self.permit, False, time.monotonic() - started)
+        print(
+            f"[HuggingFace] {label} error (attempt {attempt}/{MAX_RETRIES}) "
+            f"for model '{self.model}': {type(exc).__name__}: {exc!r}"
+        )
+
+
+class _StreamUnavailable(Exception):
+    """No attempt of a stream produced any text."""
+
+
+if hasattr(asyncio, "timeout"):
+
+    async def _next_piece(stream: AsyncIterator[str], timeout: float) -> str:
+        # A timer on the current task instead of the task per piece that
+        # wait_for starts. The scope must not span the caller's yield: the
+        # consumer runs on this task between pieces and would be cancelled.
+        async with asyncio.timeout(timeout):
+            return await stream.__anext__()
+
+else:  # Python 3.10
+
+    async def _next_piece(stream: AsyncIterator[str], timeout: float) -> str:
+        return await asyncio.wait_for(stream.__anext__(), timeout)
+
+
+async def _retrying_stream(
+    open_stream: Callable[[float], AsyncIterator[str]],
+    label: str,
+    attempts: _Attempts,
+) -> AsyncIterator[str]:
+    """
+    Pieces of the first attempt at `open_stream` that gets going. Failures
+    before the first piece are retried as in hf_call; once text has been
+    sent the caller cannot take it back, so later failures propagate.
+
+    Every piece must arrive within the attempt timeout and before the
+    request's deadline, so a stalled stream is cut off like any other slow
+    call. The breaker is told the outcome when the stream ends, with its
+    whole duration.
+    """
+    for attempt in range(1, MAX_RETRIES + 1):
+        if not attempts.admit():
+            break
+        started = time.monotonic()
+        sent = False
+        stream = open_stream(attempts.timeout())
+        try:
+            while True:
+                try:
+                    piece = await _next_piece(stream, attempts.timeout())
+                except StopAsyncIteration:
+                    break
+                sent = True
+                yield piece
+        except Exception as exc:
+            attempts.failed(label, attempt, started, exc)
+            if sent:
+                raise
+        except BaseException:
+            # The consumer went away (disconnect, cancellation); the upstream was fine so far.
+            if sent:
+                attempts.succeeded(started)
+            else:
+                attempts.abandoned()
+            raise
+        else:
+            attempts.succeeded(started)
+            return
+        finally:
+            await stream.aclose()
+        delay = attempts.backoff(attempt)
+        if delay is None:
+            break
+        await asyncio.sleep(delay)
+    raise _StreamUnavailable(label)
+
+
+def _text_pieces(text: str) -> List[str]:
+    """Words of `text` with their trailing whitespace; joined they give back `text`."""
+    return [piece for piece in re.findall(r"\S*\s*", text) if piece]
+
+
 def _local_rag_fallback(prompt: str, reason: str) -> str:
     """Generate a deterministic retrieval-only answer when remote LLM calls fail."""
     pattern = re.compile(
@@ -136,8 +477,17 @@ def _local_rag_fallback(prompt: str, reason: str) -> str:
     return "\n".join(lines)
 
 
+def is_fallback_answer(answer: str) -> bool:
+    """Whether `answer` was produced by _local_rag_fallback rather than the LLM."""
+    return "Generation provider unavailable" in answer or "Failure detail:" in answer
+
+
 def hf_call(prompt: str, model: Optional[str] = None) -> str:
-    """Execute a Hugging Face request with retries and local fallback."""
+    """
+    Execute a Hugging Face request with retries and local fallback. Attempts
+    pass the model's circuit breaker and share one HF_DEADLINE, so while the
+    provider is known to be failing the fallback comes back at once.
+    """
     disable_broken_local_proxy()
     model = model or get_hf_model()
 
@@ -146,74 +496,120 @@ def hf_call(prompt: str, model: Optional[str] = None) -> str:
     except Exception as exc:
         return _local_rag_fallback(prompt, f"Missing HF key: {exc}")
 
-    use_sdk_inference = model.lower().startswith("google/flan-")
-
-    if use_sdk_inference:
+    if model.lower().startswith("google/flan-"):
+        sources = [
+            ("SDK", lambda timeout: _hf_inference_generation(prompt, model, api_key, timeout)),
+            ("HTTP inference fallback", lambda timeout: _hf_inference_generation_http(prompt, model, api_key, timeout)),
+        ]
+        reason = f"FLAN inference unavailable for model '{model}'"
+    else:
+        sources = [("Chat completion", lambda timeout: _chat_completion(prompt, model, api_key, timeout))]
+        reason = f"Chat completion unavailable for model '{model}'"
+
+    attempts = _Attempts(model)
+    for label, call in sources:
         for attempt in range(1, MAX_RETRIES + 1):
+            if not attempts.admit():
+                return _local_rag_fallback(prompt, attempts.refused)
+            started = time.monotonic()
             try:
-                return _hf_inference_generation(prompt, model, api_key)
+                text = call(attempts.timeout())
             except Exception as exc:
-                print(
-                    f"[HuggingFace] SDK error (attempt {attempt}/{MAX_RETRIES}) "
-                    f"for model '{model}': {type(exc).__name__}: {exc!r}"
-                )
-                if attempt < MAX_RETRIES:
-                    time.sleep(1)
+                attempts.failed(label, attempt, started, exc)
+            else:
+                attempts.succeeded(started)
+                return text
+            delay = attempts.backoff(attempt)
+            if delay is None:
+                break
+            time.sleep(delay)
+
+    return _local_rag_fallback(prompt, reason)
+
+
+async def hf_call_async(prompt: str, model: Optional[str] = None) -> str:
+    """
+    hf_call for the event loop: the same breaker, deadline, retries and
+    local fallback, but upstream calls go through the loop's
+    AsyncHFTransport and retry waits use asyncio.sleep, so no thread is held
+    while generation is pending.
+    """
+    disable_broken_local_proxy()
+    model = model or get_hf_model()
+
+    try:
+        api_key = get_hf_key()
+    except Exception as exc:
+        return _local_rag_fallback(prompt, f"Missing HF key: {exc}")
 
+    if model.lower().startswith("google/flan-"):
+        sources = [
+            ("SDK", lambda timeout: asyncio.wait_for(_hf_inference_generation_async(prompt, model, api_key), timeout)),
+            ("HTTP inference fallback", lambda timeout: _hf_inference_generation_http_async(prompt, model, api_key, timeout)),
+        ]
+        reason = f"FLAN inference unavailable for model '{model}'"
+    else:
+        sources = [("Chat completion", lambda timeout: _chat_completion_async(prompt, model, api_key, timeout))]
+        reason = f"Chat completion unavailable for model '{model}'"
+
+    attempts = _Attempts(model)
+    for label, call in sources:
         for attempt in range(1, MAX_RETRIES + 1):
+            if not attempts.admit():
+                return _local_rag_fallback(prompt, attempts.refused)
+            started = time.monotonic()
             try:
-                return _hf_inference_generation_http(prompt, model, api_key)
+                text = await call(attempts.timeout())
             except Exception as exc:
-                print(
-                    f"[HuggingFace] HTTP inference fallback error "
-                    f"(attempt {attempt}/{MAX_RETRIES}) for model '{model}': "
-                    f"{type(exc).__name__}: {exc!r}"
-                )
-                if attempt < MAX_RETRIES:
-                    time.sleep(1)
-
-        return _local_rag_fallback(
-            prompt,
-            f"FLAN inference unavailable for model '{model}'",
-        )
-
-    headers = _build_headers(api_key)
-    payload = _build_chat_payload(prompt, model)
+                attempts.failed(label, attempt, started, exc)
+            else:
+                attempts.succeeded(started)
+                return text
+            delay = attempts.backoff(attempt)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+
+    return _local_rag_fallback(prompt, reason)
+
+
+async def hf_stream_async(prompt: str, model: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    hf_call_async as a stream of answer text. Chat models stream deltas from
+    the router and FLAN models stream tokens from the SDK, falling back to
+    the (non-streaming) inference endpoint; when all of them fail or are
+    refused by the breaker or deadline before producing text, the local
+    fallback answer is streamed word by word.
+    """
+    disable_broken_local_proxy()
+    model = model or get_hf_model()
 
-    for attempt in range(1, MAX_RETRIES + 1):
+    try:
+        api_key = get_hf_key()
+    except Exception as exc:
+        for piece in _text_pieces(_local_rag_fallback(prompt, f"Missing HF key: {exc}")):
+            yield piece
+        return
+
+    if model.lower().startswith("google/flan-"):
+        sources = [
+            ("SDK", lambda timeout: _text_generation_stream(prompt, model, api_key, timeout)),
+            ("HTTP inference fallback", lambda timeout: _text_generation_http_stream(prompt, model, api_key, timeout)),
+        ]
+        reason = f"FLAN inference unavailable for model '{model}'"
+    else:
+        sources = [("Chat stream", lambda timeout: _chat_completion_stream(prompt, model, api_key, timeout))]
+        reason = f"Chat completion unavailable for model '{model}'"
+
+    attempts = _Attempts(model)
+    for label, open_stream in sources:
         try:
-            response = requests.post(
-                HF_CHAT_URL,
-                json=payload,
-                headers=headers,
-                timeout=TIMEOUT,
-            )
-
-            if response.status_code == 200:
-                data = response.json()
-                return _extract_chat_text(data)
-
-            print(
-                f"[HuggingFace] Upstream error (attempt {attempt}/{MAX_RETRIES}) "
-                f"-> HTTP {response.status_code}: {response.text}"
-            )
-
-        except requests.exceptions.Timeout:
-            print(
-                f"[HuggingFace] Timeout exception on attempt {attempt}/{MAX_RETRIES}. "
-                "Network latency exceeded the configured timeout."
-            )
-
-        except requests.exceptions.RequestException as exc:
-            print(
-                f"[HuggingFace] Transport-layer exception on attempt "
-                f"{attempt}/{MAX_RETRIES}: {exc}"
-            )
-
-        if attempt < MAX_RETRIES:
-            time.sleep(1)
-
-    return _local_rag_fallback(
-        prompt,
-        f"Chat completion unavailable for model '{model}'",
-    )
+            async for piece in _retrying_stream(open_stream, label, attempts):
+                yield piece
+            return
+        except _StreamUnavailable:
+            if attempts.refused:
+                break
+
+    for piece in _text_pieces(_local_rag_fallback(prompt, attempts.refused or reason)):
+        yield piece
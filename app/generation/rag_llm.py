@@ -1,18 +1,31 @@
-﻿import json
-import re
-import math
+﻿import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import lru_cache
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, List, Mapping, Optional, Tuple, Union
 
-from app.generation.hf_llm import hf_call
-from app.retrieval.lc_rag_engine import LangChainRAGEngine
+import numpy as np
+
+from app.config import get_answer_cache_config, get_hf_model, get_rag_engine_backend, get_retrieval_workers
+from app.generation.answer_cache import AnswerCache, AnswerLookup
+from app.generation.hf_llm import hf_call, hf_call_async, hf_stream_async, is_fallback_answer
+from app.retrieval.chunk_features import tokenize
+from app.retrieval.chunk_store import FACET_COLUMNS
+from app.retrieval.index_update import MANIFEST_FILE as INDEX_MANIFEST_FILE
+from app.retrieval.keyword_index import KEYWORD_INDEX_DIR, KeywordIndex, load_keyword_index
+from app.retrieval.lc_rag_engine import INDEX_DIR, LangChainRAGEngine
+from app.retrieval.native_engine import NativeRAGEngine
+from app.retrieval.shards import SHARD_DIR, SHARDS_FILE, ShardedKeywordIndex, ShardedRAGEngine, ShardSet
 
 CORPUS_PATH = Path("data/data_processed/corpus.jsonl")
 RETRIEVE_TOP_K = 12
 MAX_CONTEXTS_FOR_ANSWER = 1
 MIN_SIMILARITY_SCORE = 0.40
 MIN_FINAL_CONFIDENCE = 0.55
+NOT_COVERED_ANSWER = "The referenced SEBI documents do not cover this information."
 
 QUERY_EXPANSIONS = {
     "disclosure": {"disclosures", "disclose", "reporting", "material"},
@@ -31,82 +44,90 @@ INTENT_GROUPS = [
 
 
 @lru_cache(maxsize=1)
-def get_rag_engine() -> LangChainRAGEngine:
+def get_rag_engine() -> Union[LangChainRAGEngine, NativeRAGEngine, ShardedRAGEngine]:
     """Reuse the loaded retriever across requests."""
+    backend = get_rag_engine_backend()
+    if backend == "native":
+        return NativeRAGEngine(top_k=RETRIEVE_TOP_K)
+    if backend == "sharded":
+        return ShardedRAGEngine(top_k=RETRIEVE_TOP_K, shards=_shard_set())
     return LangChainRAGEngine(top_k=RETRIEVE_TOP_K)
 
 
 @lru_cache(maxsize=1)
-def _load_corpus() -> List[Dict[str, str]]:
-    if not CORPUS_PATH.exists():
-        return []
+def _shard_set() -> ShardSet:
+    """Vector and keyword search share one set of loaded shards."""
+    return ShardSet()
+
+
+@lru_cache(maxsize=1)
+def _keyword_index() -> Union[KeywordIndex, ShardedKeywordIndex]:
+    """Map the persisted keyword index once; every keyword query reuses it."""
+    if get_rag_engine_backend() == "sharded":
+        return ShardedKeywordIndex(_shard_set())
+    return load_keyword_index(CORPUS_PATH)
 
-    rows: List[Dict[str, str]] = []
-    with CORPUS_PATH.open("r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                obj = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-            rows.append(obj)
-    return rows
+
+@lru_cache(maxsize=1)
+def _retrieval_pool() -> ThreadPoolExecutor:
+    """Threads run_rag_async runs retrieval on, off the event loop."""
+    workers = get_retrieval_workers() or os.cpu_count() or 1
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieval")
 
 
 @lru_cache(maxsize=1)
-def _idf_map() -> Dict[str, float]:
-    rows = _load_corpus()
-    total_docs = max(1, len(rows))
-    doc_freq: Dict[str, int] = {}
+def get_answer_cache() -> AnswerCache:
+    config = get_answer_cache_config()
+    return AnswerCache(config["max_entries"], config["ttl_seconds"], config["similarity"])
 
-    for row in rows:
-        tokens = _tokenize(str(row.get("text", "")))
-        for token in tokens:
-            doc_freq[token] = doc_freq.get(token, 0) + 1
 
-    idf: Dict[str, float] = {}
-    for token, df in doc_freq.items():
-        # Smoothed BM25-style IDF.
-        idf[token] = math.log((1.0 + total_docs - df + 0.5) / (df + 0.5) + 1.0)
+def index_version() -> str:
+    """
+    Fingerprint of the manifests of the indexes the retrievers read. Every
+    index build or update rewrites them, which invalidates the answer cache.
+    """
+    if get_rag_engine_backend() == "sharded":
+        paths = [SHARD_DIR / SHARDS_FILE]
+    else:
+        paths = [INDEX_DIR / INDEX_MANIFEST_FILE, KEYWORD_INDEX_DIR / "manifest.json"]
+    parts = []
+    for path in paths:
+        try:
+            stat = path.stat()
+            parts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append(f"{path}:missing")
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:16]
 
-    return idf
 
+def answer_cache_stats() -> Dict[str, Any]:
+    return get_answer_cache().stats()
 
-def _tokenize(text: str) -> set[str]:
-    return {t for t in re.findall(r"[a-z0-9]+", text.lower()) if len(t) > 2}
 
+def query_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters of the loaded engine's query-embedding cache."""
+    if get_rag_engine.cache_info().currsize == 0:
+        return {"loaded": False}
+    return {"loaded": True, **get_rag_engine().query_cache.stats()}
 
-def _normalize_for_scoring(text: str) -> str:
-    cleaned = text
-    cleaned = re.sub(
-        r"listing\s+obligations\s+and\s+disclosure\s+requirements",
-        " ",
-        cleaned,
-        flags=re.IGNORECASE,
-    )
-    cleaned = re.sub(
-        r"securities\s+and\s+exchange\s+board\s+of\s+india",
-        " ",
-        cleaned,
-        flags=re.IGNORECASE,
-    )
-    cleaned = re.sub(
-        r"(Inserted|Substituted|Omitted)\s+by\s+the\s+Securities\s+and\s+Exchange\s+Board\s+of\s+India.*?(?=\n|$)",
-        " ",
-        cleaned,
-        flags=re.IGNORECASE,
-    )
-    cleaned = re.sub(r"w\.e\.f\.\s*[0-9./-]+", " ", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"\bPrior to the (substitution|omission).*(?=\n|$)", " ", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"\s+", " ", cleaned)
-    return cleaned.strip()
+
+def filter_values() -> Dict[str, List[str]]:
+    """Values accepted by the doc_type / source_file retrieval filters."""
+    facets = _keyword_index().facets
+    return {column: facets.values(column) for column in FACET_COLUMNS}
+
+
+def warm_up() -> None:
+    """Load request-path artifacts ahead of the first query."""
+    _keyword_index()
 
 
 def _expand_query_tokens(question: str) -> set[str]:
-    base = _tokenize(question)
+    base = tokenize(question)
     expanded = set(base)
     for token in list(base):
         for extra in QUERY_EXPANSIONS.get(token, set()):
-            expanded.update(_tokenize(extra))
+            expanded.update(tokenize(extra))
     return expanded
 
 
@@ -123,22 +144,23 @@ def _normalize_score(score: Any) -> float:
 
 
 def _rerank_contexts(question: str, contexts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    q_tokens_base = _tokenize(question)
+    q_tokens_base = tokenize(question)
     q_tokens_expanded = _expand_query_tokens(question)
+    features = _keyword_index().features
+    q_l = question.lower().strip()
     ranked: List[Dict[str, Any]] = []
 
     for row in contexts:
-        text = str(row.get("text", ""))
-        score_text = _normalize_for_scoring(text)
-        t_tokens = _tokenize(score_text)
+        chunk = features.lookup(row)
+        t_tokens = chunk.tokens
 
         overlap_base = 0.0
         if q_tokens_base:
-            overlap_base = len(q_tokens_base.intersection(t_tokens)) / float(len(q_tokens_base))
+            overlap_base = len(t_tokens.intersection(q_tokens_base)) / float(len(q_tokens_base))
 
         overlap_expanded = 0.0
         if q_tokens_expanded:
-            overlap_expanded = len(q_tokens_expanded.intersection(t_tokens)) / float(len(q_tokens_expanded))
+            overlap_expanded = len(t_tokens.intersection(q_tokens_expanded)) / float(len(q_tokens_expanded))
 
         overlap = (0.75 * overlap_base) + (0.25 * overlap_expanded)
 
@@ -148,23 +170,13 @@ def _rerank_contexts(question: str, contexts: List[Dict[str, Any]]) -> List[Dict
         calibrated_semantic = min(1.0, max(0.0, (semantic - 0.15) / 0.75))
 
         phrase_bonus = 0.0
-        q_l = question.lower().strip()
-        text_l = score_text.lower()
-        if q_l and q_l in text_l:
+        if q_l and q_l in chunk.score_text:
             phrase_bonus = 0.1
-        if (
-            {"disclosure", "requirements"}.issubset(q_tokens_base)
-            and re.search(r"disclosure.{0,80}(require|obligation)", text_l)
-        ):
+        if {"disclosure", "requirements"}.issubset(q_tokens_base) and chunk.disclosure_obligation:
             phrase_bonus += 0.18
 
-        footnote_hits = len(re.findall(r"(inserted by|substituted by|omitted by|w\.e\.f\.|prior to)", text.lower()))
-        noise_penalty = min(0.2, footnote_hits * 0.04)
-
-        digit_density = 0.0
-        if text:
-            digit_density = sum(ch.isdigit() for ch in text) / float(len(text))
-        if digit_density > 0.08:
+        noise_penalty = min(0.2, chunk.footnote_hits_raw * 0.04)
+        if chunk.digit_heavy:
             noise_penalty += 0.12
 
         intent_penalty = 0.0
@@ -196,64 +208,33 @@ def _rerank_contexts(question: str, contexts: List[Dict[str, Any]]) -> List[Dict
     return ranked
 
 
-def _keyword_retrieve(query: str, top_k: int = 5) -> List[Dict[str, str]]:
-    corpus = _load_corpus()
-    if not corpus:
+def _keyword_retrieve(
+    query: str,
+    top_k: int = 5,
+    filters: Optional[Mapping[str, Any]] = None,
+) -> List[Dict[str, str]]:
+    index = _keyword_index()
+    if not len(index):
         return []
 
-    q_tokens_base = _tokenize(query)
-    q_tokens_expanded = _expand_query_tokens(query)
-    idf = _idf_map()
-    q_base_weight = sum(idf.get(t, 1.0) for t in q_tokens_base) or 1.0
-    q_exp_weight = sum(idf.get(t, 1.0) for t in q_tokens_expanded) or 1.0
-
-    query_l = query.lower()
-    contains_disclosure_phrase = "disclosure requirements" in query_l
-
-    scored = []
-    for row in corpus:
-        text = row.get("text", "")
-        score_text = _normalize_for_scoring(text)
-        t_tokens = _tokenize(score_text)
-        base_overlap = sum(idf.get(t, 1.0) for t in q_tokens_base.intersection(t_tokens)) / q_base_weight
-
-        expanded_overlap = (
-            sum(idf.get(t, 1.0) for t in q_tokens_expanded.intersection(t_tokens)) / q_exp_weight
-        )
-
-        phrase_bonus = 0.0
-        text_l = score_text.lower()
-        if contains_disclosure_phrase and "disclosure requirements" in text_l:
-            phrase_bonus = 0.2
-        elif contains_disclosure_phrase and "disclosure" in text_l and "require" in text_l:
-            phrase_bonus = 0.12
-        if contains_disclosure_phrase and re.search(r"disclosure.{0,80}(require|obligation)", text_l):
-            phrase_bonus += 0.18
-
-        footnote_penalty = min(
-            0.2,
-            len(re.findall(r"(inserted by|substituted by|omitted by|w\.e\.f\.|prior to)", text_l)) * 0.04,
-        )
-        digit_density = 0.0
-        if text:
-            digit_density = sum(ch.isdigit() for ch in text) / float(len(text))
-        if digit_density > 0.08:
-            footnote_penalty += 0.12
-
-        score = (0.75 * base_overlap) + (0.25 * expanded_overlap) + phrase_bonus - footnote_penalty
-        score = max(0.0, min(1.0, score))
-        if score > 0:
-            scored.append((score, row))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
+    hits = index.search(
+        tokenize(query),
+        _expand_query_tokens(query),
+        phrase_query="disclosure requirements" in query.lower(),
+        top_k=top_k,
+        filters=filters,
+    )
 
-    if not scored:
+    if not hits:
         # fallback to first few chunks so caller can still respond deterministically
-        return corpus[:top_k]
+        allowed = index.positions(filters)
+        if allowed is not None:
+            return [index.rows[int(pos)] for pos in allowed[:top_k]]
+        return index.rows[:top_k]
 
     out = []
-    for score, row in scored[:top_k]:
-        item = dict(row)
+    for pos, score in hits:
+        item = dict(index.rows[pos])
         item["score"] = score
         out.append(item)
     return out
@@ -336,20 +317,25 @@ Return 3-6 bullet points with precise compliance language and include one inline
 """
 
 
-def run_rag(question: str, history: Optional[List[Dict[str, str]]] = None):
-    """Orchestrate retrieval + prompt creation + answer generation with fallbacks."""
-    history = history or []
-
+def _retrieve_for_answer(
+    question: str,
+    history: List[Dict[str, str]],
+    filters: Optional[Mapping[str, Any]],
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Contexts for the answer and the prompt to generate it from, or None
+    when the contexts are not confident enough to send to the LLM.
+    """
     try:
         rag = get_rag_engine()
-        vector_contexts = rag.retrieve(question)
-        keyword_contexts = _keyword_retrieve(question, top_k=RETRIEVE_TOP_K)
+        vector_contexts = rag.retrieve(question, filters=filters)
+        keyword_contexts = _keyword_retrieve(question, top_k=RETRIEVE_TOP_K, filters=filters)
         raw_contexts = _fuse_contexts(vector_contexts, keyword_contexts, top_k=RETRIEVE_TOP_K)
         contexts = _rerank_contexts(question, raw_contexts)[:MAX_CONTEXTS_FOR_ANSWER]
         prompt = rag.build_prompt(question, contexts, history=history)
     except Exception as exc:
         print(f"[RAG] Embedding retrieval unavailable, using keyword fallback: {exc}")
-        keyword_contexts = _keyword_retrieve(question, top_k=RETRIEVE_TOP_K)
+        keyword_contexts = _keyword_retrieve(question, top_k=RETRIEVE_TOP_K, filters=filters)
         contexts = _rerank_contexts(question, keyword_contexts)[:MAX_CONTEXTS_FOR_ANSWER]
         prompt = _build_prompt(question, contexts, history)
 
@@ -358,22 +344,162 @@ def run_rag(question: str, history: Optional[List[Dict[str, str]]] = None):
         top_score = float(contexts[0].get("score", 0.0))
 
     if not contexts or top_score < MIN_FINAL_CONFIDENCE:
-        return {
-            "question": question,
-            "answer": "The referenced SEBI documents do not cover this information.",
-            "evidence": contexts,
-        }
+        return contexts, None
+    return contexts, prompt
 
-    answer = hf_call(prompt)
 
+def _rag_result(question: str, contexts: List[Dict[str, Any]], answer: Optional[str]) -> Dict[str, Any]:
     return {
         "question": question,
-        "answer": answer,
+        "answer": answer if answer is not None else NOT_COVERED_ANSWER,
         "evidence": contexts,
     }
 
 
+def _query_embedding(question: str) -> Optional[np.ndarray]:
+    """
+    The engine's query vector (from its query cache when possible), or None
+    until retrieval has loaded the engine. Loading is left to retrieval, so
+    an engine that cannot load is tried (and reported) once per request.
+    """
+    if get_rag_engine.cache_info().currsize == 0:
+        return None
+    try:
+        return get_rag_engine().encode([question])[0]
+    except Exception:
+        return None
+
+
+def _cached_answer(
+    question: str,
+    history: List[Dict[str, str]],
+    filters: Optional[Mapping[str, Any]],
+) -> AnswerLookup:
+    return get_answer_cache().lookup(
+        question, history, filters, get_hf_model(), index_version(), embed=_query_embedding
+    )
+
+
+def _cache_answer(lookup: AnswerLookup, result: Dict[str, Any]) -> None:
+    # Fallback answers stand in for a provider outage; the next request should try the LLM again.
+    if is_fallback_answer(result["answer"]):
+        return
+    cache = get_answer_cache()
+    vector = None
+    if cache.enabled and lookup.vector is None and cache.similarity > 0:
+        # The lookup ran before retrieval loaded the engine.
+        vector = _query_embedding(result["question"])
+    cache.store(lookup, result, vector)
+
+
+def run_rag(
+    question: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    filters: Optional[Mapping[str, Any]] = None,
+):
+    """
+    Orchestrate retrieval + prompt creation + answer generation with fallbacks.
+    `filters` scopes both retrievers to matching doc_type / source_file values.
+    Answers are served from and added to the answer cache.
+    """
+    history = history or []
+    lookup = _cached_answer(question, history, filters)
+    if lookup.result is not None:
+        return {**lookup.result, "question": question}
+    contexts, prompt = _retrieve_for_answer(question, history, filters)
+    answer = hf_call(prompt) if prompt is not None else None
+    result = _rag_result(question, contexts, answer)
+    _cache_answer(lookup, result)
+    return result
+
+
+async def run_rag_async(
+    question: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    filters: Optional[Mapping[str, Any]] = None,
+):
+    """
+    run_rag for the event loop. Retrieval (query encoding, FAISS and keyword
+    search, reranking) is CPU-bound and runs on the retrieval thread pool;
+    generation is awaited on the async HF client, so requests waiting on the
+    LLM hold neither a thread nor the loop.
+    """
+    history = history or []
+    loop = asyncio.get_running_loop()
+    lookup = await loop.run_in_executor(_retrieval_pool(), _cached_answer, question, history, filters)
+    if lookup.result is not None:
+        return {**lookup.result, "question": question}
+    contexts, prompt = await loop.run_in_executor(_retrieval_pool(), _retrieve_for_answer, question, history, filters)
+    answer = await hf_call_async(prompt) if prompt is not None else None
+    result = _rag_result(question, contexts, answer)
+    _cache_answer(lookup, result)
+    return result
+
+
+async def stream_rag_async(
+    question: str,
+    history: Optional[List[Dict[str, str]]] = None,
+    filters: Optional[Mapping[str, Any]] = None,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    run_rag_async as events: ("evidence", contexts) as soon as retrieval is
+    done, then ("token", text) pieces of the answer as they are generated.
+    """
+    history = history or []
+    loop = asyncio.get_running_loop()
+    lookup = await loop.run_in_executor(_retrieval_pool(), _cached_answer, question, history, filters)
+    if lookup.result is not None:
+        yield "evidence", lookup.result["evidence"]
+        yield "token", lookup.result["answer"]
+        return
+    contexts, prompt = await loop.run_in_executor(_retrieval_pool(), _retrieve_for_answer, question, history, filters)
+    yield "evidence", contexts
+    pieces: List[str] = []
+    if prompt is None:
+        pieces.append(NOT_COVERED_ANSWER)
+        yield "token", NOT_COVERED_ANSWER
+    else:
+        async for piece in hf_stream_async(prompt):
+            pieces.append(piece)
+            yield "token", piece
+    _cache_answer(lookup, _rag_result(question, contexts, "".join(pieces)))
+
+
+async def warm_answer_cache(path: Optional[Path] = None) -> int:
+    """
+    Answer the requests in a JSONL file (ANSWER_CACHE_WARMUP by default) one
+    at a time through run_rag_async, so their answers are cached before
+    users ask. Each line is {"question": ..., "history": [...], "filters":
+    {...}} with history and filters optional; other lines are skipped.
+    Returns the number of questions answered.
+    """
+    if path is None:
+        configured = get_answer_cache_config()["warmup_path"]
+        if not configured:
+            return 0
+        path = Path(configured)
+    if not get_answer_cache().enabled or not path.exists():
+        return 0
+
+    answered = 0
+    for line in path.read_text(encoding="utf-8").splitlines():
+        try:
+            request = json.loads(line)
+        except ValueError:
+            continue
+        question = request.get("question") if isinstance(request, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            continue
+        try:
+            await run_rag_async(question.strip(), history=request.get("history") or [], filters=request.get("filters"))
+            answered += 1
+        except Exception as exc:
+            print(f"[RAG] Answer cache warm-up failed for {question!r}: {exc}")
+    print(f"Answer cache warm-up: {answered} questions from {path}")
+    return answered
+
+
 if __name__ == "__main__":
     out = run_rag("What are the disclosure requirements for listed entities?")
     print("ANSWER:\n", out["answer"])
-    print("\nEVIDENCE:\n", out["evidence"])
+    print("\nEVIDENCE:\n", out["evidence"])
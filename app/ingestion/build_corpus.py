@@ -1,60 +1,217 @@
 # app/ingestion/build_corpus.py
 
+import hashlib
 import json
+import sys
 import uuid
+from itertools import chain
 from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+from app.config import get_chunking_config, get_dedup_config
+from app.ingestion.chunking import TokenCounter, clause_chunks, token_distribution
+from app.ingestion.dedup import collapse_near_duplicates
+from app.ingestion.manifest import StageManifest, file_sha256
+from app.ingestion.parse_pdfs import PAGES_SUFFIX, read_pages
 
 PROCESSED_DIR = Path("data/data_processed")
 CORPUS_FILE = PROCESSED_DIR / "corpus.jsonl"
+CHUNK_REPORT_FILE = Path("data/chunk_report.json")
 
 CHUNK_SIZE = 1500
 OVERLAP = 200
 
+# Fixed namespace so chunk ids are the same on every run and every machine.
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1d2c1e-52b4-4a8e-9d0a-5e3b7c9a1f20")
 
-def chunk_text(text: str):
-    chunks = []
-    start = 0
-    length = len(text)
-
-    while start < length:
-        end = start + CHUNK_SIZE
-        chunks.append(text[start:end])
-        start += CHUNK_SIZE - OVERLAP
 
-    return chunks
+def chunk_id(source_file: str, chunk_index: int, text: str) -> str:
+    """
+    Content-addressed chunk id: unchanged chunks keep their id across
+    rebuilds, so incremental index updates can tell what actually changed.
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(CHUNK_ID_NAMESPACE, f"{source_file}\n{chunk_index}\n{digest}"))
 
 
-def build_corpus():
-    json_files = list(PROCESSED_DIR.glob("*.json"))
-    if not json_files:
-        print("No JSON files in data/data_processed/. Run parse_pdfs.py first.")
-        return
+def sliding_chunks(pieces: Iterable[str], size: int = CHUNK_SIZE, overlap: int = OVERLAP) -> Iterator[str]:
+    """
+    Chunks of the concatenation of `pieces`: text[start:start + size] for
+    start = 0, size - overlap, ... while start < len(text). Only the current
+    window and the piece being consumed are held, never the whole text.
+    """
+    step = size - overlap
+    window = ""
+    start = 0
+    for piece in pieces:
+        # Trim once per piece rather than once per chunk, so a large piece
+        # is walked by offset instead of being re-copied for every chunk.
+        window = window[start:] + piece
+        start = 0
+        while len(window) - start >= size:
+            yield window[start:start + size]
+            start += step
+    while start < len(window):
+        yield window[start:start + size]
+        start += step
 
-    if CORPUS_FILE.exists():
-        CORPUS_FILE.unlink()
 
-    with CORPUS_FILE.open("w", encoding="utf-8") as f_out:
-        for fp in json_files:
+def chunk_text(text: str):
+    return list(sliding_chunks([text]))
+
+
+def document_files():
+    """Parsed document files in name order: page records, or a legacy `<stem>.json` where none exist."""
+    files = {fp.name[: -len(PAGES_SUFFIX)]: fp for fp in PROCESSED_DIR.glob(f"*{PAGES_SUFFIX}")}
+    for fp in PROCESSED_DIR.glob("*.json"):
+        files.setdefault(fp.stem, fp)
+    return [files[stem] for stem in sorted(files)]
+
+
+def load_documents(files=None) -> Iterator[Tuple[str, Iterator[str]]]:
+    """
+    (source_file, text pieces) per parsed document. Page records are read one
+    at a time and separated the way whole-document parsing joined pages; a
+    legacy `<stem>.json` can only be loaded whole and is a single piece.
+    """
+    for fp in document_files() if files is None else files:
+        if fp.name.endswith(PAGES_SUFFIX):
+            pages = read_pages(fp)
+            first = next(pages, None)
+            if first is not None:
+                yield first["source_file"], chain([first["text"]], ("\n\n" + page["text"] for page in pages))
+        else:
             data = json.loads(fp.read_text(encoding="utf-8"))
-            source = data["source_file"]
-            text = data["raw_text"]
+            yield data["source_file"], iter([data.pop("raw_text")])
+
+
+def document_chunks(pieces: Iterable[str], config: dict) -> Iterator[str]:
+    """Chunks of one document with the configured chunker (see config.get_chunking_config)."""
+    if config["chunker"] == "clauses":
+        return clause_chunks(
+            pieces,
+            config["max_tokens"],
+            config["min_tokens"],
+            config["overlap_tokens"],
+            TokenCounter(config["encoding"]),
+        )
+    if config["chunker"] != "chars":
+        raise ValueError(f"Unknown CHUNKER: {config['chunker']!r} (use chars or clauses)")
+    return sliding_chunks(pieces)
+
+
+def chunk_params(config: dict) -> dict:
+    """Chunking parameters the chunk manifest is keyed on."""
+    if config["chunker"] == "chars":
+        return {"chunk_size": CHUNK_SIZE, "overlap": OVERLAP}
+    return dict(config)
+
+
+def iter_records(files=None, config: Optional[dict] = None) -> Iterator[dict]:
+    """corpus.jsonl records of every parsed document, chunked as its pages stream in."""
+    config = config or get_chunking_config()
+    for source, pieces in load_documents(files):
+        idx = -1
+        for idx, chunk in enumerate(document_chunks(pieces, config)):
+            yield {
+                "id": chunk_id(source, idx, chunk),
+                "source_file": source,
+                "chunk_index": idx,
+                "doc_type": source.split("_")[0],
+                "text": chunk,
+            }
+        print(f"Chunked: {source} -> {idx + 1} chunks")
+
+
+def build_corpus(force: bool = False):
+    """
+    Chunk every parsed document into corpus.jsonl. Skipped when no parsed
+    file, chunking parameter or the corpus itself changed since the last
+    build (see manifest.py). Otherwise the whole corpus is rebuilt: chunking
+    is cheap next to parsing and embedding, dedup spans all documents, and
+    content-addressed ids keep unchanged chunks from being re-embedded.
+
+    Records are streamed to a temporary file as pages are read, and dedup
+    copies that file to corpus.jsonl, so memory does not grow with
+    document size.
+    """
+    files = document_files()
+    config = get_chunking_config()
+    manifest = StageManifest("chunk", dict(chunk_params(config), dedup=get_dedup_config()))
+    unchanged = [manifest.is_current(fp) for fp in files]
+    corpus_intact = CORPUS_FILE.exists() and manifest.extra.get("corpus_sha256") == file_sha256(CORPUS_FILE)
+    if files and all(unchanged) and not manifest.removed() and corpus_intact and not force:
+        print(f"Corpus is up to date ({len(files)} documents unchanged): {CORPUS_FILE}")
+        return
 
-            chunks = chunk_text(text)
+    tmp = CORPUS_FILE.with_suffix(".tmp")
+    num_records = 0
+    # Token counts are already paid for by the token-budgeted chunker.
+    counter = TokenCounter(config["encoding"]) if config["chunker"] == "clauses" else None
+    token_counts = []
+    with tmp.open("w", encoding="utf-8") as f_out:
+        for record in iter_records(files, config):
+            f_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            num_records += 1
+            if counter:
+                token_counts.append(counter.count(record["text"]))
+
+    if not num_records:
+        tmp.unlink()
+        print("No parsed documents in data/data_processed/. Run parse_pdfs.py first.")
+        return
 
-            for idx, chunk in enumerate(chunks):
-                record = {
-                    "id": str(uuid.uuid4()),
-                    "source_file": source,
-                    "chunk_index": idx,
-                    "doc_type": source.split("_")[0],
-                    "text": chunk,
-                }
-                f_out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    dedup = get_dedup_config()
+    if dedup["threshold"] > 0:
+        kept, dropped = collapse_near_duplicates(tmp, CORPUS_FILE, dedup["threshold"], dedup["num_perm"])
+        tmp.unlink()
+        print(f"Near-duplicates (Jaccard >= {dedup['threshold']}): {dropped} chunks collapsed, {kept} kept")
+    else:
+        tmp.replace(CORPUS_FILE)
+    if counter:
+        print(f"Chunk tokens: {token_distribution(token_counts, config['max_tokens'])}")
+
+    for fp in files:
+        manifest.record(fp)
+    manifest.extra["corpus_sha256"] = file_sha256(CORPUS_FILE)
+    manifest.save()
+    print(f"\nCorpus created at: {CORPUS_FILE}")
 
-            print(f"Chunked: {source} -> {len(chunks)} chunks")
 
-    print(f"\nCorpus created at: {CORPUS_FILE}")
+def chunk_report(files=None) -> dict:
+    """
+    Chunk count and token-count distribution of every parsed document under
+    the character chunker and the clause chunker, overall and per document.
+    Written to data/chunk_report.json; the corpus is not touched.
+    """
+    files = document_files() if files is None else files
+    config = get_chunking_config()
+    counter = TokenCounter(config["encoding"])
+    report = {"encoding": config["encoding"], "max_tokens": config["max_tokens"], "chunkers": {}}
+    for chunker in ("chars", "clauses"):
+        settings = dict(config, chunker=chunker)
+        budget = config["max_tokens"] if chunker == "clauses" else 0
+        overall, documents = [], {}
+        for source, pieces in load_documents(files):
+            counts = [counter.count(chunk) for chunk in document_chunks(pieces, settings)]
+            documents[source] = token_distribution(counts, budget)
+            overall.extend(counts)
+        report["chunkers"][chunker] = {"all": token_distribution(overall, budget), "documents": documents}
+
+    print(f"{'chunker':<10}{'chunks':>8}{'tokens':>10}{'mean':>8}{'p10':>6}{'p50':>6}{'p90':>6}{'p99':>6}{'max':>6}")
+    for chunker, result in report["chunkers"].items():
+        row = result["all"]
+        print(
+            f"{chunker:<10}{row['chunks']:>8}{row['tokens']:>10}{row.get('mean', 0):>8}"
+            f"{row.get('p10', 0):>6}{row.get('p50', 0):>6}{row.get('p90', 0):>6}{row.get('p99', 0):>6}{row.get('max', 0):>6}"
+        )
+    CHUNK_REPORT_FILE.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"Report written to: {CHUNK_REPORT_FILE}")
+    return report
 
 
 if __name__ == "__main__":
-    build_corpus()
+    if "--report" in sys.argv:
+        chunk_report()
+    else:
+        build_corpus(force="--force" in sys.argv)
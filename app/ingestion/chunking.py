@@ -0,0 +1,217 @@
+# app/ingestion/chunking.py
+"""
+Clause-aware, token-budgeted chunking of SEBI regulations and circulars.
+
+Document text is cut into segments at the boundaries these documents use:
+chapter/part/schedule headings, numbered regulations and paragraphs
+("31B.", "6.7.2.1", "318[Special rights"), sub-clauses ("(1)", "(a)",
+"(iv)", "a."), provisos and explanations, and blank-line paragraphs. Each
+boundary has a strength. Segments are packed into chunks of at most
+`max_tokens` tokenizer tokens. When the next segment does not fit, the
+chunk is cut at the strongest boundary that still leaves it `min_tokens`
+long, and the segments after the cut start the next chunk. A chapter, part
+or schedule heading also starts a new chunk once the current one is
+`min_tokens` long. A segment that is too long on its own is split at
+sentence ends, then between words.
+
+Text arrives as pieces (see build_corpus.load_documents) and only the
+segments of the chunk being packed are held in memory.
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Boundary strengths, weakest first.
+PARAGRAPH, SUBCLAUSE, CLAUSE, HEADING = 1, 2, 3, 4
+
+_HEADING_RE = re.compile(
+    r"^\s*(?:\d+\[)?(?:CHAPTER|PART|SCHEDULE|ANNEXURE|APPENDIX|SECTION)\b[\s\-–—:.]*[A-Z0-9IVXL]*", re.IGNORECASE
+)
+# "32.", "31B. (1)", "6.7.2.1 The scheme", "318[Special rights", "7.1" on its own line.
+_CLAUSE_RE = re.compile(r"^\s*(?:\d+[A-Z]{0,2}\.(?:\s|\(|$)|\d+(?:\.\d+)+(?:\s|$)|\d+\[\s*\S)")
+# "(1)", "(a)", "(iv)", "a.", "Provided that", "Explanation".
+_SUBCLAUSE_RE = re.compile(
+    r"^\s*(?:\(\d+[A-Z]?\)|\([a-z]{1,2}\)|\((?:[ivxl]+)\)|[a-z]\.(?:\s|$)|Provided\b|Explanation\b)"
+)
+# Split after sentence-ending punctuation and one whitespace; concatenating the parts gives back the text.
+_SENTENCE_END_RE = re.compile(r"(?<=[.;:?!]\s)")
+_WORD_RE = re.compile(r"\s*\S+\s*")
+
+
+class Segment(NamedTuple):
+    level: int
+    text: str
+    tokens: int
+
+
+def boundary_level(line: str, after_blank: bool) -> int:
+    """Strength of the boundary before `line` (0 = none)."""
+    if _HEADING_RE.match(line) and line.strip().split()[0].isupper():
+        return HEADING
+    if _CLAUSE_RE.match(line):
+        return CLAUSE
+    if _SUBCLAUSE_RE.match(line):
+        return SUBCLAUSE
+    if after_blank:
+        return PARAGRAPH
+    return 0
+
+
+class TokenCounter:
+    """Token counts with a tiktoken encoding, loaded on first use."""
+
+    def __init__(self, encoding: str = "cl100k_base"):
+        self.encoding_name = encoding
+
+    @property
+    def encoding(self):
+        return _encoding(self.encoding_name)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=None)
+def _encoding(name: str):
+    import tiktoken
+
+    return tiktoken.get_encoding(name)
+
+
+def segments(pieces: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """
+    (boundary level, text) runs of whole lines, split where a line starts a
+    heading, clause, sub-clause or paragraph. Concatenated, the texts give
+    back the input.
+    """
+    current: List[str] = []
+    level = HEADING
+    after_blank = True
+
+    def add(line: str) -> Iterator[Tuple[int, str]]:
+        nonlocal current, level, after_blank
+        blank = not line.strip()
+        line_level = 0 if blank else boundary_level(line, after_blank)
+        if line_level and any(l.strip() for l in current):
+            yield level, "".join(current)
+            current, level = [], line_level
+        current.append(line)
+        after_blank = blank
+
+    pending = ""
+    for piece in pieces:
+        lines = (pending + piece).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield from add(line + "\n")
+    if pending:
+        yield from add(pending)
+    if current:
+        yield level, "".join(current)
+
+
+def _split_long(text: str, level: int, max_tokens: int, counter: TokenCounter) -> Iterator[Segment]:
+    """Runs of sentences (or of words, within an over-long sentence) of a segment that is over budget."""
+    run, run_tokens = "", 0
+    for sentence in filter(None, _SENTENCE_END_RE.split(text)):
+        tokens = counter.count(sentence)
+        parts = [(sentence, tokens)]
+        if tokens > max_tokens:
+            parts = [(word, counter.count(word)) for word in _WORD_RE.findall(sentence) if word]
+        for part, part_tokens in parts:
+            if run and run_tokens + part_tokens > max_tokens:
+                yield Segment(level, run, run_tokens)
+                level, run, run_tokens = 0, "", 0
+            run += part
+            run_tokens += part_tokens
+    if run:
+        yield Segment(level, run, run_tokens)
+
+
+def clause_chunks(
+    pieces: Iterable[str],
+    max_tokens: int = 512,
+    min_tokens: int = 128,
+    overlap_tokens: int = 0,
+    counter: Optional[TokenCounter] = None,
+) -> Iterator[str]:
+    """
+    Chunks of at most ~max_tokens tokens cut at clause boundaries (see the
+    module docstring). With `overlap_tokens`, whole trailing segments of a
+    chunk worth up to that many tokens are repeated at the start of the next.
+    """
+    counter = counter or TokenCounter()
+    chunk: List[Segment] = []
+    # Leading segments of `chunk` repeated from the previous chunk.
+    carried = 0
+
+    def emit(cut: int) -> Iterator[str]:
+        nonlocal chunk, carried
+        head, rest = chunk[:cut], chunk[cut:]
+        text = "".join(seg.text for seg in head)
+        if text.strip():
+            yield text
+        overlap: List[Segment] = []
+        total = 0
+        for seg in reversed(head[carried:] if overlap_tokens > 0 else []):
+            if total + seg.tokens > overlap_tokens:
+                break
+            overlap.insert(0, seg)
+            total += seg.tokens
+        if len(overlap) == len(head) - carried:
+            overlap = []
+        chunk, carried = overlap + rest, len(overlap)
+
+    def best_cut(incoming_level: int) -> int:
+        """Segments to keep: cut at the strongest boundary that leaves at least min_tokens, latest on ties."""
+        best, best_level = len(chunk), -1
+        filled = 0
+        for i, seg in enumerate(chunk):
+            if i > carried and filled >= min_tokens and seg.level >= best_level:
+                best, best_level = i, seg.level
+            filled += seg.tokens
+        if incoming_level >= best_level:
+            best = len(chunk)
+        return best
+
+    for level, text in segments(pieces):
+        tokens = counter.count(text)
+        parts = [Segment(level, text, tokens)] if tokens <= max_tokens else _split_long(text, level, max_tokens, counter)
+        for part in parts:
+            filled = sum(seg.tokens for seg in chunk)
+            if part.level >= HEADING and len(chunk) > carried and filled >= min_tokens:
+                yield from emit(len(chunk))
+                filled = sum(seg.tokens for seg in chunk)
+            while chunk and filled + part.tokens > max_tokens:
+                if len(chunk) == carried:
+                    chunk, carried = [], 0
+                    break
+                yield from emit(best_cut(part.level))
+                filled = sum(seg.tokens for seg in chunk)
+            chunk.append(part)
+    if len(chunk) > carried:
+        yield from emit(len(chunk))
+
+
+def token_distribution(counts: Sequence[int], max_tokens: int = 0) -> dict:
+    """Chunk count and token-count percentiles of one chunking."""
+    values = np.asarray(counts, dtype=np.int64)
+    if not len(values):
+        return {"chunks": 0, "tokens": 0}
+    report = {
+        "chunks": int(len(values)),
+        "tokens": int(values.sum()),
+        "mean": round(float(values.mean()), 1),
+        "min": int(values.min()),
+        "p10": int(np.percentile(values, 10)),
+        "p50": int(np.percentile(values, 50)),
+        "p90": int(np.percentile(values, 90)),
+        "p99": int(np.percentile(values, 99)),
+        "max": int(values.max()),
+    }
+    if max_tokens:
+        report["over_budget"] = int((values > max_tokens).sum())
+    return report
@@ -0,0 +1,218 @@
+# app/ingestion/dedup.py
+"""
+Near-duplicate chunk elimination for the corpus build.
+
+Chunks are compared as sets of word 5-shingles. MinHash signatures with LSH
+banding propose candidate pairs; each candidate is confirmed with the exact
+Jaccard similarity, so a merge never rests on the estimate alone. Confirmed
+pairs are merged transitively. Every group keeps its first chunk in corpus
+order as the canonical one, which records the others under `duplicates`
+(id, source_file, chunk_index) so answers can still cite every location.
+A dropped chunk whose text differs from the canonical one other than in
+whitespace keeps it under `text` in its reference: clauses that differ only
+in a number ("30 days" against "21 days") are different clauses.
+
+The corpus is deduplicated file to file in two streaming passes. Only one
+64-bit key per LSH band is kept per chunk, and candidate texts are re-read
+by byte offset for the exact check, so memory grows with the chunk count
+rather than with the corpus text.
+"""
+
+import hashlib
+import json
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+import numpy as np
+
+SHINGLE_SIZE = 5
+_MERSENNE_61 = np.uint64((1 << 61) - 1)
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> Set[str]:
+    words = _WORD_RE.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _collapse_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / float(len(a | b))
+
+
+class MinHasher:
+    """MinHash over 32-bit shingle hashes with (a*x + b) mod (2^61 - 1) permutations."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        # a < 2^29 and x < 2^32 keep a*x + b below 2^64.
+        self.a = rng.integers(1, 1 << 29, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, items: Set[str]) -> np.ndarray:
+        if not items:
+            return np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in items),
+            dtype=np.uint64,
+            count=len(items),
+        )
+        return ((np.outer(hashes, self.a) + self.b) % _MERSENNE_61).min(axis=0)
+
+
+def _bands(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) whose LSH threshold (1/b)^(1/r) sits just below `threshold`, so few true pairs are missed."""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1.0 / bands) ** (1.0 / rows) <= threshold - 0.1:
+            best = (bands, rows)
+    return best
+
+
+def band_keys(signature: np.ndarray, bands: int, rows: int) -> np.ndarray:
+    """One 64-bit digest per LSH band of a signature."""
+    return np.array(
+        [
+            int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(), digest_size=8).digest(), "little")
+            for band in range(bands)
+        ],
+        dtype=np.uint64,
+    )
+
+
+class JsonlTexts(Sequence):
+    """Read-only sequence over the `text` of a JSONL file's records, read on access by byte offset."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        offsets = []
+        position = 0
+        with path.open("rb") as f:
+            for line in f:
+                offsets.append(position)
+                position += len(line)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self._file = path.open("rb")
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def record(self, pos: int) -> Dict[str, Any]:
+        self._file.seek(int(self.offsets[pos]))
+        return json.loads(self._file.readline())
+
+    def __getitem__(self, pos: int) -> str:
+        return str(self.record(pos).get("text", ""))
+
+    def __iter__(self):
+        with self.path.open("rb") as f:
+            for line in f:
+                yield str(json.loads(line).get("text", ""))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def near_duplicate_groups(texts: Sequence[str], threshold: float = 0.9, num_perm: int = 64) -> List[List[int]]:
+    """
+    Groups (ascending positions, size > 1) of texts whose shingle Jaccard >=
+    threshold. `texts` is read once in order for the band keys and then only
+    at candidate positions, so it may be a lazy sequence such as JsonlTexts.
+    """
+    hasher = MinHasher(num_perm)
+    bands, rows = _bands(num_perm, threshold)
+    keys = np.zeros((len(texts), bands), dtype=np.uint64)
+    for pos, text in enumerate(texts):
+        keys[pos] = band_keys(hasher.signature(shingles(text)), bands, rows)
+
+    @lru_cache(maxsize=1024)
+    def shingle_set(pos: int) -> frozenset:
+        return frozenset(shingles(texts[pos]))
+
+    parent = list(range(len(texts)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    checked: Set[Tuple[int, int]] = set()
+    for band in range(bands):
+        # Sorting by key puts each bucket's positions next to each other, in ascending order.
+        order = np.argsort(keys[:, band], kind="stable")
+        column = keys[order, band]
+        bounds = np.flatnonzero(column[1:] != column[:-1]) + 1
+        for bucket in np.split(order, bounds):
+            if len(bucket) < 2:
+                continue
+            members = bucket.tolist()
+            for i, first in enumerate(members):
+                for other in members[i + 1:]:
+                    if (first, other) in checked:
+                        continue
+                    checked.add((first, other))
+                    if find(first) != find(other) and jaccard(shingle_set(first), shingle_set(other)) >= threshold:
+                        root_a, root_b = find(first), find(other)
+                        parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    groups: Dict[int, List[int]] = {}
+    for pos in range(len(texts)):
+        groups.setdefault(find(pos), []).append(pos)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+def collapse_near_duplicates(
+    source: Path,
+    target: Path,
+    threshold: float = 0.9,
+    num_perm: int = 64,
+) -> Tuple[int, int]:
+    """
+    Copy the JSONL records of `source` to `target`, keeping one canonical
+    record per near-duplicate group, in corpus order, with back-references
+    to the dropped ones. A dropped record whose text differs from the
+    canonical one (beyond whitespace) keeps that text in its reference.
+    Returns (records kept, records dropped).
+    """
+    texts = JsonlTexts(source)
+    try:
+        groups = near_duplicate_groups(texts, threshold, num_perm)
+        duplicates: Dict[int, List[Dict[str, Any]]] = {}
+        dropped: Set[int] = set()
+        for members in groups:
+            head, rest = members[0], members[1:]
+            head_text = _collapse_whitespace(texts[head])
+            duplicates[head] = []
+            for i in rest:
+                record = texts.record(i)
+                ref = {"id": record.get("id"), "source_file": record.get("source_file"), "chunk_index": record.get("chunk_index")}
+                text = str(record.get("text", ""))
+                if _collapse_whitespace(text) != head_text:
+                    ref["text"] = text
+                duplicates[head].append(ref)
+            dropped.update(rest)
+    finally:
+        texts.close()
+
+    with source.open("r", encoding="utf-8") as f_in, target.open("w", encoding="utf-8") as f_out:
+        for pos, line in enumerate(f_in):
+            if pos in dropped:
+                continue
+            if pos in duplicates:
+                line = json.dumps(dict(json.loads(line), duplicates=duplicates[pos]), ensure_ascii=False) + "\n"
+            f_out.write(line)
+    return len(texts) - len(dropped), len(dropped)
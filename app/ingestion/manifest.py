@@ -0,0 +1,97 @@
+# app/ingestion/manifest.py
+"""
+Per-stage ingestion manifests, so unchanged inputs are skipped end to end.
+
+Each stage (parse, chunk) records the content hash of every input file it
+consumed and the parameters it ran with (parser version, chunk size and
+overlap, ...). A later run redoes only inputs whose hash changed and
+everything when the parameters changed. Content-addressed chunk ids then let
+the index update embed only the chunks that are actually new.
+
+Hashing reads every byte, so a file whose size and mtime match the manifest
+reuses the recorded hash instead.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+MANIFEST_DIR = Path("data/manifests")
+FORMAT_VERSION = 1
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class StageManifest:
+    """Input fingerprints and parameters of one ingestion stage."""
+
+    def __init__(self, stage: str, params: Dict[str, Any], directory: Path = MANIFEST_DIR):
+        self.stage = stage
+        self.params = params
+        self.path = directory / f"{stage}.json"
+        previous = self._read()
+        self.previous_params = previous.get("params")
+        self.previous: Dict[str, Dict[str, Any]] = previous.get("files", {})
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self._fingerprints: Dict[Path, Dict[str, Any]] = {}
+        self.extra: Dict[str, Any] = previous.get("extra", {})
+
+    def _read(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {}
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        return data if data.get("format_version") == FORMAT_VERSION else {}
+
+    @property
+    def params_changed(self) -> bool:
+        return self.previous_params != self.params
+
+    def fingerprint(self, path: Path) -> Dict[str, Any]:
+        if path in self._fingerprints:
+            return self._fingerprints[path]
+        stat = path.stat()
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        old = self.previous.get(path.name)
+        if old and old.get("size") == entry["size"] and old.get("mtime_ns") == entry["mtime_ns"]:
+            entry["sha256"] = old["sha256"]
+        else:
+            entry["sha256"] = file_sha256(path)
+        self._fingerprints[path] = entry
+        return entry
+
+    def is_current(self, path: Path, outputs: Iterable[Path] = ()) -> bool:
+        """True when `path` was processed with these params, is unchanged, and its outputs exist."""
+        entry = self.fingerprint(path)
+        old = self.previous.get(path.name)
+        if not self.params_changed and old and old["sha256"] == entry["sha256"] and all(p.exists() for p in outputs):
+            self.files[path.name] = dict(old, size=entry["size"], mtime_ns=entry["mtime_ns"])
+            return True
+        return False
+
+    def record(self, path: Path, **details: Any) -> None:
+        self.files[path.name] = dict(self.fingerprint(path), **details)
+
+    def removed(self) -> List[str]:
+        """Inputs the previous run saw that this run did not."""
+        return [name for name in self.previous if name not in self.files]
+
+    def entry(self, name: str) -> Optional[Dict[str, Any]]:
+        return self.previous.get(name)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {
+            "format_version": FORMAT_VERSION,
+            "stage": self.stage,
+            "params": self.params,
+            "files": dict(sorted(self.files.items())),
+            "extra": self.extra,
+        }
+        self.path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
@@ -1,41 +1,122 @@
 # app/ingestion/parse_pdfs.py
+"""
+Parse PDFs into line-delimited page records on a process pool.
+
+Each PDF is split into page ranges of PARSE_PAGES_PER_TASK pages, so large
+documents are extracted in parallel as well as many small ones. Results come
+back in document/page order and are streamed to `<stem>.pages.jsonl`, one
+record per page:
+
+    {"source_file": "sebi_lodr_2015.pdf", "page": 0, "num_pages": 216, "text": "..."}
+
+A document's file is written under a temporary name and renamed once its
+last page is in, so an interrupted run never leaves a truncated document
+behind for build_corpus. PDFs whose content hash and parser version match
+the parse manifest (see manifest.py) are skipped, and page files (and
+legacy `<stem>.json` files) of PDFs that were removed from data_raw are
+deleted, also when data_raw is now empty.
+"""
 
 import json
+import os
+from multiprocessing import Pool
 from pathlib import Path
+from typing import Iterator, List, Tuple
 
 import fitz
 
+from app.config import get_parse_config
+from app.ingestion.manifest import StageManifest
+
 RAW_DIR = Path("data/data_raw")
 OUT_DIR = Path("data/data_processed")
 OUT_DIR.mkdir(exist_ok=True, parents=True)
+PAGES_SUFFIX = ".pages.jsonl"
+# Bump when the page records change shape or content.
+PARSER_VERSION = "pages-1"
+
+# (pdf path, first page, end page, page count)
+PageRange = Tuple[str, int, int, int]
+
+
+def extract_pages(task: PageRange) -> Tuple[PageRange, List[str]]:
+    """Worker: text of pages [start, end) of one PDF."""
+    path, start, end, _ = task
+    with fitz.open(path) as doc:
+        return task, [doc[number].get_text("text") for number in range(start, end)]
+
+
+def plan_tasks(pdf_files: List[Path], pages_per_task: int) -> Iterator[PageRange]:
+    for pdf in pdf_files:
+        with fitz.open(pdf) as doc:
+            num_pages = doc.page_count
+        if num_pages == 0:
+            yield str(pdf), 0, 0, 0
+        for start in range(0, num_pages, pages_per_task):
+            yield str(pdf), start, min(start + pages_per_task, num_pages), num_pages
+
+
+def pages_path(pdf: Path) -> Path:
+    return OUT_DIR / f"{pdf.stem}{PAGES_SUFFIX}"
 
 
-def extract_text(pdf_path: Path) -> str:
-    doc = fitz.open(pdf_path)
-    pages = []
-    for page in doc:
-        pages.append(page.get_text("text"))
-    return "\n\n".join(pages)
+def remove_outputs(name: str, entry: dict) -> None:
+    """Delete a removed PDF's page file and any legacy `<stem>.json` build_corpus would fall back to."""
+    for output in (OUT_DIR / entry.get("output", ""), OUT_DIR / f"{Path(name).stem}.json"):
+        if output.is_file():
+            output.unlink()
 
 
 def process_pdfs():
-    pdf_files = list(RAW_DIR.glob("*.pdf"))
+    pdf_files = sorted(RAW_DIR.glob("*.pdf"))
+    manifest = StageManifest("parse", {"parser": PARSER_VERSION, "pymupdf": fitz.VersionBind})
+    todo = [pdf for pdf in pdf_files if not manifest.is_current(pdf, [pages_path(pdf)])]
+    changed = {pdf.name for pdf in todo}
+    for name in manifest.removed():
+        if name not in changed:
+            remove_outputs(name, manifest.entry(name))
+            print(f"Removed: {name}")
     if not pdf_files:
         print("No PDFs found in data/data_raw/")
+        manifest.save()
         return
 
-    for pdf in pdf_files:
-        text = extract_text(pdf)
-        payload = {
-            "source_file": pdf.name,
-            "raw_text": text,
-        }
+    print(f"PDFs: {len(todo)} to parse, {len(pdf_files) - len(todo)} unchanged")
+    if not todo:
+        manifest.save()
+        return
+
+    config = get_parse_config()
+    workers = config["workers"] or os.cpu_count() or 1
+    tasks = plan_tasks(todo, config["pages_per_task"])
+
+    out = None
+    try:
+        with Pool(processes=workers) as pool:
+            # imap yields results in task order while later ranges are still
+            # being extracted, so pages are written as soon as they are next.
+            for (path, start, end, num_pages), texts in pool.imap(extract_pages, tasks):
+                pdf = Path(path)
+                if start == 0:
+                    tmp = pages_path(pdf).with_suffix(".tmp")
+                    out = tmp.open("w", encoding="utf-8")
+                for number, text in zip(range(start, end), texts):
+                    record = {"source_file": pdf.name, "page": number, "num_pages": num_pages, "text": text}
+                    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if end == num_pages:
+                    out.close()
+                    tmp.replace(pages_path(pdf))
+                    manifest.record(pdf, output=pages_path(pdf).name, pages=num_pages)
+                    print(f"Parsed: {pdf.name} ({num_pages} pages)")
+    finally:
+        # Documents finished before an interruption are not parsed again.
+        manifest.save()
 
-        out_file = OUT_DIR / f"{pdf.stem}.json"
-        with out_file.open("w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
 
-        print(f"Parsed: {pdf.name}")
+def read_pages(path: Path) -> Iterator[dict]:
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
 
 
 if __name__ == "__main__":
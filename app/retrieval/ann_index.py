@@ -0,0 +1,500 @@
+# app/retrieval/ann_index.py
+"""
+FAISS index factory for exact and approximate search.
+
+Supported index types (INDEX_TYPE):
+  flat      exact brute-force search (default)
+  ivf_flat  inverted lists over a coarse quantizer      (IVF_NLIST, IVF_NPROBE)
+  hnsw      hierarchical navigable small-world graph    (HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH)
+  ivf_pq    inverted lists with product-quantized codes (IVF_NLIST, IVF_NPROBE, PQ_M, PQ_NBITS)
+
+Vector storage (VECTOR_STORAGE) for flat, ivf_flat and hnsw:
+  float32   full precision (default)
+  float16   half precision, 2x smaller
+  sq8       8-bit scalar quantization, 4x smaller
+Lossy storage keeps an exact float32 copy on disk (`vectors.npy`). With
+RESCORE_FACTOR=n a query fetches n*k candidates from the compressed index and
+re-ranks them exactly from that copy, which is memory-mapped so only the
+candidate rows are read.
+
+Builders write `index_meta.json` next to the index so query engines can apply
+the matching search-time knobs, and `ann_report.json` comparing the built
+index with exact search (recall@k, p50/p99 latency, serialized size).
+
+Compare every index type on an existing index:
+    python -m app.retrieval.ann_index faiss_index/langchain_index/index.faiss
+"""
+
+import json
+import math
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from app.config import get_index_params, get_index_type, get_rescore_factor, get_vector_storage
+from app.retrieval.chunk_store import replacing
+
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw", "ivf_pq")
+METRICS = {"l2": faiss.METRIC_L2, "ip": faiss.METRIC_INNER_PRODUCT}
+STORAGE_TYPES = ("float32", "float16", "sq8")
+_SQ_TYPES = {"float16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+META_FILE = "index_meta.json"
+REPORT_FILE = "ann_report.json"
+# Exact vectors kept next to lossy indexes for re-scoring and incremental updates.
+VECTORS_FILE = "vectors.npy"
+REPORT_K = 10
+REPORT_QUERIES = 200
+
+
+def resolve_params(index_type: str, num_vectors: int, dim: int, params: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+    """Fill in defaults for the knobs an index type uses, clamped to the corpus size."""
+    params = dict(params or {})
+    resolved: Dict[str, int] = {}
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # FAISS wants ~39 training points per centroid.
+        default_nlist = max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+        resolved["nlist"] = max(1, min(params.get("nlist", default_nlist), num_vectors))
+        resolved["nprobe"] = max(1, min(params.get("nprobe", 8), resolved["nlist"]))
+
+    if index_type == "ivf_pq":
+        pq_m = params.get("pq_m", 0)
+        if not pq_m or dim % pq_m:
+            pq_m = next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if dim % m == 0)
+        resolved["pq_m"] = pq_m
+        max_bits = max(1, int(math.log2(max(2, num_vectors))))
+        resolved["pq_nbits"] = min(params.get("pq_nbits", 8), max_bits)
+
+    if index_type == "hnsw":
+        resolved["hnsw_m"] = params.get("hnsw_m", 32)
+        resolved["ef_construction"] = params.get("ef_construction", 200)
+        resolved["ef_search"] = params.get("ef_search", 64)
+
+    return resolved
+
+
+def resolve_storage(index_type: str, storage: str = "float32") -> str:
+    """Storage actually used: ivf_pq always stores its own product-quantized codes."""
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage '{storage}'. Expected one of {STORAGE_TYPES}.")
+    return "pq" if index_type == "ivf_pq" else storage
+
+
+def has_lossy_codes(meta: Dict[str, Any]) -> bool:
+    return meta.get("index_type") == "ivf_pq" or meta.get("storage", "float32") != "float32"
+
+
+def build_ann_index(
+    vectors: np.ndarray,
+    index_type: str = "flat",
+    metric: str = "l2",
+    params: Optional[Dict[str, int]] = None,
+    storage: str = "float32",
+) -> faiss.Index:
+    """Train (if needed) and fill an index of the requested type and vector storage."""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}'. Expected one of {INDEX_TYPES}.")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}'. Expected one of {tuple(METRICS)}.")
+    storage = resolve_storage(index_type, storage)
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    faiss_metric = METRICS[metric]
+    knobs = resolve_params(index_type, num_vectors, dim, params)
+    qtype = _SQ_TYPES.get(storage)
+
+    if index_type == "flat":
+        if qtype is not None:
+            index = faiss.IndexScalarQuantizer(dim, qtype, faiss_metric)
+        else:
+            index = faiss.IndexFlatL2(dim) if metric == "l2" else faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        if qtype is not None:
+            index = faiss.IndexHNSWSQ(dim, qtype, knobs["hnsw_m"], faiss_metric)
+        else:
+            index = faiss.IndexHNSWFlat(dim, knobs["hnsw_m"], faiss_metric)
+        index.hnsw.efConstruction = knobs["ef_construction"]
+    else:
+        quantizer = faiss.IndexFlatL2(dim) if metric == "l2" else faiss.IndexFlatIP(dim)
+        if index_type == "ivf_pq":
+            index = faiss.IndexIVFPQ(quantizer, dim, knobs["nlist"], knobs["pq_m"], knobs["pq_nbits"], faiss_metric)
+        elif qtype is not None:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dim, knobs["nlist"], qtype, faiss_metric)
+        else:
+            index = faiss.IndexIVFFlat(quantizer, dim, knobs["nlist"], faiss_metric)
+    if not index.is_trained:
+        # IVF trains its coarse quantizer; sq8 learns per-dimension ranges.
+        index.train(vectors)
+
+    index.add(vectors)
+    apply_search_params(index, {"index_type": index_type, "params": knobs})
+    return index
+
+
+def apply_search_params(index: faiss.Index, meta: Optional[Dict[str, Any]]) -> None:
+    """Apply search-time knobs from index metadata; environment overrides win."""
+    if not meta:
+        return
+    knobs = dict(meta.get("params") or {})
+    knobs.update({k: v for k, v in get_index_params().items() if k in ("nprobe", "ef_search")})
+
+    ivf = faiss.try_extract_index_ivf(index) if meta.get("index_type", "").startswith("ivf") else None
+    if ivf is not None and "nprobe" in knobs:
+        ivf.nprobe = int(knobs["nprobe"])
+    if hasattr(index, "hnsw") and "ef_search" in knobs:
+        index.hnsw.efSearch = int(knobs["ef_search"])
+
+
+class SubsetSearcher:
+    """
+    Search restricted to a subset of index positions, e.g. the chunks that
+    pass a metadata filter. A flat index gets an exact sub-index holding only
+    the subset's vectors, so a scoped query scans the subset instead of the
+    whole corpus. IVF and HNSW indexes search with an ID selector, which
+    prunes inside the list scan / graph walk. Both are cached per subset key.
+    The cache is shared by the retrieval and shard worker threads; a subset is
+    prepared outside the lock, so a slow build does not block other lookups.
+    """
+
+    def __init__(self, index: faiss.Index, index_type: str, metric: str, cache_size: int = 32):
+        self.index = index
+        self.index_type = index_type
+        self.metric = metric
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prepare(self, positions: np.ndarray) -> Any:
+        if self.index_type == "flat":
+            vectors = self.index.reconstruct_batch(positions) if len(positions) else np.zeros((0, self.index.d), dtype=np.float32)
+            return build_ann_index(vectors, "flat", self.metric)
+        selector = faiss.IDSelectorBatch(positions)
+        ivf = faiss.try_extract_index_ivf(self.index) if self.index_type.startswith("ivf") else None
+        if ivf is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+        if hasattr(self.index, "hnsw"):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=self.index.hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+
+    def _prepared(self, key: Hashable, positions: np.ndarray) -> Any:
+        with self._lock:
+            prepared = self._cache.get(key)
+            if prepared is not None:
+                self._cache.move_to_end(key)
+                return prepared
+        prepared = self._prepare(np.ascontiguousarray(positions, dtype=np.int64))
+        with self._lock:
+            # Another thread may have prepared the same subset meanwhile; keep the first.
+            prepared = self._cache.setdefault(key, prepared)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return prepared
+
+    def search(self, vectors: np.ndarray, k: int, key: Hashable, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Like `index.search`, over `positions` only; returned ids are full-index positions."""
+        if not len(positions):
+            worst = np.inf if self.metric == "l2" else -np.inf
+            return np.full((len(vectors), k), worst, dtype=np.float32), np.full((len(vectors), k), -1, dtype=np.int64)
+        prepared = self._prepared(key, positions)
+        if self.index_type != "flat":
+            return self.index.search(vectors, k, params=prepared)
+        distances, local = prepared.search(vectors, k)
+        mapped = np.where(local >= 0, np.asarray(positions, dtype=np.int64)[np.maximum(local, 0)], -1)
+        return distances, mapped
+
+
+class Rescorer:
+    """
+    Exact re-ranking of candidates from a compressed index. Distances are
+    recomputed against full-precision vectors (usually the memory-mapped
+    `vectors.npy`) in the index's own units: squared L2 or inner product.
+    """
+
+    def __init__(self, vectors: np.ndarray, metric: str, factor: int):
+        self.vectors = vectors
+        self.metric = metric
+        self.factor = max(1, int(factor))
+
+    def candidates(self, k: int) -> int:
+        return min(k * self.factor, len(self.vectors))
+
+    def rescore(self, queries: np.ndarray, positions: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k of each row of `positions` (-1 = no hit) by exact distance."""
+        worst = np.inf if self.metric == "l2" else -np.inf
+        distances = np.full((len(queries), k), worst, dtype=np.float32)
+        ranked = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, row in enumerate(positions):
+            found = row[row >= 0]
+            if not len(found):
+                continue
+            # Sorted reads keep access to the mapped file sequential.
+            found = np.unique(found)
+            candidates = np.asarray(self.vectors[found], dtype=np.float32)
+            if self.metric == "l2":
+                exact = np.sum((candidates - queries[q]) ** 2, axis=1)
+                order = np.lexsort((found, exact))[:k]
+            else:
+                exact = candidates @ queries[q]
+                order = np.lexsort((found, -exact))[:k]
+            distances[q, :len(order)] = exact[order]
+            ranked[q, :len(order)] = found[order]
+        return distances, ranked
+
+
+def load_rescorer(directory: Path, meta: Dict[str, Any], factor: Optional[int] = None) -> Optional[Rescorer]:
+    """A Rescorer over the exact sidecar when re-scoring is on and the index codes are lossy."""
+    factor = get_rescore_factor() if factor is None else factor
+    path = directory / VECTORS_FILE
+    if factor <= 0 or not has_lossy_codes(meta) or not path.exists():
+        return None
+    return Rescorer(np.load(path, mmap_mode="r"), meta.get("metric", "l2"), factor)
+
+
+def search_index(
+    index: faiss.Index,
+    vectors: np.ndarray,
+    k: int,
+    rescorer: Optional[Rescorer] = None,
+    search: Optional[Any] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    `index.search` (or `search(vectors, k)`, e.g. a SubsetSearcher call),
+    over-fetching and re-ranking exactly when a rescorer is given.
+    """
+    search = search or index.search
+    if rescorer is None:
+        return search(vectors, k)
+    _, candidates = search(vectors, rescorer.candidates(k))
+    return rescorer.rescore(vectors, candidates, k)
+
+
+def index_meta(
+    index: faiss.Index,
+    index_type: str,
+    metric: str,
+    params: Optional[Dict[str, int]] = None,
+    storage: str = "float32",
+) -> Dict[str, Any]:
+    return {
+        "index_type": index_type,
+        "metric": metric,
+        "storage": resolve_storage(index_type, storage),
+        "params": resolve_params(index_type, index.ntotal, index.d, params),
+        "ntotal": int(index.ntotal),
+        "dim": int(index.d),
+    }
+
+
+def write_index_meta(directory: Path, meta: Dict[str, Any]) -> None:
+    with replacing(directory / META_FILE) as path:
+        path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+
+def read_index_meta(directory: Path) -> Optional[Dict[str, Any]]:
+    path = directory / META_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def read_index(path: Path, mmap: bool = False) -> faiss.Index:
+    """
+    Read an index from disk. With `mmap` the vector data stays in the page
+    cache, shared read-only by every process that maps the same file.
+    """
+    if mmap:
+        flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        try:
+            return faiss.read_index(str(path), flags)
+        except RuntimeError as exc:
+            print(f"[FAISS] Memory-mapped read of {path} failed, loading into RAM: {exc}")
+    return faiss.read_index(str(path))
+
+
+def write_index(index: faiss.Index, path: Path) -> None:
+    """Write an index next to `path` and rename it over, never truncating a file a reader has mapped."""
+    with replacing(path) as tmp:
+        faiss.write_index(index, str(tmp))
+
+
+def index_size_bytes(index: faiss.Index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def evaluate_index(
+    index: faiss.Index,
+    exact: faiss.Index,
+    queries: np.ndarray,
+    k: int = REPORT_K,
+    rescorer: Optional[Rescorer] = None,
+) -> Dict[str, Any]:
+    """Recall@k against exact search plus single-query latency percentiles."""
+    k = min(k, exact.ntotal)
+    _, truth = exact.search(queries, k)
+
+    latencies_ms: List[float] = []
+    found = np.empty_like(truth)
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = search_index(index, queries[i:i + 1], k, rescorer)
+        latencies_ms.append((time.perf_counter() - start) * 1000.0)
+        found[i] = ids[0]
+
+    hits = sum(len(set(found[i]) & set(truth[i])) for i in range(len(queries)))
+    return {
+        f"recall@{k}": hits / float(max(1, len(queries) * k)),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "size_bytes": index_size_bytes(index),
+    }
+
+
+def _sample_queries(vectors: np.ndarray, n: int = REPORT_QUERIES, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)
+    return np.ascontiguousarray(vectors[np.sort(picks)], dtype=np.float32)
+
+
+def _variant_name(index_type: str, storage: str) -> str:
+    return index_type if storage in ("float32", "pq") else f"{index_type}/{storage}"
+
+
+def ann_report(
+    vectors: np.ndarray,
+    index_types: List[str],
+    metric: str = "l2",
+    params: Optional[Dict[str, int]] = None,
+    built: Optional[Dict[str, faiss.Index]] = None,
+    storages: Optional[List[str]] = None,
+    rescore_factor: int = 0,
+) -> Dict[str, Any]:
+    """
+    Compare index types and vector storages against exact search on a sample
+    of corpus vectors. `built` maps variant names ("hnsw", "flat/sq8") to
+    indexes that are already built. Lossy variants get an extra "+rescore"
+    row when `rescore_factor` is set; `size_ratio` is the size relative to
+    the flat float32 index, i.e. the raw vector matrix.
+    """
+    built = dict(built or {})
+    if built.get("flat") is None:
+        built["flat"] = build_ann_index(vectors, "flat", metric)
+    exact = built["flat"]
+    queries = _sample_queries(vectors)
+    storages = list(dict.fromkeys(["float32"] + list(storages or [])))
+    rescorer = Rescorer(vectors, metric, rescore_factor) if rescore_factor > 0 else None
+
+    rows: Dict[str, Any] = {}
+    for index_type in dict.fromkeys(["flat"] + list(index_types)):
+        for storage in dict.fromkeys(resolve_storage(index_type, s) for s in storages):
+            name = _variant_name(index_type, storage)
+            index = built.get(name)
+            if index is None:
+                start = time.perf_counter()
+                index = build_ann_index(vectors, index_type, metric, params, "float32" if storage == "pq" else storage)
+                build_s = time.perf_counter() - start
+            else:
+                build_s = None
+            row = evaluate_index(index, exact, queries)
+            row["build_s"] = build_s
+            row["storage"] = storage
+            row["params"] = resolve_params(index_type, len(vectors), vectors.shape[1], params)
+            row["size_ratio"] = row["size_bytes"] / float(rows.get("flat", row)["size_bytes"])
+            rows[name] = row
+            if rescorer is not None and storage != "float32":
+                rescored = evaluate_index(index, exact, queries, rescorer=rescorer)
+                rescored.update(build_s=None, storage=storage, params=row["params"], size_ratio=row["size_ratio"])
+                rescored["rescore_factor"] = rescorer.factor
+                rows[f"{name}+rescore"] = rescored
+
+    return {
+        "num_vectors": int(len(vectors)),
+        "dim": int(vectors.shape[1]),
+        "metric": metric,
+        "num_queries": int(len(queries)),
+        "results": rows,
+    }
+
+
+def write_ann_report(directory: Path, report: Dict[str, Any]) -> None:
+    (directory / REPORT_FILE).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nANN report ({report['num_vectors']} vectors, {report['num_queries']} queries):")
+    for name, row in report["results"].items():
+        recall_key = next(k for k in row if k.startswith("recall@"))
+        print(
+            f"  {name:<22} {recall_key}={row[recall_key]:.3f}  "
+            f"p50={row['p50_ms']:.3f}ms  p99={row['p99_ms']:.3f}ms  "
+            f"size={row['size_bytes'] / 1024:.0f}KiB ({row.get('size_ratio', 1.0):.2f}x)"
+        )
+
+
+def build_configured_index(vectors: np.ndarray, metric: str, directory: Path) -> faiss.Index:
+    """
+    Build the index selected by INDEX_TYPE, then write its metadata and a
+    report comparing it with exact search into `directory`.
+    """
+    index_type = get_index_type()
+    params = get_index_params()
+    storage = resolve_storage(index_type, get_vector_storage())
+    print(f"Building {index_type} index ({metric}, {storage} vectors)...")
+    index = build_ann_index(vectors, index_type, metric, params, storage)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    meta = index_meta(index, index_type, metric, params, storage)
+    write_index_meta(directory, meta)
+    write_exact_vectors(directory, meta, vectors)
+    report = ann_report(
+        vectors,
+        [index_type],
+        metric,
+        params,
+        built={_variant_name(index_type, storage): index},
+        storages=[storage],
+        rescore_factor=get_rescore_factor() or 4,
+    )
+    write_ann_report(directory, report)
+    return index
+
+
+def write_exact_vectors(directory: Path, meta: Dict[str, Any], vectors: np.ndarray) -> None:
+    """Keep the float32 sidecar next to indexes with lossy codes; drop a stale one otherwise."""
+    path = directory / VECTORS_FILE
+    if has_lossy_codes(meta):
+        with replacing(path) as tmp:
+            np.save(tmp, np.ascontiguousarray(vectors, dtype=np.float32))
+    elif path.exists():
+        path.unlink()
+
+
+def _reconstruct_all(index: faiss.Index) -> np.ndarray:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+if __name__ == "__main__":
+    source = Path(sys.argv[1] if len(sys.argv) > 1 else "faiss_index/langchain_index/index.faiss")
+    source_index = faiss.read_index(str(source))
+    source_meta = read_index_meta(source.parent) or {}
+    source_metric = source_meta.get("metric") or ("ip" if source_index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2")
+    # Vectors come from the exact sidecar when there is one; otherwise they
+    # are read back from the index and are approximate for lossy sources.
+    sidecar = source.parent / VECTORS_FILE
+    source_vectors = np.load(sidecar) if sidecar.exists() else _reconstruct_all(source_index)
+    report = ann_report(
+        source_vectors,
+        list(INDEX_TYPES),
+        source_metric,
+        get_index_params(),
+        storages=list(STORAGE_TYPES),
+        rescore_factor=get_rescore_factor() or 4,
+    )
+    write_ann_report(source.parent, report)
@@ -0,0 +1,153 @@
+# app/retrieval/bench_encoder.py
+"""
+Compare query-encoder backends against the fp32 PyTorch model.
+
+For each backend, queries are encoded on that backend and scored against
+fp32 embeddings of a sample of indexed chunks (what the index holds). The
+report shows how far those cosine similarities drift from the all-fp32
+scores, how many of the fp32 top-10 chunks survive, single-query latency and
+the memory the loaded model takes.
+
+    python -m app.retrieval.bench_encoder [backend ...]
+
+Writes `encoder_report.json` next to the LangChain index.
+"""
+
+import json
+import resource
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from app.config import disable_broken_local_proxy, get_embed_model
+from app.retrieval.bench_native import QUERIES
+from app.retrieval.chunk_store import ChunkStore
+from app.retrieval.query_encoder import BACKENDS, encode_texts, load_encoder
+
+INDEX_DIR = Path("faiss_index/langchain_index")
+REPORT_FILE = "encoder_report.json"
+PARITY_TOLERANCE = 0.02
+SAMPLE_CHUNKS = 256
+TOP_K = 10
+ROUNDS = 50
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as handle:
+            pages = int(handle.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize()
+
+
+def _tensor_bytes(value: Any) -> int:
+    if isinstance(value, (tuple, list)):
+        return sum(_tensor_bytes(v) for v in value)
+    if hasattr(value, "element_size"):
+        return value.numel() * value.element_size()
+    return 0
+
+
+def _weights_bytes(model: Any) -> int:
+    """Weight size: state-dict tensors for torch models (int8 packed weights included), the graph file for ONNX."""
+    model_path = getattr(getattr(model[0], "auto_model", None), "model_path", None)
+    if model_path is not None:
+        return Path(model_path).stat().st_size
+    return sum(_tensor_bytes(v) for v in model.state_dict().values())
+
+
+def _sample_chunks(n: int = SAMPLE_CHUNKS, seed: int = 0) -> List[str]:
+    store = ChunkStore(INDEX_DIR / "chunks")
+    rng = np.random.default_rng(seed)
+    picks = np.sort(rng.choice(len(store), size=min(n, len(store)), replace=False))
+    return [store.columns["text"][int(i)] for i in picks]
+
+
+def _latency(model: Any, rounds: int = ROUNDS) -> Dict[str, float]:
+    latencies = []
+    for i in range(rounds):
+        query = QUERIES[i % len(QUERIES)]
+        start = time.perf_counter()
+        encode_texts(model, [query])
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+def _parity(reference: np.ndarray, candidate: np.ndarray, docs: np.ndarray) -> Dict[str, float]:
+    ref_sims = reference @ docs.T
+    cand_sims = candidate @ docs.T
+    drift = np.abs(ref_sims - cand_sims)
+    k = min(TOP_K, docs.shape[0])
+    ref_top = np.argsort(-ref_sims, axis=1)[:, :k]
+    cand_top = np.argsort(-cand_sims, axis=1)[:, :k]
+    overlap = np.mean([len(set(r) & set(c)) / k for r, c in zip(ref_top, cand_top)])
+    return {
+        "max_sim_drift": float(drift.max()),
+        "mean_sim_drift": float(drift.mean()),
+        "min_query_cosine": float(np.min(np.sum(reference * candidate, axis=1))),
+        f"top{TOP_K}_overlap": float(overlap),
+    }
+
+
+def _load_measured(model_name: str, backend: str):
+    before = _rss_bytes()
+    start = time.perf_counter()
+    model = load_encoder(model_name, backend)
+    load_s = time.perf_counter() - start
+    after = _rss_bytes()
+    encode_texts(model, QUERIES[:1])  # first call pays for lazy initialization
+    rss_delta = after - before if before is not None and after is not None else None
+    return model, {"load_s": load_s, "rss_delta_bytes": rss_delta, "weights_bytes": _weights_bytes(model)}
+
+
+def run_benchmark(backends: List[str]) -> Dict[str, Any]:
+    disable_broken_local_proxy()
+    model_name = get_embed_model()
+    reference, rows = None, {}
+
+    for backend in dict.fromkeys(["torch"] + backends):
+        try:
+            model, row = _load_measured(model_name, backend)
+        except RuntimeError as exc:
+            print(f"[bench] skipping {backend}: {exc}")
+            continue
+        if reference is None:
+            docs = encode_texts(model, _sample_chunks())
+            reference = encode_texts(model, QUERIES)
+        row.update(_parity(reference, encode_texts(model, QUERIES), docs))
+        row.update(_latency(model))
+        row["within_tolerance"] = row["max_sim_drift"] <= PARITY_TOLERANCE
+        rows[backend] = row
+        del model
+
+    report = {
+        "model": model_name,
+        "num_queries": len(QUERIES),
+        "num_chunks": int(docs.shape[0]),
+        "tolerance": PARITY_TOLERANCE,
+        "results": rows,
+    }
+    (INDEX_DIR / REPORT_FILE).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    print(f"\nQuery encoder backends ({model_name}, {len(QUERIES)} queries vs {report['num_chunks']} chunks)")
+    for backend, row in rows.items():
+        weights = f"{row['weights_bytes'] / 2**20:.1f}MiB" if row["weights_bytes"] else "n/a"
+        print(
+            f"  {backend:<6} drift max={row['max_sim_drift']:.4f} mean={row['mean_sim_drift']:.4f}  "
+            f"top{TOP_K}={row[f'top{TOP_K}_overlap']:.3f}  "
+            f"p50={row['p50_ms']:.2f}ms p99={row['p99_ms']:.2f}ms  weights={weights}  "
+            f"{'ok' if row['within_tolerance'] else 'OUT OF TOLERANCE'}"
+        )
+    return report
+
+
+if __name__ == "__main__":
+    requested = sys.argv[1:] or [b for b in BACKENDS if b != "torch"]
+    unknown = [b for b in requested if b not in BACKENDS]
+    if unknown:
+        sys.exit(f"Unknown backend(s) {unknown}. Expected {BACKENDS}.")
+    run_benchmark(requested)
@@ -0,0 +1,108 @@
+# app/retrieval/bench_native.py
+"""
+Benchmark the native retrieval path against the LangChain path.
+
+Checks that both engines return the same ranking for every query, then
+reports per-query latency end to end and with query vectors precomputed
+(i.e. the wrapper overhead on top of the encoder forward pass).
+
+    python -m app.retrieval.bench_native [rounds]
+"""
+
+import contextlib
+import io
+import sys
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from app.retrieval.lc_rag_engine import LangChainRAGEngine
+from app.retrieval.native_engine import NativeRAGEngine
+
+TOP_K = 12
+QUERIES = [
+    "What are the disclosure requirements for listed entities?",
+    "When must a listed entity disclose material events to the stock exchange?",
+    "What is the settlement cycle for trades on stock exchanges?",
+    "How should mutual funds value debt and money market instruments?",
+    "What are the obligations of the compliance officer?",
+    "What are the rules for related party transactions?",
+    "How is the close-out procedure handled for shortages?",
+    "What are the requirements for the board of directors composition?",
+]
+
+
+def _timed(fn: Callable[[], object], rounds: int) -> List[float]:
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return latencies
+
+
+def _summary(latencies: List[float]) -> Dict[str, float]:
+    return {"p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+
+def run_benchmark(rounds: int = 20) -> Dict[str, Dict[str, float]]:
+    with contextlib.redirect_stdout(io.StringIO()):
+        lc = LangChainRAGEngine(top_k=TOP_K)
+        native = NativeRAGEngine(top_k=TOP_K)
+
+    mismatches = 0
+    for query in QUERIES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            lc_rows = lc.retrieve(query)
+        native_rows = native.retrieve(query)
+        same_ids = [r.get("id") for r in lc_rows] == [r.get("id") for r in native_rows]
+        same_scores = np.allclose([r["score"] for r in lc_rows], [r["score"] for r in native_rows], atol=1e-6)
+        if not (same_ids and same_scores):
+            mismatches += 1
+            print(f"[bench] ranking mismatch for: {query}")
+
+    vectors = native.encode(QUERIES)
+    relevance_fn = lc.vectorstore._select_relevance_score_fn()
+
+    def lc_end_to_end():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for query in QUERIES:
+                lc.retrieve(query)
+
+    def native_end_to_end():
+        for query in QUERIES:
+            native.retrieve(query)
+
+    def lc_by_vector():
+        for vector in vectors:
+            hits = lc.vectorstore.similarity_search_with_score_by_vector(vector.tolist(), k=TOP_K)
+            [lc._to_result(doc, relevance_fn(score)) for doc, score in hits]
+
+    def native_by_vector():
+        for i in range(len(vectors)):
+            scores, positions = native.search_vectors(vectors[i:i + 1])
+            native.resolve(scores[0], positions[0])
+
+    per_query = float(len(QUERIES))
+    report = {}
+    for name, fn in (
+        ("langchain_end_to_end", lc_end_to_end),
+        ("native_end_to_end", native_end_to_end),
+        ("langchain_search_only", lc_by_vector),
+        ("native_search_only", native_by_vector),
+    ):
+        fn()  # warm-up
+        report[name] = _summary([t / per_query for t in _timed(fn, rounds)])
+
+    print(f"\nNative vs LangChain retrieval ({len(QUERIES)} queries x {rounds} rounds, top_k={TOP_K})")
+    print(f"Ranking mismatches: {mismatches}")
+    for name, row in report.items():
+        print(f"  {name:<24} p50={row['p50_ms']:.3f}ms  p99={row['p99_ms']:.3f}ms per query")
+    overhead = report["langchain_search_only"]["p50_ms"] - report["native_search_only"]["p50_ms"]
+    print(f"Per-query overhead removed (p50, excluding encoder): {overhead:.3f}ms")
+    return report
+
+
+if __name__ == "__main__":
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
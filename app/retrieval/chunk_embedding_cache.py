@@ -0,0 +1,175 @@
+# app/retrieval/chunk_embedding_cache.py
+"""
+Content-addressed embedding cache shared by the index builders.
+
+A chunk's vector depends only on the embedding model and its text, so
+vectors are cached under (model, hash of the normalized text) and survive
+rebuilds, rechunking and document edits: only text never embedded before
+is encoded again. Normalization is Unicode NFC plus whitespace collapsing,
+which the whitespace-splitting tokenizers of our sentence-transformers
+models do not distinguish anyway.
+
+Each model gets a directory under EMBED_CACHE_DIR holding:
+
+    vectors.f32   float32 rows, appended and memory-mapped for reads
+    keys.bin      16-byte blake2b digests, one per row, in the same order
+    meta.json     model, dimension and committed row count
+
+Rows are appended before meta.json is rewritten, so a crash mid-append
+leaves at most unreferenced bytes. Lookups binary-search a sorted copy of
+the keys, so neither keys nor vectors are ever loaded into a dict. Appended
+keys are merged into that sorted copy rather than re-sorting all of it, so
+a build that alternates lookups and appends batch by batch stays linear in
+the cache size per batch.
+"""
+
+import hashlib
+import json
+import sys
+import unicodedata
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import get_embed_build_config
+
+KEY_BYTES = 16
+KEY_DTYPE = f"S{KEY_BYTES}"
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=KEY_BYTES).digest()
+
+
+def model_directory(root: Path, model: str) -> Path:
+    slug = "".join(c if c.isalnum() or c in "-_." else "_" for c in model)[-48:]
+    return root / f"{slug}-{hashlib.sha256(model.encode('utf-8')).hexdigest()[:8]}"
+
+
+class EmbeddingCache:
+    """Vectors of one embedding model by normalized chunk text."""
+
+    def __init__(self, directory: Path, model: str):
+        self.directory = directory
+        self.model = model
+        self.meta_path = directory / "meta.json"
+        self.keys_path = directory / "keys.bin"
+        self.vectors_path = directory / "vectors.f32"
+        meta = json.loads(self.meta_path.read_text(encoding="utf-8")) if self.meta_path.exists() else {}
+        if meta and meta.get("model") != model:
+            raise ValueError(f"Embedding cache {directory} belongs to {meta.get('model')}, not {model}.")
+        self.dim: Optional[int] = meta.get("dim")
+        self.count: int = meta.get("count", 0)
+        self._vectors: Optional[np.ndarray] = None
+        self._order: Optional[np.ndarray] = None
+        self._sorted_keys: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _load(self) -> None:
+        if self._order is not None or not self.count:
+            return
+        keys = np.memmap(self.keys_path, dtype=KEY_DTYPE, mode="r", shape=(self.count,))
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+        self._order = np.argsort(keys, kind="stable")
+        self._sorted_keys = keys[self._order]
+
+    def lookup(self, texts: Sequence[str]) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """
+        (vectors, missing): cached vectors in text order, with zero rows for
+        texts not in the cache, and the positions of those texts. Vectors is
+        None while the cache is empty.
+        """
+        self._load()
+        if not self.count or not len(texts):
+            return None, np.arange(len(texts))
+        keys = np.array([text_key(t) for t in texts], dtype=KEY_DTYPE)
+        slots = np.minimum(np.searchsorted(self._sorted_keys, keys), self.count - 1)
+        found = self._sorted_keys[slots] == keys
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        vectors[found] = self._vectors[self._order[slots[found]]]
+        return vectors, np.flatnonzero(~found)
+
+    def add(self, texts: Sequence[str], vectors: np.ndarray) -> None:
+        """Append vectors of texts that are not cached yet."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(texts):
+            return
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding cache {self.directory} holds {self.dim}-d vectors, got {vectors.shape[1]}-d.")
+        _, missing = self.lookup(texts)
+        keys, rows, seen = [], [], set()
+        for i in missing:
+            key = text_key(texts[i])
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+                rows.append(i)
+        if not rows:
+            return
+        new_keys = np.array(keys, dtype=KEY_DTYPE)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path, data in ((self.vectors_path, vectors[rows]), (self.keys_path, new_keys)):
+            with path.open("r+b" if path.exists() else "wb") as f:
+                # Drop bytes a crashed append left past the committed rows.
+                f.truncate(self.count * (data.nbytes // len(data)))
+                f.seek(0, 2)
+                f.write(data.tobytes())
+        self.dim = vectors.shape[1]
+        first = self.count
+        self.count += len(rows)
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"model": self.model, "dim": self.dim, "count": self.count}), encoding="utf-8")
+        tmp.replace(self.meta_path)
+
+        # lookup() above loaded the sorted view unless the cache was empty.
+        order = np.argsort(new_keys, kind="stable")
+        if self._sorted_keys is None:
+            self._order, self._sorted_keys = order, new_keys[order]
+        else:
+            slots = np.searchsorted(self._sorted_keys, new_keys[order])
+            self._sorted_keys = np.insert(self._sorted_keys, slots, new_keys[order])
+            self._order = np.insert(self._order, slots, first + order)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self.count, self.dim))
+
+
+def open_embedding_cache(model: str) -> Optional[EmbeddingCache]:
+    """The cache for `model` under EMBED_CACHE_DIR, or None when caching is disabled."""
+    root = get_embed_build_config()["cache_dir"]
+    if not root:
+        return None
+    return EmbeddingCache(model_directory(Path(root), model), model)
+
+
+def embed_with_cache(
+    cache: Optional[EmbeddingCache],
+    texts: List[str],
+    encode: Callable[[List[str]], object],
+) -> np.ndarray:
+    """Vectors of `texts`, encoding only the ones the cache does not hold and caching those."""
+    vectors, missing = cache.lookup(texts) if cache is not None else (None, np.arange(len(texts)))
+    if vectors is not None and not len(missing):
+        return vectors
+    encoded = np.asarray(encode([texts[i] for i in missing]), dtype=np.float32)
+    if cache is not None:
+        cache.add([texts[i] for i in missing], encoded)
+    if vectors is None:
+        return encoded
+    vectors[missing] = encoded
+    return vectors
+
+
+if __name__ == "__main__":
+    root = Path(get_embed_build_config()["cache_dir"] or "faiss_index/embedding_cache")
+    if not root.exists():
+        sys.exit(f"No embedding cache at {root}")
+    for meta_path in sorted(root.glob("*/meta.json")):
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        size = sum(p.stat().st_size for p in meta_path.parent.iterdir())
+        print(f"{meta['model']}: {meta['count']} vectors ({meta['dim']}-d), {size / 1024:.0f} KiB")
@@ -0,0 +1,214 @@
+# app/retrieval/chunk_features.py
+"""
+Per-chunk scoring features shared by keyword retrieval and reranking.
+
+Everything that depends only on the chunk text (normalized text, token set,
+footnote counts, digit density, disclosure phrasing) is computed once when the
+corpus is loaded and stored column-wise, keyed by chunk id. Request handling
+only evaluates the query-dependent parts.
+"""
+
+import re
+from pathlib import Path
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Sequence, Set, Union
+
+import numpy as np
+
+from app.retrieval.chunk_store import SortedStringMap, StringColumn, write_string_column, write_string_map
+
+DIGIT_HEAVY_DENSITY = 0.08
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_SCORING_NOISE_RES = [
+    re.compile(r"listing\s+obligations\s+and\s+disclosure\s+requirements", re.IGNORECASE),
+    re.compile(r"securities\s+and\s+exchange\s+board\s+of\s+india", re.IGNORECASE),
+    re.compile(
+        r"(Inserted|Substituted|Omitted)\s+by\s+the\s+Securities\s+and\s+Exchange\s+Board\s+of\s+India.*?(?=\n|$)",
+        re.IGNORECASE,
+    ),
+    re.compile(r"w\.e\.f\.\s*[0-9./-]+", re.IGNORECASE),
+    re.compile(r"\bPrior to the (substitution|omission).*(?=\n|$)", re.IGNORECASE),
+]
+_WHITESPACE_RE = re.compile(r"\s+")
+_FOOTNOTE_RE = re.compile(r"(inserted by|substituted by|omitted by|w\.e\.f\.|prior to)")
+_DISCLOSURE_OBLIGATION_RE = re.compile(r"disclosure.{0,80}(require|obligation)")
+
+_ARRAY_COLUMNS = (
+    "term_offsets",
+    "term_ids",
+    "footnote_hits_raw",
+    "footnote_hits_scored",
+    "digit_heavy",
+    "has_disclosure_requirements",
+    "has_disclosure_and_require",
+    "disclosure_obligation",
+)
+
+
+def tokenize(text: str) -> Set[str]:
+    return {t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 2}
+
+
+def normalize_for_scoring(text: str) -> str:
+    """Strip regulation boilerplate and amendment footnotes before scoring."""
+    cleaned = text
+    for pattern in _SCORING_NOISE_RES:
+        cleaned = pattern.sub(" ", cleaned)
+    cleaned = _WHITESPACE_RE.sub(" ", cleaned)
+    return cleaned.strip()
+
+
+def _digit_heavy(text: str) -> bool:
+    if not text:
+        return False
+    return sum(ch.isdigit() for ch in text) / float(len(text)) > DIGIT_HEAVY_DENSITY
+
+
+class TermSet:
+    """
+    Token set of a stored chunk, kept as sorted term ids. Membership and
+    intersection only resolve the query-side tokens, never the whole chunk.
+    """
+
+    def __init__(self, term_ids: np.ndarray, vocab: Any):
+        self._term_ids = term_ids
+        self._vocab = vocab
+
+    def __contains__(self, token: object) -> bool:
+        term_id = self._vocab.get(token)
+        if term_id is None:
+            return False
+        pos = int(np.searchsorted(self._term_ids, term_id))
+        return pos < len(self._term_ids) and int(self._term_ids[pos]) == term_id
+
+    def intersection(self, tokens: Iterable[str]) -> Set[str]:
+        return {token for token in tokens if token in self}
+
+
+class ChunkView(NamedTuple):
+    """Query-independent features of a single chunk."""
+
+    score_text: str
+    tokens: Union[FrozenSet[str], TermSet]
+    footnote_hits_raw: int
+    footnote_hits_scored: int
+    digit_heavy: bool
+    has_disclosure_requirements: bool
+    has_disclosure_and_require: bool
+    disclosure_obligation: bool
+
+
+def compute_chunk_view(text: str) -> ChunkView:
+    score_text = normalize_for_scoring(text).lower()
+    return ChunkView(
+        score_text=score_text,
+        tokens=frozenset(tokenize(score_text)),
+        footnote_hits_raw=len(_FOOTNOTE_RE.findall(text.lower())),
+        footnote_hits_scored=len(_FOOTNOTE_RE.findall(score_text)),
+        digit_heavy=_digit_heavy(text),
+        has_disclosure_requirements="disclosure requirements" in score_text,
+        has_disclosure_and_require="disclosure" in score_text and "require" in score_text,
+        disclosure_obligation=_DISCLOSURE_OBLIGATION_RE.search(score_text) is not None,
+    )
+
+
+class ChunkFeatures:
+    """Column-oriented feature table for a corpus, addressable by chunk id."""
+
+    def __init__(self, rows: List[Dict[str, Any]], views: Optional[Sequence[ChunkView]] = None):
+        n = len(rows)
+        if views is None:
+            views = [compute_chunk_view(str(row.get("text", ""))) for row in rows]
+
+        self._pos: Any = {str(row["id"]): pos for pos, row in enumerate(rows) if row.get("id")}
+        self.score_text: Sequence[str] = [view.score_text for view in views]
+        # Term ids follow sorted term order so a persisted vocabulary can be
+        # searched with bisect instead of being rebuilt into a dict.
+        self.terms: Sequence[str] = sorted({token for view in views for token in view.tokens})
+        self.vocab: Any = {token: term_id for term_id, token in enumerate(self.terms)}
+
+        term_offsets = [0]
+        term_ids: List[int] = []
+        for view in views:
+            term_ids.extend(sorted(self.vocab[token] for token in view.tokens))
+            term_offsets.append(len(term_ids))
+        self.term_offsets = np.asarray(term_offsets, dtype=np.int64)
+        self.term_ids = np.asarray(term_ids, dtype=np.int32)
+
+        self.footnote_hits_raw = np.fromiter((v.footnote_hits_raw for v in views), dtype=np.int16, count=n)
+        self.footnote_hits_scored = np.fromiter((v.footnote_hits_scored for v in views), dtype=np.int16, count=n)
+        self.digit_heavy = np.fromiter((v.digit_heavy for v in views), dtype=np.bool_, count=n)
+        self.has_disclosure_requirements = np.fromiter(
+            (v.has_disclosure_requirements for v in views), dtype=np.bool_, count=n
+        )
+        self.has_disclosure_and_require = np.fromiter(
+            (v.has_disclosure_and_require for v in views), dtype=np.bool_, count=n
+        )
+        self.disclosure_obligation = np.fromiter((v.disclosure_obligation for v in views), dtype=np.bool_, count=n)
+
+    def save(self, directory: Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        write_string_column(directory, "score_text", self.score_text)
+        write_string_column(directory, "terms.keys", self.terms)
+        write_string_map(directory, "chunk_ids", dict(self._pos.items()), dtype=np.int64)
+        for name in _ARRAY_COLUMNS:
+            np.save(directory / f"{name}.npy", getattr(self, name))
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "ChunkFeatures":
+        """Map a feature table written by `save` without recomputing anything."""
+        features = cls.__new__(cls)
+        features.score_text = StringColumn.load(directory, "score_text", mmap)
+        features.vocab = SortedStringMap.load(directory, "terms", mmap)
+        features.terms = StringColumn.load(directory, "terms.keys", mmap)
+        features._pos = SortedStringMap.load(directory, "chunk_ids", mmap)
+        for name in _ARRAY_COLUMNS:
+            setattr(features, name, np.load(directory / f"{name}.npy", mmap_mode="r" if mmap else None))
+        return features
+
+    def __len__(self) -> int:
+        return len(self.score_text)
+
+    def position(self, chunk_id: Any) -> Optional[int]:
+        if not chunk_id:
+            return None
+        return self._pos.get(str(chunk_id))
+
+    def doc_term_ids(self, pos: int) -> np.ndarray:
+        return self.term_ids[self.term_offsets[pos]:self.term_offsets[pos + 1]]
+
+    def view(self, pos: int) -> ChunkView:
+        return ChunkView(
+            score_text=self.score_text[pos],
+            tokens=TermSet(self.doc_term_ids(pos), self.vocab),
+            footnote_hits_raw=int(self.footnote_hits_raw[pos]),
+            footnote_hits_scored=int(self.footnote_hits_scored[pos]),
+            digit_heavy=bool(self.digit_heavy[pos]),
+            has_disclosure_requirements=bool(self.has_disclosure_requirements[pos]),
+            has_disclosure_and_require=bool(self.has_disclosure_and_require[pos]),
+            disclosure_obligation=bool(self.disclosure_obligation[pos]),
+        )
+
+    def detached_view(self, pos: int) -> ChunkView:
+        """Like `view`, with plain token strings, for building another feature table."""
+        view = self.view(pos)
+        return view._replace(tokens=frozenset(self.terms[int(t)] for t in self.doc_term_ids(pos)))
+
+    def lookup(self, row: Dict[str, Any]) -> ChunkView:
+        """Features for a retrieved row; rows outside the table are computed on the fly."""
+        pos = self.position(row.get("id"))
+        if pos is None:
+            return compute_chunk_view(str(row.get("text", "")))
+        return self.view(pos)
+
+    def noise_penalty(self, footnote_hits: np.ndarray) -> np.ndarray:
+        return np.minimum(0.2, footnote_hits * 0.04) + np.where(self.digit_heavy, 0.12, 0.0)
+
+    def disclosure_bonus(self) -> np.ndarray:
+        """Bonus each chunk earns when the query asks about disclosure requirements."""
+        bonus = np.where(
+            self.has_disclosure_requirements,
+            0.2,
+            np.where(self.has_disclosure_and_require, 0.12, 0.0),
+        )
+        return bonus + np.where(self.disclosure_obligation, 0.18, 0.0)
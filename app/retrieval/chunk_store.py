@@ -0,0 +1,365 @@
+# app/retrieval/chunk_store.py
+"""
+Columnar, memory-mappable storage for chunk text and metadata.
+
+Strings are stored as one UTF-8 blob plus an int64 offsets array and numeric
+columns as plain .npy files. Readers map the files read-only, so every worker
+process on a host shares the same physical pages instead of holding a private
+copy of the corpus.
+
+Mapped files are never rewritten in place: writers stage a new file or
+directory next to the old one and rename it over, so a running reader keeps
+the pages of the version it mapped (see `replacing` and `staged_directory`).
+
+The facet columns (doc_type, source_file) additionally get a value -> chunk
+positions index, so metadata filters resolve to a sorted position array
+without scanning the text columns.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import cached_property, lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+STRING_COLUMNS = ("id", "source_file", "doc_type", "text")
+INT_COLUMNS = ("chunk_index",)
+# Optional structured values (e.g. near-duplicate back-references) kept as
+# JSON strings; rows without a value omit the key.
+JSON_COLUMNS = ("duplicates",)
+FACET_COLUMNS = ("doc_type", "source_file")
+
+FilterKey = Tuple[Tuple[str, Tuple[str, ...]], ...]
+
+
+def text_digest(text: str) -> str:
+    """Content address of a chunk text; equal texts embed and score identically."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def replacing(path: Path) -> Iterator[Path]:
+    """
+    Yield a temporary path next to `path` to write to; it is renamed over
+    `path` when the block completes and removed if it raises. The temporary
+    name keeps the suffix, so np.save and friends do not append their own.
+    """
+    tmp = path.with_name(f".tmp.{path.name}")
+    try:
+        yield tmp
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+
+
+@contextmanager
+def staged_directory(directory: Path) -> Iterator[Path]:
+    """
+    Yield an empty sibling directory to build a new version of `directory`
+    in; it is swapped in when the block completes and discarded if it raises.
+    The old version is moved aside before the swap and deleted after it.
+
+    The swap is two renames, so for the instant between them `directory` does
+    not exist: a reader opening it right then gets FileNotFoundError and has
+    to retry, while readers that already mapped the old files keep them. A
+    symlink flip would close the window, but index directories such as the
+    LangChain index are plain directories in existing checkouts and symlinks
+    need extra privileges on Windows. A run interrupted between the renames
+    leaves only `<name>.old`, which the next swap restores before staging.
+    """
+    staging = directory.with_name(directory.name + ".tmp")
+    old = directory.with_name(directory.name + ".old")
+    if old.exists() and not directory.exists():
+        old.rename(directory)
+    for leftover in (staging, old):
+        if leftover.exists():
+            shutil.rmtree(leftover)
+    staging.mkdir(parents=True)
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    if directory.exists():
+        directory.rename(old)
+    staging.rename(directory)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def _load_array(path: Path, mmap: bool) -> np.ndarray:
+    return np.load(path, mmap_mode="r" if mmap else None)
+
+
+def _load_blob(path: Path, mmap: bool) -> np.ndarray:
+    if path.stat().st_size == 0:
+        return np.zeros(0, dtype=np.uint8)
+    if mmap:
+        return np.memmap(path, dtype=np.uint8, mode="r")
+    return np.fromfile(path, dtype=np.uint8)
+
+
+def write_string_column(directory: Path, name: str, values: Iterable[str]) -> int:
+    """Stream strings into `<name>.bin` with offsets in `<name>.offsets.npy`."""
+    offsets = [0]
+    with (directory / f"{name}.bin").open("wb") as f:
+        for value in values:
+            data = str(value).encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+    np.save(directory / f"{name}.offsets.npy", np.asarray(offsets, dtype=np.int64))
+    return len(offsets) - 1
+
+
+class StringColumn:
+    """Read-only sequence of strings backed by a blob and an offsets array."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def load(cls, directory: Path, name: str, mmap: bool = True) -> "StringColumn":
+        return cls(
+            _load_blob(directory / f"{name}.bin", mmap),
+            _load_array(directory / f"{name}.offsets.npy", mmap),
+        )
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, pos: Union[int, slice]) -> Any:
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+        if pos < 0:
+            pos += len(self)
+        start = int(self._offsets[pos])
+        end = int(self._offsets[pos + 1])
+        return bytes(self._blob[start:end]).decode("utf-8")
+
+
+def write_string_map(
+    directory: Path,
+    name: str,
+    mapping: Mapping[str, Any],
+    dtype: Any = None,
+) -> None:
+    """Persist a str -> value mapping as sorted keys plus an aligned values array."""
+    keys = sorted(mapping)
+    write_string_column(directory, f"{name}.keys", keys)
+    if dtype is not None:
+        np.save(directory / f"{name}.values.npy", np.asarray([mapping[k] for k in keys], dtype=dtype))
+
+
+class SortedStringMap:
+    """
+    Binary-search lookup over sorted string keys. Without a values array the
+    position of the key in sorted order is returned.
+    """
+
+    def __init__(self, keys: StringColumn, values: Optional[np.ndarray] = None):
+        self._keys = keys
+        self._values = values
+        # Query terms repeat heavily; memoize the bisect instead of re-decoding keys.
+        self._find = lru_cache(maxsize=65536)(self._bisect)
+
+    @classmethod
+    def load(cls, directory: Path, name: str, mmap: bool = True) -> "SortedStringMap":
+        values_path = directory / f"{name}.values.npy"
+        values = _load_array(values_path, mmap) if values_path.exists() else None
+        return cls(StringColumn.load(directory, f"{name}.keys", mmap), values)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def _bisect(self, key: str) -> int:
+        pos = bisect_left(self._keys, key)
+        if pos >= len(self._keys) or self._keys[pos] != key:
+            return -1
+        return pos
+
+    def get(self, key: str, default: Any = None) -> Any:
+        pos = self._find(key)
+        if pos < 0:
+            return default
+        if self._values is None:
+            return pos
+        return self._values[pos].item()
+
+    def items(self) -> Iterable[Tuple[str, Any]]:
+        for pos in range(len(self._keys)):
+            yield self._keys[pos], pos if self._values is None else self._values[pos].item()
+
+
+def normalize_filters(filters: Optional[Mapping[str, Any]]) -> Optional[FilterKey]:
+    """
+    Canonical, hashable form of a metadata filter such as
+    {"doc_type": "master", "source_file": ["a.pdf", "b.pdf"]}. Values of one
+    column are OR-ed, columns are AND-ed. Returns None for "no filter".
+    """
+    if not filters:
+        return None
+    key = []
+    for column, values in filters.items():
+        if column not in FACET_COLUMNS:
+            raise ValueError(f"Cannot filter on '{column}'. Filterable columns: {FACET_COLUMNS}.")
+        if values is None:
+            continue
+        if isinstance(values, str):
+            values = [values]
+        values = tuple(sorted({str(v) for v in values}))
+        if values:
+            key.append((column, values))
+    return tuple(sorted(key)) or None
+
+
+class Facets:
+    """Ascending chunk positions for every distinct value of the facet columns."""
+
+    def __init__(self, size: int, columns: Dict[str, Tuple[List[str], np.ndarray, np.ndarray]]):
+        self.size = size
+        self._columns = columns
+        self._slots = {
+            column: {value: i for i, value in enumerate(values)}
+            for column, (values, _, _) in columns.items()
+        }
+        self.select = lru_cache(maxsize=256)(self._select)
+
+    @classmethod
+    def from_values(cls, values: Mapping[str, Sequence[str]], size: int) -> "Facets":
+        columns = {}
+        for column in FACET_COLUMNS:
+            distinct, inverse = np.unique(np.asarray(list(values[column]), dtype=str), return_inverse=True)
+            offsets = np.zeros(len(distinct) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(inverse, minlength=len(distinct)), out=offsets[1:])
+            positions = np.argsort(inverse, kind="stable").astype(np.int64)
+            columns[column] = ([str(v) for v in distinct], offsets, positions)
+        return cls(size, columns)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Mapping[str, Any]]) -> "Facets":
+        values = {column: [str(row.get(column) or "") for row in rows] for column in FACET_COLUMNS}
+        return cls.from_values(values, len(rows))
+
+    def save(self, directory: Path) -> None:
+        for column, (values, offsets, positions) in self._columns.items():
+            write_string_column(directory, f"{column}.facet.keys", values)
+            np.save(directory / f"{column}.facet.offsets.npy", offsets)
+            np.save(directory / f"{column}.facet.positions.npy", positions)
+
+    @classmethod
+    def load(cls, directory: Path, size: int, mmap: bool = True) -> Optional["Facets"]:
+        columns = {}
+        for column in FACET_COLUMNS:
+            if not (directory / f"{column}.facet.positions.npy").exists():
+                return None
+            columns[column] = (
+                StringColumn.load(directory, f"{column}.facet.keys", mmap)[:],
+                _load_array(directory / f"{column}.facet.offsets.npy", mmap),
+                _load_array(directory / f"{column}.facet.positions.npy", mmap),
+            )
+        return cls(size, columns)
+
+    def values(self, column: str) -> List[str]:
+        return [v for v in self._columns[column][0] if v]
+
+    def _select(self, key: FilterKey) -> np.ndarray:
+        """Sorted positions matching a key from `normalize_filters` (memoized)."""
+        selected: Optional[np.ndarray] = None
+        for column, values in key:
+            _, offsets, positions = self._columns[column]
+            slots = self._slots[column]
+            parts = [
+                positions[offsets[slots[v]]:offsets[slots[v] + 1]]
+                for v in values
+                if v in slots
+            ]
+            matched = np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+            selected = matched if selected is None else np.intersect1d(selected, matched, assume_unique=True)
+        return selected if selected is not None else np.arange(self.size, dtype=np.int64)
+
+
+def write_chunk_store(directory: Path, rows: List[Dict[str, Any]]) -> None:
+    """Write the chunk store to `directory`, staged and swapped in as a whole."""
+    with staged_directory(directory) as staging:
+        for name in STRING_COLUMNS:
+            write_string_column(staging, name, (row.get(name) or "" for row in rows))
+        for name in INT_COLUMNS:
+            values = []
+            for row in rows:
+                try:
+                    values.append(int(row.get(name, -1)))
+                except (TypeError, ValueError):
+                    values.append(-1)
+            np.save(staging / f"{name}.npy", np.asarray(values, dtype=np.int64))
+        for name in JSON_COLUMNS:
+            write_string_column(staging, name, (json.dumps(row[name]) if row.get(name) else "" for row in rows))
+        write_string_map(
+            staging,
+            "id_lookup",
+            {str(row["id"]): pos for pos, row in enumerate(rows) if row.get("id")},
+            dtype=np.int64,
+        )
+        Facets.from_rows(rows).save(staging)
+        (staging / "manifest.json").write_text(
+            json.dumps({"num_chunks": len(rows), "columns": list(STRING_COLUMNS + INT_COLUMNS + JSON_COLUMNS)}, indent=2),
+            encoding="utf-8",
+        )
+
+
+class ChunkStore:
+    """Chunk rows (id, source_file, chunk_index, doc_type, text) by position."""
+
+    def __init__(self, directory: Path, mmap: bool = True):
+        if not (directory / "manifest.json").exists():
+            raise FileNotFoundError(f"Chunk store not found at {directory}.")
+        self.directory = directory
+        self.columns: Dict[str, Any] = {
+            name: StringColumn.load(directory, name, mmap) for name in STRING_COLUMNS
+        }
+        for name in INT_COLUMNS:
+            self.columns[name] = _load_array(directory / f"{name}.npy", mmap)
+        # Stores written before a JSON column existed simply lack its files.
+        self._json_columns = [name for name in JSON_COLUMNS if (directory / f"{name}.bin").exists()]
+        for name in self._json_columns:
+            self.columns[name] = StringColumn.load(directory, name, mmap)
+        self._ids = SortedStringMap.load(directory, "id_lookup", mmap)
+        self._mmap = mmap
+
+    def __len__(self) -> int:
+        return len(self.columns["text"])
+
+    def __getitem__(self, pos: Union[int, slice]) -> Any:
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+        row: Dict[str, Any] = {}
+        for name in STRING_COLUMNS:
+            row[name] = self.columns[name][pos]
+        for name in INT_COLUMNS:
+            row[name] = int(self.columns[name][pos])
+        for name in self._json_columns:
+            value = self.columns[name][pos]
+            if value:
+                row[name] = json.loads(value)
+        if not row["id"]:
+            row["id"] = None
+        return row
+
+    def position(self, chunk_id: Any) -> Optional[int]:
+        if not chunk_id:
+            return None
+        return self._ids.get(str(chunk_id))
+
+    @cached_property
+    def facets(self) -> Facets:
+        facets = Facets.load(self.directory, len(self), self._mmap)
+        if facets is None:
+            # Stores written before facets existed: group the columns once.
+            facets = Facets.from_values({c: self.columns[c][:] for c in FACET_COLUMNS}, len(self))
+        return facets
@@ -0,0 +1,240 @@
+# app/retrieval/embed_build.py
+"""
+Resumable, batched embedding of corpus.jsonl for the index builders.
+
+The corpus is streamed in batches of EMBED_BATCH_SIZE chunks and encoded on
+EMBED_WORKERS processes (each loads its own model and gets an equal share of
+the CPU threads). Every finished batch is written to a checkpoint directory
+under faiss_index/.checkpoints/, keyed by builder, model, batch size and
+corpus hash, so a build that is interrupted resumes from the first missing
+batch instead of starting over. Texts the embedding cache already holds
+(see chunk_embedding_cache.py) are not encoded at all, and the model is
+not even loaded when every text is cached. The batches are then copied
+into one memory-mapped vectors file that the index is built from.
+
+CorpusRows gives the builders a re-iterable view of corpus.jsonl that reads
+the file on every pass, so chunk stores, manifests and docstores are written
+without holding every chunk text at once.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import get_embed_build_config
+from app.ingestion.manifest import file_sha256
+from app.retrieval.chunk_embedding_cache import EmbeddingCache, open_embedding_cache
+
+CHECKPOINT_ROOT = Path("faiss_index/.checkpoints")
+VECTORS_NAME = "vectors.npy"
+
+# Called once per worker process; returns a function that embeds a list of texts.
+EncoderLoader = Callable[[], Callable[[List[str]], Any]]
+
+
+class CorpusRows:
+    """Rows of corpus.jsonl, read from disk on every iteration."""
+
+    def __init__(self, path: Path, row: Callable[[Dict[str, Any]], Dict[str, Any]] = dict):
+        self.path = path
+        self.row = row
+        with path.open("rb") as f:
+            self._len = sum(1 for _ in f)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        with self.path.open("r", encoding="utf-8") as f:
+            for line in f:
+                yield self.row(json.loads(line))
+
+    def batches(self, size: int) -> Iterator[List[Dict[str, Any]]]:
+        batch: List[Dict[str, Any]] = []
+        for row in self:
+            batch.append(row)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def checkpoint_dir(builder: str, model: str, corpus_path: Path, batch_size: int) -> Path:
+    key = f"{builder}\n{model}\n{batch_size}\n{file_sha256(corpus_path)}"
+    return CHECKPOINT_ROOT / f"{builder}-{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+
+def _batch_path(directory: Path, number: int) -> Path:
+    return directory / f"batch_{number:06d}.npy"
+
+
+def _save_batch(directory: Path, number: int, vectors: np.ndarray) -> None:
+    tmp = directory / f"batch_{number:06d}.tmp.npy"
+    np.save(tmp, np.asarray(vectors, dtype=np.float32))
+    tmp.replace(_batch_path(directory, number))
+
+
+_worker_encode = None
+
+
+def _init_worker(loader: EncoderLoader, threads: int) -> None:
+    global _worker_encode
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_encode = loader()
+
+
+def _encode_batch(task: Tuple[int, List[str]]) -> Tuple[int, np.ndarray]:
+    number, texts = task
+    return number, np.asarray(_worker_encode(texts), dtype=np.float32)
+
+
+class _Batches:
+    """
+    Checkpoints batches in corpus order: fully cached batches straight away,
+    the rest once their uncached texts come back from the encoder.
+    """
+
+    def __init__(self, directory: Path, cache: Optional[EmbeddingCache], done: int, num_batches: int):
+        self.directory = directory
+        self.cache = cache
+        self.done = done
+        self.num_batches = num_batches
+        self.cached = 0
+        # Batch number -> (vectors with cached rows filled in, positions left to encode, their texts)
+        self._partial: Dict[int, Tuple[Optional[np.ndarray], np.ndarray, List[str]]] = {}
+
+    def pending(self, rows: CorpusRows, batch_size: int) -> Iterator[Tuple[int, List[str]]]:
+        """(batch number, texts to encode) of every unfinished batch with uncached texts."""
+        for number, batch in enumerate(rows.batches(batch_size)):
+            if _batch_path(self.directory, number).exists():
+                continue
+            texts = [row["text"] for row in batch]
+            vectors, missing = self.cache.lookup(texts) if self.cache is not None else (None, np.arange(len(texts)))
+            self.cached += len(texts) - len(missing)
+            if vectors is not None and not len(missing):
+                self._save(number, vectors)
+                continue
+            todo = [texts[i] for i in missing]
+            self._partial[number] = (vectors, missing, todo)
+            yield number, todo
+
+    def finish(self, number: int, encoded: Any) -> None:
+        vectors, missing, texts = self._partial.pop(number)
+        encoded = np.asarray(encoded, dtype=np.float32)
+        if self.cache is not None:
+            self.cache.add(texts, encoded)
+        if vectors is None:
+            vectors = encoded
+        else:
+            vectors[missing] = encoded
+        self._save(number, vectors)
+
+    def _save(self, number: int, vectors: np.ndarray) -> None:
+        _save_batch(self.directory, number, vectors)
+        self.done += 1
+        print(f"Embedded batch {self.done}/{self.num_batches}")
+
+
+def embed_corpus(rows: CorpusRows, loader: EncoderLoader, builder: str, model: str) -> np.ndarray:
+    """
+    Vectors of every row in corpus order, as a memory-mapped float32 array.
+    Batches already checkpointed for this builder, model and corpus are not
+    embedded again, and texts found in the embedding cache (see
+    chunk_embedding_cache.py) are not encoded again.
+    """
+    config = get_embed_build_config()
+    batch_size = config["batch_size"]
+    directory = checkpoint_dir(builder, model, rows.path, batch_size)
+    for stale in CHECKPOINT_ROOT.glob(f"{builder}-*"):
+        if stale != directory:
+            shutil.rmtree(stale, ignore_errors=True)
+    directory.mkdir(parents=True, exist_ok=True)
+    num_batches = -(-len(rows) // batch_size)
+    done = sum(1 for number in range(num_batches) if _batch_path(directory, number).exists())
+    if done:
+        print(f"Resuming from checkpoint {directory}: {done}/{num_batches} batches already embedded.")
+
+    if done < num_batches:
+        batches = _Batches(directory, open_embedding_cache(model), done, num_batches)
+        tasks = batches.pending(rows, batch_size)
+        # The model is only loaded once some text actually needs encoding.
+        first = next(tasks, None)
+        if first is not None:
+            tasks = chain([first], tasks)
+            workers = config["workers"] or os.cpu_count() or 1
+            workers = max(1, min(workers, num_batches - batches.done))
+            if workers == 1:
+                encode = loader()
+                for number, texts in tasks:
+                    batches.finish(number, encode(texts))
+            else:
+                _embed_on_pool(tasks, batches, loader, workers)
+        if batches.cached:
+            print(f"Embedding cache: {batches.cached} of {len(rows)} chunks reused.")
+
+    return _assemble(directory, num_batches, len(rows))
+
+
+def _embed_on_pool(tasks: Iterator[Tuple[int, List[str]]], batches: _Batches, loader: EncoderLoader, workers: int) -> None:
+    from multiprocessing import Pool
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with Pool(processes=workers, initializer=_init_worker, initargs=(loader, threads)) as pool:
+        # Keep only a couple of batches per worker in flight; Pool.imap would
+        # read the whole corpus into its task queue up front.
+        pending = []
+        for task in tasks:
+            pending.append(pool.apply_async(_encode_batch, (task,)))
+            if len(pending) >= 2 * workers:
+                batches.finish(*pending.pop(0).get())
+        for result in pending:
+            batches.finish(*result.get())
+
+
+def _assemble(directory: Path, num_batches: int, num_rows: int) -> np.ndarray:
+    path = directory / VECTORS_NAME
+    vectors = None
+    offset = 0
+    for number in range(num_batches):
+        batch = np.load(_batch_path(directory, number), mmap_mode="r")
+        if vectors is None:
+            vectors = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(num_rows, batch.shape[1]))
+        vectors[offset:offset + len(batch)] = batch
+        offset += len(batch)
+    if vectors is None:
+        return np.zeros((0, 0), dtype=np.float32)
+    if offset != num_rows:
+        raise RuntimeError(f"Checkpoint {directory} holds {offset} vectors for {num_rows} corpus rows.")
+    vectors.flush()
+    return vectors
+
+
+def clear_checkpoint(rows: CorpusRows, builder: str, model: str) -> None:
+    """Drop the checkpoint once the index it fed has been written."""
+    directory = checkpoint_dir(builder, model, rows.path, get_embed_build_config()["batch_size"])
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class StreamedDict:
+    """
+    Pickles as a plain dict of `items()` without building it: pickle writes
+    the pairs as it pulls them from the iterator.
+    """
+
+    def __init__(self, items: Callable[[], Iterator[Tuple[Any, Any]]]):
+        self.items = items
+
+    def __reduce__(self):
+        return dict, (), None, None, self.items()
@@ -1,51 +1,77 @@
 # app/embed_index.py
 
-import json
-import numpy as np
-import pandas as pd
 import faiss
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 
+from app.config import get_embed_build_config
+from app.retrieval.ann_index import build_configured_index, write_index
+from app.retrieval.chunk_store import replacing, write_chunk_store
+from app.retrieval.embed_build import CorpusRows, clear_checkpoint, embed_corpus
+from app.retrieval.keyword_index import KEYWORD_INDEX_DIR, build_keyword_index
+
 CORPUS_FILE = Path("data/data_processed/corpus.jsonl")
 INDEX_PATH = Path("faiss_index/faiss_index.bin")
 META_PATH = Path("faiss_index/metadata.parquet")
+CHUNK_STORE_DIR = Path("faiss_index/chunks")
+MODEL_NAME = "all-MiniLM-L6-v2"
+
+METADATA_SCHEMA = pa.schema(
+    [
+        ("id", pa.string()),
+        ("source_file", pa.string()),
+        ("chunk_index", pa.int64()),
+        ("doc_type", pa.string()),
+        ("text", pa.string()),
+        (
+            "duplicates",
+            pa.list_(
+                pa.struct(
+                    [("id", pa.string()), ("source_file", pa.string()), ("chunk_index", pa.int64()), ("text", pa.string())]
+                )
+            ),
+        ),
+    ]
+)
+
+def sentence_encoder():
+    """Loaded once per embedding worker (see embed_build.embed_corpus)."""
+    return SentenceTransformer(MODEL_NAME).encode
+
+def write_metadata(rows: CorpusRows) -> None:
+    """metadata.parquet, written one batch of rows at a time."""
+    with replacing(META_PATH) as path, pq.ParquetWriter(path, METADATA_SCHEMA) as writer:
+        for batch in rows.batches(get_embed_build_config()["batch_size"]):
+            writer.write_table(pa.Table.from_pylist(batch, schema=METADATA_SCHEMA))
 
 def build_index():
     if not CORPUS_FILE.exists():
         print("❌ corpus.jsonl not found. Run build_corpus.py first.")
         return
 
-    print("🚀 Loading embedding model...")
-    model = SentenceTransformer("all-MiniLM-L6-v2")
-
-    texts = []
-    metadata = []
-
-    print("📄 Reading corpus...")
-    with CORPUS_FILE.open("r", encoding="utf-8") as f:
-        for line in f:
-            rec = json.loads(line)
-            texts.append(rec["text"])
-            metadata.append(rec)
-
-    print(f"📦 Total chunks: {len(texts)}")
+    rows = CorpusRows(CORPUS_FILE)
+    print(f"📦 Total chunks: {len(rows)}")
     print("⚙️  Generating embeddings...")
 
-    embeddings = model.encode(texts, show_progress_bar=True)
-    embeddings = np.asarray(embeddings, dtype="float32")
+    embeddings = embed_corpus(rows, sentence_encoder, "native", MODEL_NAME)
     faiss.normalize_L2(embeddings)
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings)
+    index = build_configured_index(embeddings, "ip", INDEX_PATH.parent)
+
+    write_index(index, INDEX_PATH)
+    write_metadata(rows)
+    write_chunk_store(CHUNK_STORE_DIR, rows)
+    clear_checkpoint(rows, "native", MODEL_NAME)
 
-    faiss.write_index(index, str(INDEX_PATH))
-    pd.DataFrame(metadata).to_parquet(META_PATH, index=False)
+    print("🔤 Building keyword index...")
+    build_keyword_index(CORPUS_FILE, KEYWORD_INDEX_DIR)
 
     print("\n🎯 FAISS index built successfully!")
     print(f"📌 Index saved at: {INDEX_PATH}")
-    print(f"📌 Metadata saved at: {META_PATH}")
+    print(f"📌 Metadata saved at: {META_PATH} (+ {CHUNK_STORE_DIR})")
+    print(f"📌 Keyword index saved at: {KEYWORD_INDEX_DIR}")
 
 if __name__ == "__main__":
     build_index()
@@ -0,0 +1,175 @@
+# app/retrieval/embedding_cache.py
+"""
+Bounded cache of query embeddings for the retrieval engines.
+
+Keys are the embedding model name plus the query with case and whitespace
+normalized, so trivial variations of the same compliance question reuse one
+encoder forward pass. Only the key is normalized: a miss encodes the query
+as written, so a cached vector is the one the uncached path would return for
+the first spelling seen. Entries are evicted least-recently-used beyond
+QUERY_CACHE_SIZE and expire after QUERY_CACHE_TTL seconds. With
+QUERY_CACHE_PATH set, entries are also written through to a SQLite file so
+the cache survives restarts.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import get_query_cache_config
+
+
+def normalize_query(query: str) -> str:
+    # all-MiniLM-L6-v2 lowercases and splits on whitespace itself, so for the
+    # default model every spelling under one key embeds identically.
+    return " ".join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    """Thread-safe LRU/TTL cache of float32 query vectors."""
+
+    def __init__(
+        self,
+        model_name: str,
+        max_entries: int = 4096,
+        ttl_seconds: float = 86400.0,
+        persist_path: Optional[Path] = None,
+    ):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[np.ndarray, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if persist_path is not None and max_entries > 0:
+            self._open_store(persist_path)
+
+    def _open_store(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS query_embeddings ("
+            " model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL,"
+            " created REAL NOT NULL, PRIMARY KEY (model, query))"
+        )
+        if self.ttl_seconds > 0:
+            self._db.execute("DELETE FROM query_embeddings WHERE created < ?", (time.time() - self.ttl_seconds,))
+        self._prune_store()
+        self._db.commit()
+
+    def _prune_store(self) -> None:
+        # Keep the newest max_entries rows for this model, so the file stays
+        # as bounded as the in-memory LRU.
+        self._db.execute(
+            "DELETE FROM query_embeddings WHERE model = ? AND query NOT IN ("
+            " SELECT query FROM query_embeddings WHERE model = ? ORDER BY created DESC LIMIT ?)",
+            (self.model_name, self.model_name, self.max_entries),
+        )
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl_seconds > 0 and time.time() - created > self.ttl_seconds
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            vector, created = entry
+            if not self._expired(created):
+                self._entries.move_to_end(key)
+                return vector
+            del self._entries[key]
+
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT vector, created FROM query_embeddings WHERE model = ? AND query = ?",
+            (self.model_name, key),
+        ).fetchone()
+        if row is None or self._expired(row[1]):
+            return None
+        vector = np.frombuffer(row[0], dtype=np.float32)
+        self._remember(key, vector, row[1])
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray, created: float) -> None:
+        self._entries[key] = (vector, created)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _store(self, items: List[Tuple[str, np.ndarray]]) -> None:
+        now = time.time()
+        for key, vector in items:
+            self._remember(key, vector, now)
+        if self._db is not None:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created) VALUES (?, ?, ?, ?)",
+                [(self.model_name, key, vector.tobytes(), now) for key, vector in items],
+            )
+            self._prune_store()
+            self._db.commit()
+
+    def encode(self, queries: Sequence[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Return one vector per query, calling `encode_fn` once with the
+        queries whose keys are not cached, as written (the first query seen
+        per key).
+        """
+        queries = list(queries)
+        keys = [normalize_query(q) for q in queries]
+        if self.max_entries <= 0:
+            with self._lock:
+                self.misses += len(keys)
+            return np.asarray(encode_fn(queries), dtype=np.float32)
+
+        texts = dict(zip(reversed(keys), reversed(queries)))
+
+        found: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                vector = self._lookup(key)
+                if vector is not None:
+                    found[key] = vector
+            missing = [key for key in dict.fromkeys(keys) if key not in found]
+            self.misses += len(missing)
+            self.hits += len(keys) - len(missing)
+
+        if missing:
+            encoded = np.asarray(encode_fn([texts[key] for key in missing]), dtype=np.float32)
+            fresh = [(key, np.ascontiguousarray(encoded[i])) for i, key in enumerate(missing)]
+            with self._lock:
+                self._store(fresh)
+            found.update(fresh)
+
+        return np.stack([found[key] for key in keys])
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "model": self.model_name,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._db is not None,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def build_query_cache(model_name: str) -> QueryEmbeddingCache:
+    """Cache configured from QUERY_CACHE_SIZE / QUERY_CACHE_TTL / QUERY_CACHE_PATH."""
+    config = get_query_cache_config()
+    return QueryEmbeddingCache(
+        model_name,
+        max_entries=config["max_entries"],
+        ttl_seconds=config["ttl_seconds"],
+        persist_path=Path(config["path"]) if config["path"] else None,
+    )
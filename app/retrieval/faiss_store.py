@@ -1,14 +1,24 @@
-import faiss
 import pickle
+from pathlib import Path
 from typing import List
 
 import numpy as np
+
+from app.retrieval.ann_index import read_index
+from app.retrieval.chunk_store import ChunkStore
 
 class FAISSVectorStore:
-    def __init__(self, index_path: str, metadata_path: str):
-        self.index = faiss.read_index(index_path)
-        with open(metadata_path, "rb") as f:
-            self.metadata = pickle.load(f)
+    def __init__(self, index_path: str, metadata_path: str, mmap: bool = True):
+        """
+        `metadata_path` may be a chunk store directory (memory-mapped, no
+        unpickling) or a legacy pickle file.
+        """
+        self.index = read_index(Path(index_path), mmap=mmap)
+        if Path(metadata_path).is_dir():
+            self.metadata = ChunkStore(Path(metadata_path), mmap=mmap)
+        else:
+            with open(metadata_path, "rb") as f:
+                self.metadata = pickle.load(f)
 
     def search(self, embedding: List[float], top_k: int):
         scores, indices = self.index.search(
@@ -0,0 +1,185 @@
+# app/retrieval/index_update.py
+"""
+Incremental updates of a built vector index.
+
+Chunk ids are content-addressed (see ingestion/build_corpus.chunk_id), so a
+digest of a document's chunk ids changes exactly when its chunks do. An
+update compares the indexed chunk store with the new corpus per source
+document, keeps the vectors of unchanged documents, reuses the stored vector
+of any chunk whose text is already indexed, and embeds only the rest:
+
+  flat      vectors are removed and appended in place
+  ivf_*     vectors are re-added to a copy of the trained index (no retraining)
+  hnsw      the graph is rebuilt from stored vectors (HNSW cannot delete)
+
+Every build and update writes `index_manifest.json` describing what the
+index currently holds: embedding model, index type, the hash of the corpus
+file it was built from and, per document, its chunk count and digest. The
+manifest is the commit point of a build: it is written last, after every
+other artifact, so an interrupted build or update is redone rather than
+taken to be current.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import faiss
+import numpy as np
+
+from app.ingestion.manifest import file_sha256
+from app.retrieval.ann_index import VECTORS_FILE, build_ann_index, has_lossy_codes
+from app.retrieval.chunk_store import replacing, text_digest
+
+MANIFEST_FILE = "index_manifest.json"
+MANIFEST_VERSION = 1
+
+
+class DocumentDiff(NamedTuple):
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    unchanged: List[str]
+
+
+class UpdatePlan(NamedTuple):
+    diff: DocumentDiff
+    keep: np.ndarray               # old positions kept, ascending
+    appended: List[Dict[str, Any]]  # rows placed after the kept ones
+    reuse: np.ndarray              # per appended row: old position with the same text, or -1
+
+
+def document_digests(rows: Sequence[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Per source document: chunk count and a digest of its chunk ids in order.
+    Near-duplicate back-references count towards the digest, so a document
+    whose chunks gain or lose duplicates elsewhere is re-indexed with them.
+    """
+    groups: Dict[str, List[str]] = {}
+    for row in rows:
+        key = str(row.get("id") or "")
+        for duplicate in row.get("duplicates") or ():
+            key += f"+{duplicate.get('id')}"
+        groups.setdefault(str(row.get("source_file")), []).append(key)
+    return {
+        source: {"chunks": len(keys), "digest": hashlib.sha256("\n".join(keys).encode("utf-8")).hexdigest()}
+        for source, keys in groups.items()
+    }
+
+
+def diff_documents(old: Dict[str, Dict[str, Any]], new: Dict[str, Dict[str, Any]]) -> DocumentDiff:
+    return DocumentDiff(
+        added=[s for s in new if s not in old],
+        changed=[s for s in new if s in old and old[s]["digest"] != new[s]["digest"]],
+        removed=[s for s in old if s not in new],
+        unchanged=[s for s in new if s in old and old[s]["digest"] == new[s]["digest"]],
+    )
+
+
+def plan_update(old_rows: Sequence[Dict[str, Any]], new_rows: Sequence[Dict[str, Any]]) -> UpdatePlan:
+    """
+    Keep old rows of unchanged documents in their current order and append
+    the rows of added and changed documents in corpus order.
+    """
+    diff = diff_documents(document_digests(old_rows), document_digests(new_rows))
+    unchanged = set(diff.unchanged)
+    keep = np.asarray(
+        [pos for pos, row in enumerate(old_rows) if str(row.get("source_file")) in unchanged],
+        dtype=np.int64,
+    )
+    appended = [row for row in new_rows if str(row.get("source_file")) not in unchanged]
+
+    old_by_text = {text_digest(str(row.get("text", ""))): pos for pos, row in enumerate(old_rows)}
+    reuse = np.asarray(
+        [old_by_text.get(text_digest(str(row.get("text", ""))), -1) for row in appended],
+        dtype=np.int64,
+    )
+    return UpdatePlan(diff, keep, appended, reuse)
+
+
+def stored_vectors(index: faiss.Index, meta: Dict[str, Any], directory: Path) -> Optional[np.ndarray]:
+    """
+    Exact vectors of an index by position: from `vectors.npy` when the
+    builder kept one, else read back from indexes that store them
+    losslessly. None for lossy codes (ivf_pq, float16, sq8) without a sidecar.
+    """
+    path = directory / VECTORS_FILE
+    if path.exists():
+        return np.load(path)
+    if has_lossy_codes(meta):
+        return None
+    index_type = meta.get("index_type", "flat")
+    if index_type in ("flat", "hnsw"):
+        return index.reconstruct_n(0, index.ntotal)
+    if index_type == "ivf_flat":
+        faiss.extract_index_ivf(index).make_direct_map()
+        return index.reconstruct_n(0, index.ntotal)
+    return None
+
+
+def update_vector_index(
+    index: faiss.Index,
+    index_type: str,
+    metric: str,
+    plan: UpdatePlan,
+    old_vectors: np.ndarray,
+    new_vectors: np.ndarray,
+    params: Optional[Dict[str, int]] = None,
+    storage: str = "float32",
+) -> faiss.Index:
+    """Apply `plan` to `index`; positions afterwards are kept rows, then appended rows."""
+    new_vectors = np.ascontiguousarray(new_vectors, dtype=np.float32)
+    if index_type == "flat":
+        # IndexScalarQuantizer (float16 / sq8) supports the same in-place edits.
+        removed = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), plan.keep)
+        if len(removed):
+            # IndexFlat compacts on removal and keeps the survivors in order.
+            index.remove_ids(faiss.IDSelectorBatch(removed))
+        if len(new_vectors):
+            index.add(new_vectors)
+        return index
+
+    vectors = np.concatenate([old_vectors[plan.keep], new_vectors]).astype(np.float32, copy=False)
+    if index_type.startswith("ivf"):
+        updated = faiss.clone_index(index)
+        updated.reset()
+        updated.add(vectors)
+        return updated
+    return build_ann_index(vectors, index_type, metric, params, storage)
+
+
+def read_index_manifest(directory: Path) -> Optional[Dict[str, Any]]:
+    path = directory / MANIFEST_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def write_index_manifest(
+    directory: Path,
+    rows: Sequence[Dict[str, Any]],
+    embed_model: str,
+    index_type: str,
+    corpus_path: Optional[Path] = None,
+    corpus_sha256: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Record what `directory` holds. Pass the `corpus_sha256` taken before the
+    corpus was read, so a corpus rewritten during the build does not look
+    indexed.
+    """
+    if corpus_sha256 is None and corpus_path and corpus_path.exists():
+        corpus_sha256 = file_sha256(corpus_path)
+    manifest = {
+        "format_version": MANIFEST_VERSION,
+        "embed_model": embed_model,
+        "index_type": index_type,
+        "num_vectors": len(rows),
+        "corpus_path": str(corpus_path) if corpus_path else None,
+        "corpus_sha256": corpus_sha256,
+        "documents": document_digests(rows),
+    }
+    with replacing(directory / MANIFEST_FILE) as path:
+        path.write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
@@ -0,0 +1,328 @@
+# app/retrieval/keyword_index.py
+"""
+Sparse keyword index over the chunk corpus.
+
+Posting lists, IDF weights and the query-independent parts of the keyword
+score are computed once per corpus. A query only touches the postings of its
+own terms, so keyword latency grows with the number of matching postings
+instead of with the number of chunks. Metadata filters drop postings of
+non-matching chunks before any scoring happens.
+
+The index builders persist it next to the FAISS index as a directory of
+.npy arrays and UTF-8 blobs which the API memory-maps at startup:
+
+    faiss_index/keyword_index/
+      manifest.json        format version and the corpus (content hash) it was built from
+      chunks/              chunk rows (see chunk_store.py)
+      features/            per-chunk scoring features (see chunk_features.py)
+      idf.*                sorted vocabulary -> IDF
+      doc_freq.*           sorted vocabulary -> document frequency (for updates)
+      post_offsets.npy     CSR offsets into post_docs, by term id
+      post_docs.npy        chunk positions, ascending within each term
+"""
+
+import json
+import math
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from app.ingestion.manifest import file_sha256
+from app.retrieval.chunk_features import ChunkFeatures, ChunkView, compute_chunk_view, tokenize
+from app.retrieval.chunk_store import (
+    ChunkStore,
+    Facets,
+    FilterKey,
+    SortedStringMap,
+    normalize_filters,
+    staged_directory,
+    text_digest,
+    write_chunk_store,
+    write_string_map,
+)
+
+CORPUS_PATH = Path("data/data_processed/corpus.jsonl")
+KEYWORD_INDEX_DIR = Path("faiss_index/keyword_index")
+FORMAT_VERSION = 2
+
+BASE_WEIGHT = 0.75
+EXPANDED_WEIGHT = 0.25
+
+
+def bm25_idf(doc_freq: int, total_docs: int) -> float:
+    # Smoothed BM25-style IDF.
+    return math.log((1.0 + total_docs - doc_freq + 0.5) / (doc_freq + 0.5) + 1.0)
+
+
+def load_corpus_rows(path: Path = CORPUS_PATH) -> List[Dict[str, Any]]:
+    if not path.exists():
+        return []
+
+    rows: List[Dict[str, Any]] = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            rows.append(obj)
+    return rows
+
+
+class KeywordIndex:
+    """Inverted index with IDF-weighted term-at-a-time scoring."""
+
+    def __init__(
+        self,
+        rows: List[Dict[str, Any]],
+        features: Optional[ChunkFeatures] = None,
+        doc_freq: Optional[Dict[str, int]] = None,
+    ):
+        self.rows = rows
+        self.features = features if features is not None else ChunkFeatures(rows)
+        total_docs = max(1, len(rows))
+
+        if doc_freq is None:
+            doc_freq = {}
+            for row in rows:
+                for token in tokenize(str(row.get("text", ""))):
+                    doc_freq[token] = doc_freq.get(token, 0) + 1
+        self.doc_freq: Any = doc_freq
+        self.idf: Any = {token: bm25_idf(df, total_docs) for token, df in doc_freq.items()}
+
+        # Invert the feature table's forward index (chunk -> terms) into
+        # posting lists (term -> chunks); a stable sort keeps chunks ascending.
+        fwd = self.features
+        doc_lens = np.diff(fwd.term_offsets)
+        docs = np.repeat(np.arange(len(fwd), dtype=np.int32), doc_lens)
+        order = np.argsort(fwd.term_ids, kind="stable")
+        self._post_docs = docs[order]
+        self._post_offsets = np.zeros(len(fwd.terms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(fwd.term_ids, minlength=len(fwd.terms)), out=self._post_offsets[1:])
+        self.facets = Facets.from_rows(rows)
+        self._init_chunk_scores()
+
+    def _init_chunk_scores(self) -> None:
+        fwd = self.features
+        self._vocab = fwd.vocab
+        self._penalty = fwd.noise_penalty(fwd.footnote_hits_scored)
+        self._bonus = fwd.disclosure_bonus()
+        self._bonus_docs = np.flatnonzero(self._bonus > 0).astype(np.int32)
+        self._filter_mask = lru_cache(maxsize=256)(self._build_filter_mask)
+
+    @classmethod
+    def from_corpus(cls, path: Path = CORPUS_PATH) -> "KeywordIndex":
+        return cls(load_corpus_rows(path))
+
+    @classmethod
+    def update(cls, previous: "KeywordIndex", rows: List[Dict[str, Any]]) -> "KeywordIndex":
+        """
+        Index `rows`, computing features and document frequencies only for
+        chunk texts that `previous` does not already hold. Postings are
+        re-inverted from the forward index, which is a few array operations.
+        """
+        old_texts = [str(previous.rows[pos].get("text", "")) for pos in range(len(previous))]
+        old_digests = [text_digest(text) for text in old_texts]
+        old_pos = {digest: pos for pos, digest in enumerate(old_digests)}
+        new_texts = [str(row.get("text", "")) for row in rows]
+        new_digests = [text_digest(text) for text in new_texts]
+
+        texts = {**dict(zip(old_digests, old_texts)), **dict(zip(new_digests, new_texts))}
+        old_counts = Counter(old_digests)
+        new_counts = Counter(new_digests)
+        doc_freq: Dict[str, int] = dict(previous.doc_freq.items())
+        for digests, sign in ((old_counts - new_counts, -1), (new_counts - old_counts, 1)):
+            for digest, count in digests.items():
+                for token in tokenize(texts[digest]):
+                    doc_freq[token] = doc_freq.get(token, 0) + sign * count
+        doc_freq = {token: df for token, df in doc_freq.items() if df > 0}
+
+        views: List[ChunkView] = []
+        for text, digest in zip(new_texts, new_digests):
+            pos = old_pos.get(digest)
+            if pos is None:
+                views.append(compute_chunk_view(text))
+            else:
+                views.append(previous.features.detached_view(pos))
+        return cls(rows, ChunkFeatures(rows, views), doc_freq)
+
+    def save(self, directory: Path = KEYWORD_INDEX_DIR, corpus_path: Optional[Path] = None) -> None:
+        """
+        Write the index to `directory`. Files are staged in a sibling directory
+        and swapped in at the end, so running workers keep their mapped pages.
+        """
+        with staged_directory(directory) as staging:
+            write_chunk_store(staging / "chunks", list(self.rows))
+            self.features.save(staging / "features")
+            write_string_map(staging, "idf", self.idf, dtype=np.float64)
+            write_string_map(staging, "doc_freq", self.doc_freq, dtype=np.int64)
+            np.save(staging / "post_offsets.npy", self._post_offsets)
+            np.save(staging / "post_docs.npy", self._post_docs)
+
+            manifest = {
+                "format_version": FORMAT_VERSION,
+                "num_chunks": len(self),
+                "num_terms": len(self.features.terms),
+                "num_postings": int(len(self._post_docs)),
+                "corpus_path": str(corpus_path) if corpus_path else None,
+                "corpus_sha256": file_sha256(corpus_path) if corpus_path and corpus_path.exists() else None,
+            }
+            (staging / "manifest.json").write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, directory: Path = KEYWORD_INDEX_DIR, mmap: bool = True) -> "KeywordIndex":
+        """Memory-map a persisted index; nothing is parsed or tokenized."""
+        manifest = read_manifest(directory)
+        if manifest is None or manifest.get("format_version") != FORMAT_VERSION:
+            raise FileNotFoundError(f"No compatible keyword index at {directory}.")
+
+        mode = "r" if mmap else None
+        index = cls.__new__(cls)
+        index.rows = ChunkStore(directory / "chunks", mmap=mmap)
+        index.features = ChunkFeatures.load(directory / "features", mmap=mmap)
+        index.idf = SortedStringMap.load(directory, "idf", mmap=mmap)
+        index.doc_freq = SortedStringMap.load(directory, "doc_freq", mmap=mmap)
+        index._post_offsets = np.load(directory / "post_offsets.npy", mmap_mode=mode)
+        index._post_docs = np.load(directory / "post_docs.npy", mmap_mode=mode)
+        index.facets = index.rows.facets
+        index._init_chunk_scores()
+        return index
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _build_filter_mask(self, key: FilterKey) -> np.ndarray:
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.facets.select(key)] = True
+        return mask
+
+    def positions(self, filters: Optional[Mapping[str, Any]] = None) -> Optional[np.ndarray]:
+        """Sorted positions of chunks matching `filters`, or None when unfiltered."""
+        key = normalize_filters(filters)
+        return None if key is None else self.facets.select(key)
+
+    def _postings(self, token: str) -> np.ndarray:
+        term_id = self._vocab.get(token)
+        if term_id is None:
+            return self._post_docs[:0]
+        return self._post_docs[self._post_offsets[term_id]:self._post_offsets[term_id + 1]]
+
+    def search(
+        self,
+        base_tokens: Iterable[str],
+        expanded_tokens: Iterable[str],
+        phrase_query: bool,
+        top_k: int,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> List[Tuple[int, float]]:
+        """
+        Score chunks that share a query term (or earn the disclosure phrase
+        bonus) and return the top-k as (row position, score) pairs. With
+        `filters`, only postings of matching chunks are scored.
+        """
+        key = normalize_filters(filters)
+        mask = self._filter_mask(key) if key is not None else None
+        base = set(base_tokens)
+        expanded = set(expanded_tokens)
+        idf = self.idf
+        base_norm = sum(idf.get(t, 1.0) for t in base) or 1.0
+        expanded_norm = sum(idf.get(t, 1.0) for t in expanded) or 1.0
+
+        doc_parts: List[np.ndarray] = []
+        weight_parts: List[np.ndarray] = []
+        for token in base | expanded:
+            docs = self._postings(token)
+            if mask is not None:
+                docs = docs[mask[docs]]
+            if not len(docs):
+                continue
+            weight = 0.0
+            if token in base:
+                weight += BASE_WEIGHT * idf.get(token, 1.0) / base_norm
+            if token in expanded:
+                weight += EXPANDED_WEIGHT * idf.get(token, 1.0) / expanded_norm
+            doc_parts.append(docs)
+            weight_parts.append(np.full(len(docs), weight, dtype=np.float64))
+
+        bonus_docs = self._bonus_docs if mask is None else self._bonus_docs[mask[self._bonus_docs]]
+        if phrase_query and len(bonus_docs):
+            doc_parts.append(bonus_docs)
+            weight_parts.append(np.zeros(len(bonus_docs), dtype=np.float64))
+
+        if not doc_parts:
+            return []
+
+        candidates, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weight_parts), minlength=len(candidates))
+        if phrase_query:
+            scores += self._bonus[candidates]
+        scores -= self._penalty[candidates]
+        np.clip(scores, 0.0, 1.0, out=scores)
+
+        keep = scores > 0
+        candidates = candidates[keep]
+        scores = scores[keep]
+        # Highest score first; ties keep corpus order like a stable sort would.
+        order = np.lexsort((candidates, -scores))[:top_k]
+        return [(int(candidates[i]), float(scores[i])) for i in order]
+
+
+def read_manifest(directory: Path) -> Optional[Dict[str, Any]]:
+    path = directory / "manifest.json"
+    if not path.exists():
+        return None
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return None
+
+
+def build_keyword_index(
+    corpus_path: Path = CORPUS_PATH,
+    index_dir: Path = KEYWORD_INDEX_DIR,
+) -> KeywordIndex:
+    """Build the keyword index from corpus.jsonl and persist it."""
+    index = KeywordIndex.from_corpus(corpus_path)
+    index.save(index_dir, corpus_path=corpus_path)
+    return index
+
+
+def update_keyword_index(
+    corpus_path: Path = CORPUS_PATH,
+    index_dir: Path = KEYWORD_INDEX_DIR,
+) -> KeywordIndex:
+    """Rebuild the persisted index for corpus.jsonl, reusing work for unchanged chunks."""
+    rows = load_corpus_rows(corpus_path)
+    try:
+        previous = KeywordIndex.load(index_dir, mmap=False)
+    except FileNotFoundError:
+        index = KeywordIndex(rows)
+    else:
+        index = KeywordIndex.update(previous, rows)
+    index.save(index_dir, corpus_path=corpus_path)
+    return index
+
+
+def load_keyword_index(
+    corpus_path: Path = CORPUS_PATH,
+    index_dir: Path = KEYWORD_INDEX_DIR,
+) -> KeywordIndex:
+    """
+    Map the persisted index when it matches the corpus on disk; otherwise
+    build one in memory from corpus.jsonl.
+    """
+    manifest = read_manifest(index_dir)
+    corpus_sha256 = file_sha256(corpus_path) if corpus_path.exists() else None
+    if manifest is not None and manifest.get("format_version") == FORMAT_VERSION:
+        if corpus_sha256 is None or manifest.get("corpus_sha256") == corpus_sha256:
+            return KeywordIndex.load(index_dir)
+        print(f"[Keyword] Index at {index_dir} is stale for {corpus_path}; rebuilding in memory.")
+    return KeywordIndex.from_corpus(corpus_path)
+
+
+if __name__ == "__main__":
+    built = build_keyword_index()
+    print(f"Keyword index built: {len(built)} chunks -> {KEYWORD_INDEX_DIR}")
@@ -4,21 +4,85 @@ Build FAISS index using LangChain + HuggingFace embeddings.
 
 Reads:  data/data_processed/corpus.jsonl
 Writes: faiss_index/langchain_index/
+        faiss_index/keyword_index/
+
+By default an existing index is updated for the documents that changed
+since it was built, embedding only chunks whose text is not indexed yet (see
+index_update.py); nothing is done when corpus.jsonl is unchanged. A missing
+or incompatible index is built from scratch; `--full` forces that:
+    python -m app.retrieval.lc_embed_index [--full]
+
+Builds and updates write every artifact into a staging directory that
+replaces faiss_index/langchain_index/ in one rename, so the index, chunk
+store and manifest on disk always belong together. The keyword index is
+written before that rename: once the manifest is in place, everything it
+describes is too.
+
+Convert an existing pickled index to the memory-mappable chunk store
+without re-embedding:
+    python -m app.retrieval.lc_embed_index --chunks-only
 """
 
 import json
+import pickle
+import shutil
+import sys
 from pathlib import Path
 
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from langchain_huggingface import HuggingFaceEmbeddings
 
-from app.config import disable_broken_local_proxy, get_embed_model
+from app.config import disable_broken_local_proxy, get_embed_model, get_index_params, get_index_type, get_vector_storage
+from app.ingestion.manifest import file_sha256
+from app.retrieval.ann_index import (
+    REPORT_FILE,
+    VECTORS_FILE,
+    apply_search_params,
+    build_configured_index,
+    index_meta,
+    read_index_meta,
+    resolve_storage,
+    write_exact_vectors,
+    write_index_meta,
+)
+from app.retrieval.chunk_embedding_cache import embed_with_cache, open_embedding_cache
+from app.retrieval.chunk_store import ChunkStore, staged_directory, write_chunk_store
+from app.retrieval.embed_build import CorpusRows, StreamedDict, clear_checkpoint, embed_corpus
+from app.retrieval.index_update import (
+    plan_update,
+    read_index_manifest,
+    stored_vectors,
+    update_vector_index,
+    write_index_manifest,
+)
+from app.retrieval.keyword_index import KEYWORD_INDEX_DIR, build_keyword_index, update_keyword_index
 
 CORPUS_PATH = Path("data/data_processed/corpus.jsonl")
 INDEX_DIR = Path("faiss_index/langchain_index")
+CHUNK_STORE_DIR = INDEX_DIR / "chunks"
 EMBED_MODEL = get_embed_model()
 
 
+def corpus_metadata(obj: dict) -> dict:
+    metadata = {
+        "id": obj.get("id"),
+        "source_file": obj.get("source_file"),
+        "chunk_index": obj.get("chunk_index"),
+        "doc_type": obj.get("doc_type"),
+    }
+    if obj.get("duplicates"):
+        metadata["duplicates"] = obj["duplicates"]
+    return metadata
+
+
+def corpus_row(obj: dict) -> dict:
+    return dict(corpus_metadata(obj), text=obj["text"])
+
+
 def load_corpus():
     if not CORPUS_PATH.exists():
         raise FileNotFoundError(
@@ -32,27 +96,28 @@ def load_corpus():
         for line in f:
             obj = json.loads(line)
             texts.append(obj["text"])
-            metadatas.append(
-                {
-                    "id": obj.get("id"),
-                    "source_file": obj.get("source_file"),
-                    "chunk_index": obj.get("chunk_index"),
-                    "doc_type": obj.get("doc_type"),
-                }
-            )
+            metadatas.append(corpus_metadata(obj))
 
     return texts, metadatas
 
 
-def build_langchain_faiss_index():
-    print("Loading corpus from:", CORPUS_PATH)
-    texts, metadatas = load_corpus()
-    print(f"Total chunks: {len(texts)}")
+def write_chunk_columns(vectorstore: FAISS) -> list:
+    """Write docstore contents in FAISS position order as a columnar chunk store."""
+    rows = []
+    for pos in range(vectorstore.index.ntotal):
+        doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[pos])
+        row = dict(doc.metadata or {})
+        row["text"] = doc.page_content
+        rows.append(row)
+    write_chunk_store(CHUNK_STORE_DIR, rows)
+    return rows
+
 
+def load_embeddings() -> HuggingFaceEmbeddings:
     print(f"Initializing embedding model ({EMBED_MODEL})...")
     disable_broken_local_proxy()
     try:
-        embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+        return HuggingFaceEmbeddings(model_name=EMBED_MODEL)
     except Exception as exc:
         raise RuntimeError(
             "Failed to load the embedding model. Ensure "
@@ -60,19 +125,181 @@ def build_langchain_faiss_index():
             "download it."
         ) from exc
 
-    print("Building FAISS index via LangChain...")
-    vectorstore = FAISS.from_texts(
-        texts=texts,
-        embedding=embeddings,
-        metadatas=metadatas,
+
+def document_encoder():
+    """Loaded once per embedding worker (see embed_build.embed_corpus)."""
+    return load_embeddings().embed_documents
+
+
+def docstore_id(pos: int, row: dict) -> str:
+    return str(row.get("id") or pos)
+
+
+def write_docstore(rows: CorpusRows, directory: Path = INDEX_DIR) -> None:
+    """
+    index.pkl as FAISS.save_local writes it, (InMemoryDocstore,
+    index_to_docstore_id), with the documents pickled straight from
+    corpus.jsonl instead of being collected first.
+    """
+    documents = StreamedDict(
+        lambda: (
+            (
+                docstore_id(pos, row),
+                Document(page_content=row["text"], metadata={k: v for k, v in row.items() if k != "text"}),
+            )
+            for pos, row in enumerate(rows)
+        )
+    )
+    docstore = InMemoryDocstore(documents)
+    index_to_docstore_id = {pos: docstore_id(pos, row) for pos, row in enumerate(rows)}
+    with (directory / "index.pkl").open("wb") as f:
+        pickle.dump((docstore, index_to_docstore_id), f)
+
+
+def export_chunk_store():
+    print("Loading pickled LangChain index from:", INDEX_DIR)
+    vectorstore = FAISS.load_local(
+        str(INDEX_DIR),
+        embeddings=None,
+        allow_dangerous_deserialization=True,
     )
+    write_chunk_columns(vectorstore)
+    print(f"Chunk store written to: {CHUNK_STORE_DIR}")
 
-    INDEX_DIR.mkdir(parents=True, exist_ok=True)
-    vectorstore.save_local(str(INDEX_DIR))
+
+def build_langchain_faiss_index():
+    """
+    Embed corpus.jsonl in resumable batches (see embed_build.py) and write the
+    index in LangChain's layout, reading chunk texts back from the corpus for
+    each artifact rather than keeping them all. The artifacts are written to a
+    staging directory that replaces INDEX_DIR as a whole at the end.
+    """
+    print("Loading corpus from:", CORPUS_PATH)
+    if not CORPUS_PATH.exists():
+        raise FileNotFoundError(
+            f"Corpus file not found at {CORPUS_PATH}. Run your ingestion pipeline first."
+        )
+    corpus_sha256 = file_sha256(CORPUS_PATH)
+    rows = CorpusRows(CORPUS_PATH, corpus_row)
+    print(f"Total chunks: {len(rows)}")
+
+    print("Embedding corpus...")
+    vectors = embed_corpus(rows, document_encoder, "langchain", EMBED_MODEL)
+
+    with staged_directory(INDEX_DIR) as staging:
+        # LangChain scores with L2 distance over the configured index type.
+        index = build_configured_index(vectors, "l2", staging)
+        faiss.write_index(index, str(staging / "index.faiss"))
+        write_docstore(rows, staging)
+        write_chunk_store(staging / CHUNK_STORE_DIR.name, rows)
+
+        print("Building keyword index...")
+        build_keyword_index(CORPUS_PATH, KEYWORD_INDEX_DIR)
+        write_index_manifest(staging, rows, EMBED_MODEL, get_index_type(), CORPUS_PATH, corpus_sha256)
+    clear_checkpoint(rows, "langchain", EMBED_MODEL)
 
     print("\nLangChain FAISS index built successfully.")
     print(f"Index directory: {INDEX_DIR}")
+    print(f"Keyword index directory: {KEYWORD_INDEX_DIR}")
+
+
+def update_langchain_faiss_index():
+    """Bring the index in line with corpus.jsonl, touching only changed documents."""
+    meta = read_index_meta(INDEX_DIR) or {"index_type": "flat", "metric": "l2"}
+    manifest = read_index_manifest(INDEX_DIR)
+    if not (INDEX_DIR / "index.faiss").exists() or not (CHUNK_STORE_DIR / "manifest.json").exists():
+        print("No existing index with a chunk store; running a full build.")
+        return build_langchain_faiss_index()
+    if manifest is not None and manifest.get("embed_model") != EMBED_MODEL:
+        print(f"Index was embedded with {manifest.get('embed_model')}, not {EMBED_MODEL}; running a full build.")
+        return build_langchain_faiss_index()
+    if meta["index_type"] != get_index_type():
+        print(f"Index type changed ({meta['index_type']} -> {get_index_type()}); running a full build.")
+        return build_langchain_faiss_index()
+    storage = meta.get("storage", "float32")
+    if storage != resolve_storage(meta["index_type"], get_vector_storage()):
+        print(f"Vector storage changed ({storage} -> {get_vector_storage()}); running a full build.")
+        return build_langchain_faiss_index()
+
+    # The manifest is written last (see index_update.py), so a matching hash
+    # means the previous build or update ran to completion.
+    corpus_sha256 = file_sha256(CORPUS_PATH)
+    if manifest is not None and manifest.get("corpus_sha256") == corpus_sha256:
+        print(f"Index is up to date with {CORPUS_PATH}; nothing to do.")
+        return
+
+    index_type = meta["index_type"]
+    index = faiss.read_index(str(INDEX_DIR / "index.faiss"))
+    old_vectors = stored_vectors(index, meta, INDEX_DIR)
+    if old_vectors is None:
+        print(f"Stored {index_type} codes are lossy and no {VECTORS_FILE} was kept; running a full build.")
+        return build_langchain_faiss_index()
+
+    texts, metadatas = load_corpus()
+    new_rows = [dict(metadata, text=text) for text, metadata in zip(texts, metadatas)]
+    old_rows = ChunkStore(CHUNK_STORE_DIR, mmap=False)[:]
+    plan = plan_update(old_rows, new_rows)
+    diff = plan.diff
+    print(
+        f"Documents: {len(diff.added)} added, {len(diff.changed)} changed, "
+        f"{len(diff.removed)} removed, {len(diff.unchanged)} unchanged"
+    )
+
+    missing = np.flatnonzero(plan.reuse < 0)
+    new_vectors = np.zeros((len(plan.appended), index.d), dtype=np.float32)
+    reused = np.flatnonzero(plan.reuse >= 0)
+    new_vectors[reused] = old_vectors[plan.reuse[reused]]
+    embeddings = None
+    if len(missing):
+        print(f"Embedding {len(missing)} new chunks ({len(reused)} reused)...")
+
+        def encode(texts):
+            nonlocal embeddings
+            embeddings = embeddings or load_embeddings()
+            return embeddings.embed_documents(texts)
+
+        texts = [plan.appended[i]["text"] for i in missing]
+        new_vectors[missing] = embed_with_cache(open_embedding_cache(EMBED_MODEL), texts, encode)
+    else:
+        print(f"Nothing to embed ({len(reused)} chunks reused).")
+
+    index = update_vector_index(
+        index, index_type, meta.get("metric", "l2"), plan, old_vectors, new_vectors, get_index_params(), storage
+    )
+    apply_search_params(index, meta)
+    rows = [old_rows[pos] for pos in plan.keep] + plan.appended
+
+    docstore_ids = [docstore_id(pos, row) for pos, row in enumerate(rows)]
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(
+            {
+                doc_id: Document(page_content=row["text"], metadata={k: v for k, v in row.items() if k != "text"})
+                for doc_id, row in zip(docstore_ids, rows)
+            }
+        ),
+        index_to_docstore_id=dict(enumerate(docstore_ids)),
+    )
+    with staged_directory(INDEX_DIR) as staging:
+        vectorstore.save_local(str(staging))
+        write_chunk_store(staging / CHUNK_STORE_DIR.name, rows)
+        updated_meta = index_meta(index, index_type, meta.get("metric", "l2"), meta.get("params"), storage)
+        write_index_meta(staging, updated_meta)
+        write_exact_vectors(staging, updated_meta, np.concatenate([old_vectors[plan.keep], new_vectors]))
+        if (INDEX_DIR / REPORT_FILE).exists():
+            shutil.copy2(INDEX_DIR / REPORT_FILE, staging / REPORT_FILE)
+
+        print("Updating keyword index...")
+        update_keyword_index(CORPUS_PATH, KEYWORD_INDEX_DIR)
+        write_index_manifest(staging, rows, EMBED_MODEL, index_type, CORPUS_PATH, corpus_sha256)
+    print(f"\nIndex updated: {len(rows)} vectors in {INDEX_DIR}")
 
 
 if __name__ == "__main__":
-    build_langchain_faiss_index()
+    if "--chunks-only" in sys.argv:
+        export_chunk_store()
+    elif "--full" in sys.argv:
+        build_langchain_faiss_index()
+    else:
+        update_langchain_faiss_index()
@@ -1,17 +1,80 @@
 # app/retrieval/lc_rag_engine.py
 
+from collections.abc import Mapping
+from functools import cached_property, partial
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
 
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
+from sentence_transformers import SentenceTransformer
 
-from app.config import disable_broken_local_proxy, get_embed_model
+from app.config import disable_broken_local_proxy, get_embed_backend, get_embed_model, get_index_load_mode
+from app.retrieval.ann_index import SubsetSearcher, apply_search_params, load_rescorer, read_index, read_index_meta, search_index
+from app.retrieval.chunk_store import FACET_COLUMNS, ChunkStore, Facets, normalize_filters
+from app.retrieval.embedding_cache import build_query_cache
+from app.retrieval.prompt import build_sebi_prompt
+from app.retrieval.query_encoder import encode_texts, encoder_id, load_encoder
 
 INDEX_DIR = Path("faiss_index/langchain_index")
+CHUNK_STORE_DIR = INDEX_DIR / "chunks"
 EMBED_MODEL = get_embed_model()
 
 
+class PositionIds(Mapping):
+    """index_to_docstore_id for a chunk store: FAISS position i maps to id "i"."""
+
+    def __init__(self, size: int):
+        self._size = size
+
+    def __getitem__(self, pos: int) -> str:
+        if not 0 <= pos < self._size:
+            raise KeyError(pos)
+        return str(pos)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self._size))
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class ChunkStoreDocstore(Docstore):
+    """Read-only LangChain docstore over a memory-mapped ChunkStore."""
+
+    def __init__(self, store: ChunkStore):
+        self.store = store
+
+    def search(self, search: str) -> Union[str, Document]:
+        try:
+            pos = int(search)
+        except ValueError:
+            pos = -1
+        if not 0 <= pos < len(self.store):
+            return f"ID {search} not found."
+        meta = self.store[pos]
+        text = meta.pop("text")
+        return Document(page_content=text, metadata=meta)
+
+
+class EncoderEmbeddings(Embeddings):
+    """LangChain embeddings over an encoder loaded by `load_encoder`."""
+
+    def __init__(self, model: SentenceTransformer):
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return encode_texts(self.model, texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
 class LangChainRAGEngine:
     """RAG engine using LangChain's FAISS VectorStore and HuggingFace embeddings."""
 
@@ -26,40 +89,143 @@ class LangChainRAGEngine:
 
         self.top_k = top_k
         disable_broken_local_proxy()
+        self.embed_backend = get_embed_backend()
         try:
-            self.embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+            if self.embed_backend == "torch":
+                self.embeddings = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+            else:
+                self.embeddings = EncoderEmbeddings(load_encoder(EMBED_MODEL, self.embed_backend))
         except Exception as exc:
             raise RuntimeError(
                 "Failed to load the embedding model. Ensure "
                 f"'{EMBED_MODEL}' is available locally or allow network access to "
                 "download it."
             ) from exc
-        self.vectorstore = FAISS.load_local(
-            str(INDEX_DIR),
-            embeddings=self.embeddings,
-            allow_dangerous_deserialization=True,
+        self.load_mode = get_index_load_mode()
+        self.chunk_store = ChunkStore(CHUNK_STORE_DIR) if (CHUNK_STORE_DIR / "manifest.json").exists() else None
+        if self.load_mode == "mmap" and self.chunk_store is not None:
+            # Map index.faiss and the columnar chunk store instead of reading
+            # the index into RAM and unpickling index.pkl.
+            self.vectorstore = FAISS(
+                embedding_function=self.embeddings,
+                index=read_index(INDEX_DIR / "index.faiss", mmap=True),
+                docstore=ChunkStoreDocstore(self.chunk_store),
+                index_to_docstore_id=PositionIds(len(self.chunk_store)),
+            )
+        else:
+            self.load_mode = "pickle"
+            self.vectorstore = FAISS.load_local(
+                str(INDEX_DIR),
+                embeddings=self.embeddings,
+                allow_dangerous_deserialization=True,
+            )
+        self.query_cache = build_query_cache(encoder_id(EMBED_MODEL, self.embed_backend))
+        self.index_meta = read_index_meta(INDEX_DIR) or {"index_type": "flat"}
+        apply_search_params(self.vectorstore.index, self.index_meta)
+        self.subsets = SubsetSearcher(
+            self.vectorstore.index,
+            self.index_meta["index_type"],
+            self.index_meta.get("metric", "l2"),
         )
+        self.rescorer = load_rescorer(INDEX_DIR, self.index_meta)
 
-        print("LangChain RAG engine ready.")
+        print(
+            f"LangChain RAG engine ready ({self.index_meta['index_type']} index, "
+            f"{self.load_mode} load, {self.embed_backend} encoder)."
+        )
+
+    @cached_property
+    def facets(self) -> Facets:
+        """doc_type / source_file -> FAISS positions, for metadata filters."""
+        if self.chunk_store is not None:
+            return self.chunk_store.facets
+        store = self.vectorstore
+        metadata = [store.docstore.search(store.index_to_docstore_id[pos]).metadata for pos in range(store.index.ntotal)]
+        return Facets.from_values(
+            {c: [str(meta.get(c) or "") for meta in metadata] for c in FACET_COLUMNS},
+            len(metadata),
+        )
 
-    def retrieve(self, query: str) -> List[Dict[str, Any]]:
-        """Return top-k relevant chunks along with relevance scores."""
+    def retrieve(self, query: str, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Return top-k relevant chunks along with relevance scores. `filters`
+        (e.g. {"source_file": "master_circular_mutual_funds.pdf"}) restricts
+        the FAISS search itself to the matching chunks.
+        """
         print(f"\nRetrieving top {self.top_k} matches for query:")
         print(f"   -> {query}")
 
-        docs_and_scores = self.vectorstore.similarity_search_with_relevance_scores(
-            query,
+        if normalize_filters(filters) is not None or self.rescorer is not None:
+            return self.retrieve_many([query], filters=filters)[0]
+
+        vector = self._embed_queries([query])[0]
+        docs_and_scores = self.vectorstore.similarity_search_with_score_by_vector(
+            vector.tolist(),
             k=self.top_k,
         )
+        relevance_fn = self.vectorstore._select_relevance_score_fn()
 
-        results = []
-        for doc, score in docs_and_scores:
-            meta = dict(doc.metadata or {})
-            meta["text"] = doc.page_content
-            meta["score"] = float(score)
-            results.append(meta)
+        return [self._to_result(doc, relevance_fn(score)) for doc, score in docs_and_scores]
 
-        return results
+    def encode(self, queries: Sequence[str]) -> np.ndarray:
+        """Query vectors, served from the query cache where possible."""
+        # embed_documents batches the forward pass; without query-specific
+        # encode kwargs it produces the same vectors as embed_query.
+        return self.query_cache.encode(
+            queries,
+            lambda texts: np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32),
+        )
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """encode, normalized when the vector store expects unit vectors."""
+        vectors = self.encode(queries)
+        if self.vectorstore._normalize_L2:
+            vectors = vectors.copy()
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        k: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Retrieve for many queries at once: one embedding batch and one matrix
+        FAISS search. Scores use the same relevance function as `retrieve`.
+        """
+        k = k or self.top_k
+        if not queries:
+            return []
+
+        vectors = self._embed_queries(list(queries))
+        key = normalize_filters(filters)
+        search = None
+        if key is not None:
+            # Search only the matching positions; LangChain's own `filter=`
+            # over-fetches fetch_k hits and drops non-matching ones afterwards.
+            search = partial(self.subsets.search, key=key, positions=self.facets.select(key))
+        distances, indices = search_index(self.vectorstore.index, vectors, k, self.rescorer, search)
+        relevance_fn = self.vectorstore._select_relevance_score_fn()
+
+        batched = []
+        for row_distances, row_indices in zip(distances, indices):
+            results = []
+            for distance, idx in zip(row_distances, row_indices):
+                if idx == -1:
+                    continue
+                doc_id = self.vectorstore.index_to_docstore_id[int(idx)]
+                doc = self.vectorstore.docstore.search(doc_id)
+                results.append(self._to_result(doc, relevance_fn(distance)))
+            batched.append(results)
+        return batched
+
+    @staticmethod
+    def _to_result(doc: Any, score: Any) -> Dict[str, Any]:
+        meta = dict(doc.metadata or {})
+        meta["text"] = doc.page_content
+        meta["score"] = float(score)
+        return meta
 
     def build_prompt(
         self,
@@ -68,37 +234,4 @@ class LangChainRAGEngine:
         history: Optional[List[Dict[str, str]]] = None,
     ) -> str:
         """Build a SEBI-compliant prompt using retrieved context and history."""
-        history_text = ""
-
-        if history:
-            for turn in history:
-                history_text += (
-                    f"User: {turn['user']}\nAssistant: {turn['assistant']}\n\n"
-                )
-
-        context_block = "\n\n".join(
-            f"[{c.get('source_file')} - chunk {c.get('chunk_index')}]:\n{c.get('text')}"
-            for c in contexts
-        )
-
-        prompt = f"""
-You are a SEBI compliance assistant.
-Answer strictly from the retrieved SEBI context.
-Use only the most relevant point from the provided context and do not include unrelated details.
-
-If the answer is not clearly supported by the context, reply exactly:
-"The referenced SEBI documents do not cover this information."
-
-Conversation History:
-{history_text}
-
-User Question:
-{query}
-
-Retrieved SEBI Context:
-{context_block}
-
-Return 3-6 bullet points with precise compliance language and include one inline citation in this format:
-[source_file - chunk chunk_index]
-"""
-        return prompt
+        return build_sebi_prompt(query, contexts, history)
@@ -0,0 +1,139 @@
+# app/retrieval/native_engine.py
+"""
+LangChain-free retrieval over the LangChain-built index.
+
+Uses the sentence-transformers model and the raw FAISS index directly and
+returns numpy score/position arrays; chunk text and metadata are only read
+from the memory-mapped chunk store for the hits that are actually used.
+Scores follow the LangChain path (L2 relevance = 1 - distance / sqrt(2)), so
+rankings and scores match LangChainRAGEngine.
+
+Select it for the API with RAG_ENGINE=native.
+"""
+
+import math
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import disable_broken_local_proxy, get_embed_backend, get_embed_model, get_index_load_mode
+from app.retrieval.ann_index import SubsetSearcher, apply_search_params, load_rescorer, read_index, read_index_meta, search_index
+from app.retrieval.chunk_store import ChunkStore, normalize_filters
+from app.retrieval.embedding_cache import build_query_cache
+from app.retrieval.prompt import build_sebi_prompt
+from app.retrieval.query_encoder import encode_texts, encoder_id, load_encoder
+
+INDEX_DIR = Path("faiss_index/langchain_index")
+EMBED_MODEL = get_embed_model()
+
+
+class NativeRAGEngine:
+    """Retriever built directly on sentence-transformers, FAISS and numpy."""
+
+    def __init__(self, top_k: int = 5, index_dir: Path = INDEX_DIR):
+        chunk_dir = index_dir / "chunks"
+        if not (chunk_dir / "manifest.json").exists():
+            raise FileNotFoundError(
+                f"Chunk store not found at {chunk_dir}. "
+                "Run: python -m app.retrieval.lc_embed_index --chunks-only"
+            )
+
+        print("Initializing native RAG engine...")
+
+        self.top_k = top_k
+        disable_broken_local_proxy()
+        self.embed_backend = get_embed_backend()
+        try:
+            self.model = load_encoder(EMBED_MODEL, self.embed_backend)
+        except Exception as exc:
+            raise RuntimeError(
+                "Failed to load the embedding model. Ensure "
+                f"'{EMBED_MODEL}' is available locally or allow network access to "
+                "download it."
+            ) from exc
+
+        mmap = get_index_load_mode() == "mmap"
+        self.index = read_index(index_dir / "index.faiss", mmap=mmap)
+        self.index_meta = read_index_meta(index_dir) or {"index_type": "flat", "metric": "l2"}
+        apply_search_params(self.index, self.index_meta)
+        self.metric = self.index_meta.get("metric", "l2")
+        self.chunks = ChunkStore(chunk_dir, mmap=mmap)
+        self.subsets = SubsetSearcher(self.index, self.index_meta["index_type"], self.metric)
+        self.rescorer = load_rescorer(index_dir, self.index_meta)
+        self.query_cache = build_query_cache(encoder_id(EMBED_MODEL, self.embed_backend))
+
+        print(f"Native RAG engine ready ({self.index_meta['index_type']} index, {self.embed_backend} encoder).")
+
+    def encode(self, queries: Sequence[str]) -> np.ndarray:
+        return self.query_cache.encode(queries, self._encode_uncached)
+
+    def _encode_uncached(self, texts: List[str]) -> np.ndarray:
+        # Same preprocessing as HuggingFaceEmbeddings, so vectors are identical.
+        return encode_texts(self.model, texts)
+
+    def search_vectors(
+        self,
+        vectors: np.ndarray,
+        k: Optional[int] = None,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Relevance scores and chunk positions, shape (n_queries, k); -1 marks
+        no hit. `filters` restricts the search to chunks whose doc_type /
+        source_file match (see chunk_store.normalize_filters).
+        """
+        key = normalize_filters(filters)
+        search = None
+        if key is not None:
+            search = partial(self.subsets.search, key=key, positions=self.chunks.facets.select(key))
+        distances, positions = search_index(self.index, vectors, k or self.top_k, self.rescorer, search)
+        if self.metric == "l2":
+            scores = 1.0 - distances / math.sqrt(2)
+        else:
+            scores = distances
+        return scores, positions
+
+    def search(
+        self,
+        queries: Sequence[str],
+        k: Optional[int] = None,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        return self.search_vectors(self.encode(queries), k, filters)
+
+    def resolve(self, scores: np.ndarray, positions: np.ndarray) -> List[Dict[str, Any]]:
+        """Materialize result rows for one query's scores/positions."""
+        results = []
+        for score, pos in zip(scores, positions):
+            if pos == -1:
+                continue
+            row = self.chunks[int(pos)]
+            row["score"] = float(score)
+            results.append(row)
+        return results
+
+    def retrieve(self, query: str, filters: Optional[Mapping[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return top-k relevant chunks along with relevance scores."""
+        scores, positions = self.search([query], filters=filters)
+        return self.resolve(scores[0], positions[0])
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        k: Optional[int] = None,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        if not queries:
+            return []
+        scores, positions = self.search(queries, k, filters)
+        return [self.resolve(s, p) for s, p in zip(scores, positions)]
+
+    def build_prompt(
+        self,
+        query: str,
+        contexts: List[Dict[str, Any]],
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> str:
+        return build_sebi_prompt(query, contexts, history)
@@ -0,0 +1,45 @@
+# app/retrieval/prompt.py
+
+from typing import Any, Dict, List, Optional
+
+
+def build_sebi_prompt(
+    query: str,
+    contexts: List[Dict[str, Any]],
+    history: Optional[List[Dict[str, str]]] = None,
+) -> str:
+    """Build a SEBI-compliant prompt using retrieved context and history."""
+    history_text = ""
+
+    if history:
+        for turn in history:
+            history_text += (
+                f"User: {turn['user']}\nAssistant: {turn['assistant']}\n\n"
+            )
+
+    context_block = "\n\n".join(
+        f"[{c.get('source_file')} - chunk {c.get('chunk_index')}]:\n{c.get('text')}"
+        for c in contexts
+    )
+
+    prompt = f"""
+You are a SEBI compliance assistant.
+Answer strictly from the retrieved SEBI context.
+Use only the most relevant point from the provided context and do not include unrelated details.
+
+If the answer is not clearly supported by the context, reply exactly:
+"The referenced SEBI documents do not cover this information."
+
+Conversation History:
+{history_text}
+
+User Question:
+{query}
+
+Retrieved SEBI Context:
+{context_block}
+
+Return 3-6 bullet points with precise compliance language and include one inline citation in this format:
+[source_file - chunk chunk_index]
+"""
+    return prompt
@@ -0,0 +1,61 @@
+# app/retrieval/query_encoder.py
+"""
+Query-encoder backends for CPU inference.
+
+EMBED_BACKEND selects how the embedding model runs at query time:
+  torch  the PyTorch fp32 model (default)
+  int8   the PyTorch model with its Linear layers dynamically quantized to int8
+  onnx   the exported ONNX graph on onnxruntime (needs `sentence-transformers[onnx]`);
+         EMBED_ONNX_FILE picks a specific file from the model repo, e.g. one of
+         the pre-quantized `onnx/model_qint8_*.onnx` graphs
+
+Index builders always embed documents with the fp32 model; only the query
+side changes. `python -m app.retrieval.bench_encoder` checks cosine-similarity
+parity against fp32 and compares latency and memory.
+"""
+
+from importlib.util import find_spec
+from typing import List, Sequence
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from app.config import get_embed_backend, get_onnx_file
+
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def encoder_id(model_name: str, backend: str) -> str:
+    """Cache namespace for vectors produced by `model_name` on `backend`."""
+    return model_name if backend == "torch" else f"{model_name}#{backend}"
+
+
+def load_encoder(model_name: str, backend: str = "") -> SentenceTransformer:
+    """Load `model_name` for CPU inference on the requested backend."""
+    backend = backend or get_embed_backend()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Expected one of {BACKENDS}.")
+
+    if backend == "onnx":
+        if find_spec("onnxruntime") is None or find_spec("optimum") is None:
+            raise RuntimeError(
+                "EMBED_BACKEND=onnx needs onnxruntime and optimum. "
+                "Run: pip install 'sentence-transformers[onnx]'"
+            )
+        onnx_file = get_onnx_file()
+        model_kwargs = {"file_name": onnx_file} if onnx_file else None
+        return SentenceTransformer(model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+
+    model = SentenceTransformer(model_name, device="cpu")
+    if backend == "int8":
+        import torch
+
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
+
+
+def encode_texts(model: SentenceTransformer, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+    """Embed texts the way HuggingFaceEmbeddings does (newlines folded to spaces)."""
+    texts: List[str] = [t.replace("\n", " ") for t in texts]
+    vectors = model.encode(texts, batch_size=batch_size, show_progress_bar=False, convert_to_numpy=True)
+    return np.ascontiguousarray(vectors, dtype=np.float32)
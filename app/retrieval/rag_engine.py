@@ -3,28 +3,58 @@
 import faiss
 import numpy as np
 import pandas as pd
+from functools import cached_property, partial
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
+
+from app.config import get_index_load_mode, get_index_type
+from app.retrieval.ann_index import SubsetSearcher, apply_search_params, load_rescorer, read_index, read_index_meta, search_index
+from app.retrieval.chunk_store import FACET_COLUMNS, ChunkStore, Facets, normalize_filters
+from app.retrieval.query_encoder import load_encoder
 
 INDEX_PATH = Path("faiss_index/faiss_index.bin")
 META_PATH = Path("faiss_index/metadata.parquet")
+CHUNK_STORE_DIR = Path("faiss_index/chunks")
 
 class RAGEngine:
 
     def __init__(self, top_k: int = 5):
         if not INDEX_PATH.exists():
             raise FileNotFoundError("FAISS index not found. Run embed_index.py first.")
-        if not META_PATH.exists():
+        use_mmap = get_index_load_mode() == "mmap" and (CHUNK_STORE_DIR / "manifest.json").exists()
+        if not use_mmap and not META_PATH.exists():
             raise FileNotFoundError("Metadata file not found.")
 
         print("🚀 Initializing RAG engine...")
         self.top_k = top_k
-        self.model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.index = faiss.read_index(str(INDEX_PATH))
-        self.meta = pd.read_parquet(META_PATH)
+        self.model = load_encoder("all-MiniLM-L6-v2")
+        if use_mmap:
+            self.index = read_index(INDEX_PATH, mmap=True)
+            self.meta = ChunkStore(CHUNK_STORE_DIR)
+        else:
+            self.index = faiss.read_index(str(INDEX_PATH))
+            self.meta = pd.read_parquet(META_PATH)
+        self.index_meta = read_index_meta(INDEX_PATH.parent)
+        if self.index_meta is None:
+            print(f"⚠️  No index metadata next to {INDEX_PATH}; assuming a flat index. Re-run embed_index.py to record it.")
+            self.index_meta = {"index_type": "flat", "metric": "ip"}
+        elif self.index_meta["index_type"] != get_index_type():
+            print(
+                f"⚠️  {INDEX_PATH} is a {self.index_meta['index_type']} index but INDEX_TYPE={get_index_type()}; "
+                "re-run embed_index.py to rebuild it."
+            )
+        apply_search_params(self.index, self.index_meta)
+        self.subsets = SubsetSearcher(self.index, self.index_meta["index_type"], self.index_meta.get("metric", "ip"))
+        self.rescorer = load_rescorer(INDEX_PATH.parent, self.index_meta)
         print("✅ RAG Engine Ready.")
 
-    def retrieve(self, query: str):
+    @cached_property
+    def facets(self) -> Facets:
+        if isinstance(self.meta, ChunkStore):
+            return self.meta.facets
+        values = {c: self.meta[c].fillna("").astype(str).tolist() for c in FACET_COLUMNS}
+        return Facets.from_values(values, len(self.meta))
+
+    def retrieve(self, query: str, filters=None):
         print(f"\n🔎 Retrieving top {self.top_k} matches for query:")
         print(f"   → {query}")
 
@@ -32,13 +62,22 @@ class RAGEngine:
         q_emb = np.asarray(q_emb, dtype="float32")
         faiss.normalize_L2(q_emb)
 
-        scores, idxs = self.index.search(q_emb, self.top_k)
+        key = normalize_filters(filters)
+        search = None
+        if key is not None:
+            search = partial(self.subsets.search, key=key, positions=self.facets.select(key))
+        scores, idxs = search_index(self.index, q_emb, self.top_k, self.rescorer, search)
         scores = scores[0]
         idxs = idxs[0]
 
         results = []
         for idx, score in zip(idxs, scores):
-            rec = self.meta.iloc[idx].to_dict()
+            if idx == -1:
+                continue
+            if isinstance(self.meta, ChunkStore):
+                rec = self.meta[int(idx)]
+            else:
+                rec = self.meta.iloc[idx].to_dict()
             rec["score"] = float(score)
             results.append(rec)
 
@@ -0,0 +1,425 @@
+# app/retrieval/shards.py
+"""
+Sharded vector + keyword index with parallel scatter-gather search.
+
+The corpus is partitioned by source document (SHARD_BY=source, one shard
+per document) or by chunk-id hash (SHARD_BY=hash, NUM_SHARDS shards). Each
+shard is a self-contained FAISS index, chunk store and keyword index:
+
+    faiss_index/shards/
+      shards.json            scheme, model, metric and the documents of each shard
+      <shard>/
+        index.faiss          FAISS index over the shard's chunks
+        index_meta.json
+        vectors.npy          exact vectors, kept when VECTOR_STORAGE is lossy
+        keyword_index/       keyword index and chunk rows (see keyword_index.py)
+
+A query is sent to every shard on a thread pool (FAISS and numpy release
+the GIL) and the per-shard top-k lists are merged into the exact global
+top-k. Keyword scores use IDF over all shards, so they equal the scores of
+the unsharded index. Global positions run through the shards in name order.
+
+Vectors are taken from the LangChain index by chunk text, so build or
+update that first. Rebuilding only rewrites shards whose documents changed:
+    python -m app.retrieval.shards
+"""
+
+import hashlib
+import json
+import re
+import shutil
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, Union
+
+import faiss
+import numpy as np
+
+from app.config import (
+    disable_broken_local_proxy,
+    get_embed_backend,
+    get_embed_model,
+    get_index_load_mode,
+    get_index_params,
+    get_index_type,
+    get_shard_config,
+    get_vector_storage,
+)
+from app.retrieval.ann_index import (
+    VECTORS_FILE,
+    SubsetSearcher,
+    apply_search_params,
+    build_ann_index,
+    index_meta,
+    load_rescorer,
+    read_index,
+    read_index_meta,
+    resolve_storage,
+    search_index,
+    write_exact_vectors,
+    write_index_meta,
+)
+from app.retrieval.chunk_features import ChunkView, compute_chunk_view
+from app.retrieval.chunk_store import ChunkStore, normalize_filters, staged_directory, text_digest
+from app.retrieval.embedding_cache import build_query_cache
+from app.retrieval.index_update import document_digests, stored_vectors
+from app.retrieval.keyword_index import CORPUS_PATH, KeywordIndex, bm25_idf, load_corpus_rows
+from app.retrieval.prompt import build_sebi_prompt
+from app.retrieval.query_encoder import encode_texts, encoder_id, load_encoder
+
+SHARD_DIR = Path("faiss_index/shards")
+VECTOR_SOURCE_DIR = Path("faiss_index/langchain_index")
+SHARDS_FILE = "shards.json"
+FORMAT_VERSION = 1
+SCHEMES = ("source", "hash")
+
+
+def shard_name(row: Dict[str, Any], scheme: str, num_shards: int) -> str:
+    if scheme == "source":
+        stem = Path(str(row.get("source_file") or "unknown")).stem
+        return "src_" + re.sub(r"[^A-Za-z0-9_.-]+", "_", stem)
+    digest = hashlib.sha256(str(row.get("id") or row.get("text", "")).encode("utf-8")).hexdigest()
+    return f"hash_{int(digest[:8], 16) % num_shards:03d}"
+
+
+def read_shards_manifest(directory: Path = SHARD_DIR) -> Optional[Dict[str, Any]]:
+    path = directory / SHARDS_FILE
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _corpus_vectors(rows: List[Dict[str, Any]], vector_dir: Path) -> Tuple[np.ndarray, str]:
+    """Vectors for `rows` looked up by chunk text in the built LangChain index."""
+    meta = read_index_meta(vector_dir) or {"index_type": "flat", "metric": "l2"}
+    index = faiss.read_index(str(vector_dir / "index.faiss"))
+    vectors = stored_vectors(index, meta, vector_dir)
+    if vectors is None:
+        raise RuntimeError(f"Cannot read exact vectors back from {vector_dir}; rebuild it so it keeps {VECTORS_FILE}.")
+    texts = ChunkStore(vector_dir / "chunks", mmap=False).columns["text"]
+    by_text = {text_digest(texts[pos]): pos for pos in range(len(texts))}
+    missing = [row.get("id") for row in rows if text_digest(str(row.get("text", ""))) not in by_text]
+    if missing:
+        raise RuntimeError(
+            f"{len(missing)} corpus chunks are not embedded yet. "
+            "Run: python -m app.retrieval.lc_embed_index"
+        )
+    picks = [by_text[text_digest(str(row.get("text", "")))] for row in rows]
+    return np.ascontiguousarray(vectors[picks], dtype=np.float32), meta.get("metric", "l2")
+
+
+def write_shard(
+    directory: Path,
+    rows: List[Dict[str, Any]],
+    vectors: np.ndarray,
+    metric: str,
+    index_type: str,
+    params: Optional[Dict[str, int]] = None,
+    storage: str = "float32",
+) -> None:
+    """Write one shard; files are staged and swapped in like the keyword index."""
+    with staged_directory(directory) as staging:
+        index = build_ann_index(vectors, index_type, metric, params, storage)
+        faiss.write_index(index, str(staging / "index.faiss"))
+        meta = index_meta(index, index_type, metric, params, storage)
+        write_index_meta(staging, meta)
+        write_exact_vectors(staging, meta, vectors)
+        KeywordIndex(rows).save(staging / "keyword_index")
+
+
+def build_shards(
+    corpus_path: Path = CORPUS_PATH,
+    shard_dir: Path = SHARD_DIR,
+    vector_dir: Path = VECTOR_SOURCE_DIR,
+) -> Dict[str, Any]:
+    """Partition the corpus and (re)write every shard whose documents changed."""
+    config = get_shard_config()
+    scheme, num_shards = config["scheme"], config["num_shards"]
+    if scheme not in SCHEMES:
+        raise ValueError(f"Unknown shard scheme '{scheme}'. Expected one of {SCHEMES}.")
+
+    rows = load_corpus_rows(corpus_path)
+    vectors, metric = _corpus_vectors(rows, vector_dir)
+    index_type, params = get_index_type(), get_index_params()
+    storage = resolve_storage(index_type, get_vector_storage())
+
+    groups: Dict[str, List[int]] = {}
+    for pos, row in enumerate(rows):
+        groups.setdefault(shard_name(row, scheme, num_shards), []).append(pos)
+
+    previous = read_shards_manifest(shard_dir) or {}
+    same_layout = all(
+        previous.get(key) == value
+        for key, value in (
+            ("scheme", scheme),
+            ("metric", metric),
+            ("index_type", index_type),
+            ("storage", storage),
+            ("embed_model", get_embed_model()),
+        )
+    )
+    old_shards = previous.get("shards", {}) if same_layout else {}
+
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    shards: Dict[str, Any] = {}
+    for name in sorted(groups):
+        shard_rows = [rows[pos] for pos in groups[name]]
+        documents = document_digests(shard_rows)
+        shards[name] = {"num_chunks": len(shard_rows), "documents": documents}
+        if old_shards.get(name, {}).get("documents") == documents and (shard_dir / name / "index.faiss").exists():
+            print(f"  {name}: unchanged ({len(shard_rows)} chunks)")
+            continue
+        print(f"  {name}: writing {len(shard_rows)} chunks")
+        write_shard(shard_dir / name, shard_rows, vectors[groups[name]], metric, index_type, params, storage)
+
+    for stale in set(old_shards) - set(shards):
+        print(f"  {stale}: removed")
+        shutil.rmtree(shard_dir / stale, ignore_errors=True)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "scheme": scheme,
+        "num_shards": num_shards if scheme == "hash" else len(shards),
+        "embed_model": get_embed_model(),
+        "metric": metric,
+        "index_type": index_type,
+        "storage": storage,
+        "corpus_path": str(corpus_path),
+        "shards": shards,
+    }
+    (shard_dir / SHARDS_FILE).write_text(json.dumps(manifest, indent=2), encoding="utf-8")
+    return manifest
+
+
+class Shard:
+    """One shard's FAISS index and keyword index (whose chunk store it shares)."""
+
+    def __init__(self, directory: Path, offset: int, mmap: bool):
+        self.name = directory.name
+        self.offset = offset
+        self.index = read_index(directory / "index.faiss", mmap=mmap)
+        self.meta = read_index_meta(directory) or {"index_type": "flat", "metric": "l2"}
+        apply_search_params(self.index, self.meta)
+        self.subsets = SubsetSearcher(self.index, self.meta["index_type"], self.meta.get("metric", "l2"))
+        self.rescorer = load_rescorer(directory, self.meta)
+        self.keyword = KeywordIndex.load(directory / "keyword_index", mmap=mmap)
+        self.chunks = self.keyword.rows
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+
+class ShardSet:
+    """All shards of a sharded index plus the pool that searches them."""
+
+    def __init__(self, directory: Path = SHARD_DIR, mmap: Optional[bool] = None, workers: Optional[int] = None):
+        manifest = read_shards_manifest(directory)
+        if manifest is None or manifest.get("format_version") != FORMAT_VERSION:
+            raise FileNotFoundError(f"No sharded index at {directory}. Run: python -m app.retrieval.shards")
+        if mmap is None:
+            mmap = get_index_load_mode() == "mmap"
+
+        self.metric = manifest.get("metric", "l2")
+        self.shards: List[Shard] = []
+        offset = 0
+        for name in sorted(manifest["shards"]):
+            shard = Shard(directory / name, offset, mmap)
+            self.shards.append(shard)
+            offset += len(shard)
+        self.offsets = np.asarray([s.offset for s in self.shards] + [offset], dtype=np.int64)
+
+        # Keyword IDF over the whole corpus, shared by every shard.
+        doc_freq: Counter = Counter()
+        for shard in self.shards:
+            doc_freq.update(dict(shard.keyword.doc_freq.items()))
+        total = max(1, offset)
+        idf = {token: bm25_idf(df, total) for token, df in doc_freq.items()}
+        for shard in self.shards:
+            shard.keyword.idf = idf
+
+        workers = workers if workers is not None else get_shard_config()["workers"]
+        self.pool = ThreadPoolExecutor(max_workers=workers or max(1, len(self.shards)), thread_name_prefix="shard")
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def locate(self, pos: int) -> Tuple[Shard, int]:
+        shard = self.shards[int(np.searchsorted(self.offsets, pos, side="right")) - 1]
+        return shard, pos - shard.offset
+
+    def __getitem__(self, pos: Union[int, slice]) -> Any:
+        if isinstance(pos, slice):
+            return [self[i] for i in range(*pos.indices(len(self)))]
+        shard, local = self.locate(int(pos))
+        return shard.chunks[local]
+
+    def search_vectors(
+        self,
+        vectors: np.ndarray,
+        k: int,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact global top-k distances and positions, merged from every shard's top-k."""
+        key = normalize_filters(filters)
+
+        def scatter(shard: Shard) -> Tuple[np.ndarray, np.ndarray]:
+            search = None
+            if key is not None:
+                search = partial(shard.subsets.search, key=key, positions=shard.chunks.facets.select(key))
+            distances, local = search_index(shard.index, vectors, k, shard.rescorer, search)
+            return distances, np.where(local >= 0, local + shard.offset, -1)
+
+        parts = list(self.pool.map(scatter, self.shards))
+        distances = np.concatenate([p[0] for p in parts], axis=1)
+        positions = np.concatenate([p[1] for p in parts], axis=1)
+        worst = np.inf if self.metric == "l2" else -np.inf
+        distances = np.where(positions >= 0, distances, worst)
+        sort_key = distances if self.metric == "l2" else -distances
+
+        merged_d = np.empty((len(vectors), k), dtype=np.float32)
+        merged_p = np.empty((len(vectors), k), dtype=np.int64)
+        for q in range(len(vectors)):
+            # Closest first; equal distances keep global position order.
+            order = np.lexsort((positions[q], sort_key[q]))[:k]
+            merged_d[q], merged_p[q] = distances[q][order], positions[q][order]
+        return merged_d, merged_p
+
+    def keyword_search(
+        self,
+        base_tokens: Iterable[str],
+        expanded_tokens: Iterable[str],
+        phrase_query: bool,
+        top_k: int,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> List[Tuple[int, float]]:
+        base, expanded = set(base_tokens), set(expanded_tokens)
+
+        def scatter(shard: Shard) -> List[Tuple[int, float]]:
+            hits = shard.keyword.search(base, expanded, phrase_query, top_k, filters)
+            return [(shard.offset + pos, score) for pos, score in hits]
+
+        hits = [hit for part in self.pool.map(scatter, self.shards) for hit in part]
+        hits.sort(key=lambda hit: (-hit[1], hit[0]))
+        return hits[:top_k]
+
+    def positions(self, filters: Optional[Mapping[str, Any]] = None) -> Optional[np.ndarray]:
+        key = normalize_filters(filters)
+        if key is None:
+            return None
+        return np.concatenate([shard.chunks.facets.select(key) + shard.offset for shard in self.shards])
+
+
+class ShardFeatures:
+    """Chunk features by id across shards (ChunkFeatures.lookup surface)."""
+
+    def __init__(self, shards: ShardSet):
+        self._shards = shards
+
+    def lookup(self, row: Dict[str, Any]) -> ChunkView:
+        for shard in self._shards.shards:
+            pos = shard.keyword.features.position(row.get("id"))
+            if pos is not None:
+                return shard.keyword.features.view(pos)
+        return compute_chunk_view(str(row.get("text", "")))
+
+
+class ShardFacets:
+    def __init__(self, shards: ShardSet):
+        self._shards = shards
+
+    def values(self, column: str) -> List[str]:
+        return sorted({v for shard in self._shards.shards for v in shard.chunks.facets.values(column)})
+
+
+class ShardedKeywordIndex:
+    """The KeywordIndex interface rag_llm uses, answered by scatter-gather over shards."""
+
+    def __init__(self, shards: ShardSet):
+        self.shards = shards
+        self.rows = shards
+        self.features = ShardFeatures(shards)
+        self.facets = ShardFacets(shards)
+
+    def __len__(self) -> int:
+        return len(self.shards)
+
+    def search(self, *args: Any, **kwargs: Any) -> List[Tuple[int, float]]:
+        return self.shards.keyword_search(*args, **kwargs)
+
+    def positions(self, filters: Optional[Mapping[str, Any]] = None) -> Optional[np.ndarray]:
+        return self.shards.positions(filters)
+
+
+class ShardedRAGEngine:
+    """Vector retrieval over a ShardSet; same interface as NativeRAGEngine."""
+
+    def __init__(self, top_k: int = 5, shards: Optional[ShardSet] = None):
+        print("Initializing sharded RAG engine...")
+        self.top_k = top_k
+        self.shards = shards if shards is not None else ShardSet()
+        embed_model = get_embed_model()
+        disable_broken_local_proxy()
+        self.embed_backend = get_embed_backend()
+        try:
+            self.model = load_encoder(embed_model, self.embed_backend)
+        except Exception as exc:
+            raise RuntimeError(
+                "Failed to load the embedding model. Ensure "
+                f"'{embed_model}' is available locally or allow network access to "
+                "download it."
+            ) from exc
+        self.query_cache = build_query_cache(encoder_id(embed_model, self.embed_backend))
+        print(f"Sharded RAG engine ready ({len(self.shards.shards)} shards, {len(self.shards)} chunks).")
+
+    def encode(self, queries: Sequence[str]) -> np.ndarray:
+        return self.query_cache.encode(queries, lambda texts: encode_texts(self.model, texts))
+
+    def search(
+        self,
+        queries: Sequence[str],
+        k: Optional[int] = None,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        distances, positions = self.shards.search_vectors(self.encode(queries), k or self.top_k, filters)
+        scores = 1.0 - distances / np.sqrt(2) if self.shards.metric == "l2" else distances
+        return scores, positions
+
+    def resolve(self, scores: np.ndarray, positions: np.ndarray) -> List[Dict[str, Any]]:
+        results = []
+        for score, pos in zip(scores, positions):
+            if pos == -1:
+                continue
+            row = self.shards[int(pos)]
+            row["score"] = float(score)
+            results.append(row)
+        return results
+
+    def retrieve(self, query: str, filters: Optional[Mapping[str, Any]] = None) -> List[Dict[str, Any]]:
+        scores, positions = self.search([query], filters=filters)
+        return self.resolve(scores[0], positions[0])
+
+    def retrieve_many(
+        self,
+        queries: List[str],
+        k: Optional[int] = None,
+        filters: Optional[Mapping[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        if not queries:
+            return []
+        scores, positions = self.search(queries, k, filters)
+        return [self.resolve(s, p) for s, p in zip(scores, positions)]
+
+    def build_prompt(
+        self,
+        query: str,
+        contexts: List[Dict[str, Any]],
+        history: Optional[List[Dict[str, str]]] = None,
+    ) -> str:
+        return build_sebi_prompt(query, contexts, history)
+
+
+if __name__ == "__main__":
+    built = build_shards()
+    print(f"Sharded index: {len(built['shards'])} shards ({built['scheme']}) -> {SHARD_DIR}")
@@ -1,8 +1,12 @@
-﻿import requests
+﻿import json
+
+import requests
 import streamlit as st
 
 API_URL = "http://127.0.0.1:8000/query"
+STREAM_URL = "http://127.0.0.1:8000/query/stream"
 HEALTH_URL = "http://127.0.0.1:8000/health"
+FILTERS_URL = "http://127.0.0.1:8000/filters"
 
 st.set_page_config(
     page_title="SEBI Command Deck",
@@ -216,6 +220,68 @@ def _check_api_health() -> str:
         return "offline"
 
 
+@st.cache_data(ttl=300)
+def _filter_options() -> dict:
+    try:
+        r = requests.get(FILTERS_URL, timeout=5)
+        return r.json() if r.status_code == 200 else {}
+    except (requests.RequestException, ValueError):
+        return {}
+
+
+def _sse_events(response: requests.Response):
+    """(event, data) pairs of a server-sent event stream, as they arrive."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(":")
+            if field == "event":
+                event = value.strip()
+            elif field == "data":
+                data.append(value[1:] if value.startswith(" ") else value)
+            continue
+        if data:
+            yield event, json.loads("\n".join(data))
+        event, data = "message", []
+
+
+def _render_evidence(evidence: list) -> None:
+    with st.expander("Evidence", expanded=True):
+        for item in evidence:
+            source = item.get("source_file", "unknown")
+            chunk_index = item.get("chunk_index", "n/a")
+            text = item.get("text", "")
+            score = item.get("score")
+            badge = ""
+            if score is not None:
+                badge = f"<span class='badge'>score {score:.4f}</span>"
+            also_in = ""
+            duplicates = item.get("duplicates") or []
+            if duplicates:
+                refs = ", ".join(f"{d.get('source_file')} - chunk {d.get('chunk_index')}" for d in duplicates)
+                also_in = f"<div><em>Also appears in: {refs}</em></div>"
+                for d in duplicates:
+                    if d.get("text"):
+                        also_in += (
+                            f"<div><em>Worded differently in {d.get('source_file')} - chunk {d.get('chunk_index')}:</em> "
+                            f"{d['text']}</div>"
+                        )
+
+            st.markdown(
+                f"""
+<div class="evidence">
+  <div class="eh">
+    <strong>{source} - chunk {chunk_index}</strong>
+    {badge}
+  </div>
+  <div>{text}</div>
+  {also_in}
+</div>
+""",
+                unsafe_allow_html=True,
+            )
+
+
 health = _check_api_health()
 
 st.markdown(
@@ -249,6 +315,12 @@ with st.sidebar:
         st.session_state.mode = "unknown"
         st.rerun()
     st.markdown("---")
+    st.markdown("### Scope")
+    st.caption("Limit retrieval to selected documents.")
+    options = _filter_options()
+    scope_docs = st.multiselect("Source documents", options.get("source_file", []))
+    scope_types = st.multiselect("Document types", options.get("doc_type", []))
+    st.markdown("---")
     st.markdown("### Runtime")
     st.code(API_URL)
 
@@ -271,54 +343,52 @@ if query and query.strip():
     with st.chat_message("user"):
         st.write(query)
 
-    with st.spinner("Processing regulatory context..."):
-        payload = {"question": query, "history": st.session_state.history}
-        try:
-            response = requests.post(API_URL, json=payload, timeout=90)
-        except requests.RequestException as exc:
-            response = None
-            st.error(f"Could not reach API: {exc}")
+    payload = {
+        "question": query,
+        "history": st.session_state.history,
+        "filters": {"source_file": scope_docs, "doc_type": scope_types},
+    }
 
-    if response is not None and response.status_code == 200:
-        data = response.json()
-        answer = data.get("answer", "")
-        evidence = data.get("evidence", [])
-        mode = data.get("mode", "unknown")
+    with st.chat_message("assistant"):
+        mode_slot = st.empty()
+        answer_slot = st.empty()
+        answer_slot.caption("Processing regulatory context...")
+    evidence_slot = st.container()
 
+    answer = ""
+    mode = None
+    try:
+        # The read timeout applies between events, not to the whole answer.
+        with requests.post(STREAM_URL, json=payload, stream=True, timeout=(5, 90)) as response:
+            if response.status_code != 200:
+                st.error(f"API error: {response.status_code} - {response.text}")
+            else:
+                for event, data in _sse_events(response):
+                    if event == "evidence":
+                        if data:
+                            with evidence_slot:
+                                _render_evidence(data)
+                    elif event == "token":
+                        answer += data.get("text", "")
+                        answer_slot.markdown(answer + "▌")
+                    elif event == "done":
+                        mode = data.get("mode", "unknown")
+                    elif event == "error":
+                        st.error(f"API error: {data.get('detail')}")
+    except requests.RequestException as exc:
+        st.error(f"Could not reach API: {exc}")
+
+    if answer:
+        answer_slot.markdown(answer)
+    else:
+        answer_slot.empty()
+    if mode is not None:
         st.session_state.messages.append({"role": "assistant", "content": answer})
         st.session_state.history.append({"user": query, "assistant": answer})
         st.session_state.mode = mode
 
-        with st.chat_message("assistant"):
-            mode_class = "mode-fallback" if mode == "fallback" else "mode-llm"
-            st.markdown(
-                f"<span class='mode {mode_class}'>mode: {mode}</span>",
-                unsafe_allow_html=True,
-            )
-            st.write(answer)
-
-        if evidence:
-            with st.expander("Evidence", expanded=True):
-                for item in evidence:
-                    source = item.get("source_file", "unknown")
-                    chunk_index = item.get("chunk_index", "n/a")
-                    text = item.get("text", "")
-                    score = item.get("score")
-                    badge = ""
-                    if score is not None:
-                        badge = f"<span class='badge'>score {score:.4f}</span>"
-
-                    st.markdown(
-                        f"""
-<div class="evidence">
-  <div class="eh">
-    <strong>{source} - chunk {chunk_index}</strong>
-    {badge}
-  </div>
-  <div>{text}</div>
-</div>
-""",
-                        unsafe_allow_html=True,
-                    )
-    elif response is not None:
-        st.error(f"API error: {response.status_code} - {response.text}")
+        mode_class = "mode-fallback" if mode == "fallback" else "mode-llm"
+        mode_slot.markdown(
+            f"<span class='mode {mode_class}'>mode: {mode}</span>",
+            unsafe_allow_html=True,
+        )
@@ -0,0 +1,158 @@
+import types
+
+import numpy as np
+import pytest
+
+from app.config import get_answer_cache_config
+from app.generation import answer_cache
+from app.generation.answer_cache import AnswerCache
+
+HISTORY = [{"role": "user", "content": "Earlier question"}]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(answer_cache, "time", types.SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def embedder(vectors):
+    calls = []
+
+    def embed(question):
+        calls.append(question)
+        return vectors.get(question)
+
+    embed.calls = calls
+    return embed
+
+
+def lookup(cache, question, history=(), filters=None, model="flan", version="v1", embed=None):
+    return cache.lookup(question, list(history), filters, model, version, embed)
+
+
+def cached(cache, question, result, **kwargs):
+    miss = lookup(cache, question, **kwargs)
+    assert miss.result is None
+    cache.store(miss, result)
+
+
+def test_exact_hit_ignores_case_and_whitespace(clock):
+    cache = AnswerCache(similarity=0)
+    cached(cache, "What is Regulation 30?", {"answer": "a"})
+    hit = lookup(cache, "  what is   regulation 30? ")
+    assert hit.tier == "exact" and hit.result == {"answer": "a"}
+    assert cache.stats()["exact_hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_scope_separates_history_filters_and_model(clock):
+    cache = AnswerCache(similarity=0)
+    cached(cache, "q", {"answer": "plain"})
+    cached(cache, "q", {"answer": "with history"}, history=HISTORY)
+    cached(cache, "q", {"answer": "scoped"}, filters={"doc_type": ["master"]})
+
+    assert lookup(cache, "q").result == {"answer": "plain"}
+    assert lookup(cache, "q", history=HISTORY).result == {"answer": "with history"}
+    assert lookup(cache, "q", filters={"doc_type": "master"}).result == {"answer": "scoped"}
+    assert lookup(cache, "q", filters={"source_file": "x.pdf"}).result is None
+    assert lookup(cache, "q", model="other").result is None
+
+
+def test_semantic_hit_above_threshold_only(clock):
+    embed = embedder({
+        "q1": unit(1, 0, 0),
+        "close": unit(1, 0.1, 0),
+        "far": unit(1, 1, 0),
+    })
+    cache = AnswerCache(similarity=0.95)
+    cached(cache, "q1", {"answer": "a"}, embed=embed)
+
+    hit = lookup(cache, "close", embed=embed)
+    assert hit.tier == "semantic" and hit.result == {"answer": "a"}
+    assert lookup(cache, "far", embed=embed).result is None
+    # Semantic matches stay inside their scope too.
+    assert lookup(cache, "close", model="other", embed=embed).result is None
+
+
+def test_semantic_tier_off_never_embeds(clock):
+    embed = embedder({"q1": unit(1, 0), "close": unit(1, 0.01)})
+    cache = AnswerCache(similarity=0)
+    cached(cache, "q1", {"answer": "a"}, embed=embed)
+    assert lookup(cache, "close", embed=embed).result is None
+    assert embed.calls == []
+
+
+def test_exact_hit_does_not_embed(clock):
+    embed = embedder({"q1": unit(1, 0)})
+    cache = AnswerCache(similarity=0.95)
+    cached(cache, "q1", {"answer": "a"}, embed=embed)
+    assert lookup(cache, "Q1", embed=embed).tier == "exact"
+    assert embed.calls == ["q1"]
+
+
+def test_entries_expire_after_ttl(clock):
+    embed = embedder({"q1": unit(1, 0), "close": unit(1, 0.01)})
+    cache = AnswerCache(ttl_seconds=60, similarity=0.95)
+    cached(cache, "q1", {"answer": "a"}, embed=embed)
+    clock.now += 59
+    assert lookup(cache, "q1").result is not None
+    clock.now += 2
+    assert lookup(cache, "q1").result is None
+    assert lookup(cache, "close", embed=embed).result is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = AnswerCache(max_entries=2, similarity=0)
+    cached(cache, "a", {"answer": "a"})
+    cached(cache, "b", {"answer": "b"})
+    assert lookup(cache, "a").result is not None
+    cached(cache, "c", {"answer": "c"})
+    assert lookup(cache, "b").result is None
+    assert lookup(cache, "a").result is not None and lookup(cache, "c").result is not None
+
+
+def test_index_version_change_drops_the_cache(clock):
+    cache = AnswerCache(similarity=0)
+    cached(cache, "q", {"answer": "old"})
+    pending = lookup(cache, "other")
+    assert lookup(cache, "q", version="v2").result is None
+    assert cache.stats()["invalidations"] == 1
+    # An answer generated against the old index is not stored.
+    cache.store(pending, {"answer": "stale"})
+    assert lookup(cache, "other", version="v2").result is None
+
+
+def test_disabled_cache_stores_nothing(clock):
+    cache = AnswerCache(max_entries=0)
+    cached(cache, "q", {"answer": "a"})
+    assert lookup(cache, "q").result is None
+
+
+def test_vector_given_at_store_enables_semantic_hits(clock):
+    embed = embedder({"close": unit(1, 0.1, 0)})
+    cache = AnswerCache(similarity=0.95)
+    # Looked up before the engine could embed the question.
+    miss = lookup(cache, "q1")
+    cache.store(miss, {"answer": "a"}, vector=np.array([2.0, 0.0, 0.0]))
+    assert lookup(cache, "close", embed=embed).tier == "semantic"
+
+
+def test_semantic_tier_is_opt_in(monkeypatch):
+    monkeypatch.delenv("ANSWER_CACHE_SIMILARITY", raising=False)
+    assert get_answer_cache_config()["similarity"] == 0
+    assert AnswerCache().similarity == 0
@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from app.retrieval.chunk_embedding_cache import EmbeddingCache, embed_with_cache
+
+MODEL = "test/minilm"
+DIM = 4
+
+
+def vectors_for(texts, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((len(texts), DIM)).astype(np.float32)
+
+
+def test_add_then_lookup_round_trips(tmp_path):
+    cache = EmbeddingCache(tmp_path, MODEL)
+    assert cache.lookup(["a"])[0] is None
+
+    texts = ["alpha clause", "beta clause", "gamma clause"]
+    vectors = vectors_for(texts)
+    cache.add(texts, vectors)
+    assert len(cache) == 3
+
+    found, missing = cache.lookup(["gamma clause", "new clause", "alpha clause"])
+    assert missing.tolist() == [1]
+    np.testing.assert_array_equal(found[[0, 2]], vectors[[2, 0]])
+    np.testing.assert_array_equal(found[1], np.zeros(DIM, dtype=np.float32))
+
+    # Keys are normalized text, and a reopened cache serves the same rows.
+    reopened = EmbeddingCache(tmp_path, MODEL)
+    found, missing = reopened.lookup(["  beta\n clause ", "alpha clause"])
+    assert not len(missing)
+    np.testing.assert_array_equal(found, vectors[[1, 0]])
+
+
+def test_add_skips_cached_and_repeated_texts(tmp_path):
+    cache = EmbeddingCache(tmp_path, MODEL)
+    cache.add(["a", "b"], vectors_for("ab"))
+    cache.add(["b", "c", "c"], vectors_for("bcc", seed=1))
+    assert len(cache) == 3
+    assert (tmp_path / "keys.bin").stat().st_size == 3 * 16
+    assert (tmp_path / "vectors.f32").stat().st_size == 3 * DIM * 4
+    found, _ = cache.lookup(["b", "c"])
+    np.testing.assert_array_equal(found, np.stack([vectors_for("ab")[1], vectors_for("bcc", seed=1)[1]]))
+
+
+def test_crashed_append_tail_is_ignored_and_truncated(tmp_path):
+    cache = EmbeddingCache(tmp_path, MODEL)
+    vectors = vectors_for(["a", "b"])
+    cache.add(["a", "b"], vectors)
+    # An append that wrote rows but died before meta.json was rewritten.
+    with (tmp_path / "vectors.f32").open("ab") as f:
+        f.write(np.ones((1, DIM), dtype=np.float32).tobytes()[:10])
+    with (tmp_path / "keys.bin").open("ab") as f:
+        f.write(b"x" * 16)
+
+    reopened = EmbeddingCache(tmp_path, MODEL)
+    assert len(reopened) == 2
+    found, missing = reopened.lookup(["a", "b", "c"])
+    assert missing.tolist() == [2]
+    np.testing.assert_array_equal(found[:2], vectors)
+
+    extra = vectors_for(["c"], seed=2)
+    reopened.add(["c"], extra)
+    assert (tmp_path / "keys.bin").stat().st_size == 3 * 16
+    assert (tmp_path / "vectors.f32").stat().st_size == 3 * DIM * 4
+    found, missing = EmbeddingCache(tmp_path, MODEL).lookup(["c", "a", "b"])
+    assert not len(missing)
+    np.testing.assert_array_equal(found, np.concatenate([extra, vectors]))
+
+
+def test_interleaved_adds_and_lookups_match_a_dict(tmp_path):
+    rng = np.random.default_rng(3)
+    cache = EmbeddingCache(tmp_path, MODEL)
+    expected = {}
+    for batch in range(30):
+        texts = [f"chunk {int(i)}" for i in rng.integers(0, 200, size=12)]
+        vectors, missing = cache.lookup(texts)
+        for pos, text in enumerate(texts):
+            if text in expected:
+                np.testing.assert_array_equal(vectors[pos], expected[text])
+            else:
+                assert pos in missing
+        new = vectors_for(texts, seed=100 + batch)
+        cache.add(texts, new)
+        for text, vector in zip(texts, new):
+            expected.setdefault(text, vector)
+
+    assert len(cache) == len(expected)
+    texts = sorted(expected)
+    for reader in (cache, EmbeddingCache(tmp_path, MODEL)):
+        vectors, missing = reader.lookup(texts)
+        assert not len(missing)
+        np.testing.assert_array_equal(vectors, np.stack([expected[t] for t in texts]))
+
+
+def test_rejects_other_model_and_dimension(tmp_path):
+    EmbeddingCache(tmp_path, MODEL).add(["a"], vectors_for("a"))
+    with pytest.raises(ValueError):
+        EmbeddingCache(tmp_path, "other/model")
+    with pytest.raises(ValueError):
+        EmbeddingCache(tmp_path, MODEL).add(["b"], np.zeros((1, DIM + 1), dtype=np.float32))
+
+
+def test_embed_with_cache_encodes_only_missing_texts(tmp_path):
+    cache = EmbeddingCache(tmp_path, MODEL)
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.stack([np.full(DIM, len(t), dtype=np.float32) for t in texts])
+
+    first = embed_with_cache(cache, ["aa", "bbb"], encode)
+    second = embed_with_cache(cache, ["bbb", "c", "aa"], encode)
+    assert calls == [["aa", "bbb"], ["c"]]
+    np.testing.assert_array_equal(second, np.stack([first[1], np.full(DIM, 1, dtype=np.float32), first[0]]))
+    assert embed_with_cache(None, ["dd"], encode).shape == (1, DIM)
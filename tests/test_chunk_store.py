@@ -0,0 +1,61 @@
+import pytest
+
+from app.retrieval.chunk_store import ChunkStore, staged_directory, write_chunk_store
+
+
+def siblings(tmp_path):
+    return sorted(p.name for p in tmp_path.iterdir())
+
+
+def test_staged_directory_swaps_and_cleans_up(tmp_path):
+    target = tmp_path / "index"
+    with staged_directory(target) as staging:
+        (staging / "version").write_text("1")
+    with staged_directory(target) as staging:
+        assert staging != target and not any(staging.iterdir())
+        (staging / "version").write_text("2")
+        # Until the block completes, the previous version is still in place.
+        assert (target / "version").read_text() == "1"
+    assert (target / "version").read_text() == "2"
+    assert siblings(tmp_path) == ["index"]
+
+
+def test_failed_build_keeps_the_old_version(tmp_path):
+    target = tmp_path / "index"
+    with staged_directory(target) as staging:
+        (staging / "version").write_text("1")
+    with pytest.raises(RuntimeError):
+        with staged_directory(target) as staging:
+            (staging / "version").write_text("2")
+            raise RuntimeError("build failed")
+    assert (target / "version").read_text() == "1"
+    assert siblings(tmp_path) == ["index"]
+
+
+def test_interrupted_swap_is_restored(tmp_path):
+    target = tmp_path / "index"
+    with staged_directory(target) as staging:
+        (staging / "version").write_text("1")
+    # Interrupted after moving the old version aside, before the new one landed.
+    target.rename(tmp_path / "index.old")
+    (tmp_path / "index.tmp").mkdir()
+
+    with pytest.raises(RuntimeError):
+        with staged_directory(target):
+            raise RuntimeError("build failed")
+    assert (target / "version").read_text() == "1"
+    assert siblings(tmp_path) == ["index"]
+
+
+def test_chunk_store_round_trips(tmp_path):
+    rows = [
+        {"id": "c1", "source_file": "a.pdf", "chunk_index": 0, "doc_type": "master", "text": "alpha"},
+        {"id": "c2", "source_file": "b.pdf", "chunk_index": 3, "doc_type": "circular", "text": "beta",
+         "duplicates": [{"source_file": "c.pdf", "chunk_index": 1}]},
+    ]
+    write_chunk_store(tmp_path / "chunks", rows)
+    store = ChunkStore(tmp_path / "chunks")
+    assert len(store) == 2
+    assert store[1] == rows[1] and store[0] == rows[0]
+    assert store.position("c2") == 1 and store.position("missing") is None
+    assert store.facets.select((("doc_type", ("master",)),)).tolist() == [0]
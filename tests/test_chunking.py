@@ -0,0 +1,110 @@
+import pytest
+
+from app.ingestion.build_corpus import sliding_chunks
+from app.ingestion.chunking import TokenCounter, clause_chunks, segments
+
+
+class WordCounter(TokenCounter):
+    """Counts whitespace-separated words, so the tests need no tokenizer download."""
+
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+
+COUNTER = WordCounter()
+
+
+def regulation_text() -> str:
+    parts = []
+    for chapter in ("I", "II"):
+        parts.append(f"CHAPTER {chapter}\nPRELIMINARY PROVISIONS\n\n")
+        for reg in range(1, 5):
+            parts.append(f"{len(chapter)}{reg}. Obligations of the listed entity number {reg}.\n")
+            for letter in "abc":
+                parts.append(f"({letter}) the listed entity shall disclose the event " + "within the period specified " * 3 + "\n")
+            parts.append("Provided that the board may relax the time lines in exceptional cases.\n\n")
+    return "".join(parts)
+
+
+TEXT = regulation_text()
+
+
+def pieces(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 7, 50, len(TEXT)])
+def test_chunks_reconstruct_the_text_within_budget(size):
+    chunks = list(clause_chunks(pieces(TEXT, size), max_tokens=80, min_tokens=20, counter=COUNTER))
+    assert "".join(chunks) == TEXT
+    assert all(0 < COUNTER.count(chunk) <= 80 for chunk in chunks)
+    assert chunks == list(clause_chunks([TEXT], max_tokens=80, min_tokens=20, counter=COUNTER))
+
+
+def test_chunks_start_at_boundaries():
+    starts = set()
+    offset = 0
+    for _, text in segments([TEXT]):
+        starts.add(offset)
+        offset += len(text)
+
+    offset = 0
+    for chunk in clause_chunks([TEXT], max_tokens=100, min_tokens=20, counter=COUNTER):
+        assert offset in starts
+        offset += len(chunk)
+    assert offset == len(TEXT)
+
+
+def test_heading_starts_a_new_chunk():
+    chunks = list(clause_chunks([TEXT], max_tokens=200, min_tokens=20, counter=COUNTER))
+    assert sum(chunk.startswith("CHAPTER ") for chunk in chunks) == 2
+
+
+def test_min_tokens_merges_small_clauses():
+    text = "".join(f"{i}. Short clause {i}.\n" for i in range(1, 21))
+    chunks = list(clause_chunks([text], max_tokens=30, min_tokens=12, counter=COUNTER))
+    assert "".join(chunks) == text
+    assert all(COUNTER.count(chunk) >= 12 for chunk in chunks[:-1])
+    assert all(COUNTER.count(chunk) <= 30 for chunk in chunks)
+
+
+def test_long_segment_is_split_at_sentence_ends():
+    text = " ".join(f"Sentence {i} says the entity shall file the report on time." for i in range(30))
+    chunks = list(clause_chunks([text], max_tokens=40, min_tokens=10, counter=COUNTER))
+    assert "".join(chunks) == text
+    assert len(chunks) > 1
+    assert all(COUNTER.count(chunk) <= 40 for chunk in chunks)
+    assert all(chunk.endswith(". ") for chunk in chunks[:-1])
+
+
+def test_long_sentence_is_split_between_words():
+    text = " ".join(f"word{i}" for i in range(100))
+    chunks = list(clause_chunks([text], max_tokens=30, min_tokens=5, counter=COUNTER))
+    assert "".join(chunks) == text
+    assert [COUNTER.count(chunk) for chunk in chunks] == [30, 30, 30, 10]
+
+
+def test_overlap_repeats_trailing_segments_within_budget():
+    chunks = list(clause_chunks([TEXT], max_tokens=80, min_tokens=20, overlap_tokens=25, counter=COUNTER))
+    assert all(COUNTER.count(chunk) <= 80 for chunk in chunks)
+    assert TEXT.startswith(chunks[0])
+    start, end = 0, len(chunks[0])
+    overlapped = 0
+    for chunk in chunks[1:]:
+        # Each chunk starts within the previous one (or right after it) and moves past its end.
+        new_start = next(s for s in range(end, start, -1) if TEXT.startswith(chunk, s))
+        assert COUNTER.count(TEXT[new_start:end]) <= 25
+        assert new_start + len(chunk) > end
+        overlapped += new_start < end
+        start, end = new_start, new_start + len(chunk)
+    assert end == len(TEXT)
+    assert overlapped
+
+
+@pytest.mark.parametrize("cuts", [[], [1], [5, 6, 7], [1499, 1500, 2601], [3000]])
+def test_sliding_chunks_match_whole_text_windows(cuts):
+    text = regulation_text()
+    bounds = [0] + cuts + [len(text)]
+    pieces = [text[a:b] for a, b in zip(bounds, bounds[1:])]
+    expected = [text[start:start + 1500] for start in range(0, len(text), 1300)]
+    assert list(sliding_chunks(pieces, 1500, 200)) == expected
@@ -0,0 +1,186 @@
+import types
+
+import pytest
+
+from app.config import get_hf_breaker_config
+from app.generation import circuit_breaker
+from app.generation.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Deadline, backoff_delay
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, "time", types.SimpleNamespace(monotonic=clock))
+    # No jitter: the breaker stays open for the full interval.
+    monkeypatch.setattr(circuit_breaker.random, "uniform", lambda low, high: high)
+    return clock
+
+
+def make_breaker(**kwargs):
+    options = dict(window_seconds=60.0, min_calls=4, error_rate=0.5, slow_seconds=10.0, slow_rate=0.5, open_seconds=5.0)
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.state == OPEN
+
+
+def test_opens_on_error_rate_once_min_calls_are_in(clock):
+    breaker = make_breaker()
+    for ok in (False, False, True):
+        breaker.record(breaker.allow(), ok, 0.1)
+    assert breaker.state == CLOSED
+    breaker.record(breaker.allow(), True, 0.1)
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+    assert breaker.allow() is None
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_opens_on_slow_rate(clock):
+    breaker = make_breaker()
+    for latency in (12.0, 0.5, 11.0, 0.5):
+        breaker.record(breaker.allow(), True, latency)
+    assert breaker.state == OPEN
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record(breaker.allow(), False, 0.1)
+    clock.now += 61
+    for _ in range(3):
+        breaker.record(breaker.allow(), True, 0.1)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 3
+
+
+def test_half_open_lets_one_probe_through_and_success_closes(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 4.9
+    assert breaker.allow() is None
+
+    clock.now += 0.2
+    probe = breaker.allow()
+    assert probe is not None and probe.probe
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is None
+
+    breaker.record(probe, True, 0.2)
+    assert breaker.state == CLOSED
+    assert breaker.trips == 0
+    assert breaker.allow() is not None
+
+
+def test_failed_probe_reopens_for_twice_as_long(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 5.1
+    breaker.record(breaker.allow(), False, 0.2)
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    clock.now += 9.9
+    assert breaker.allow() is None
+    clock.now += 0.2
+    assert breaker.allow() is not None
+
+
+def test_slow_probe_counts_as_failure(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 5.1
+    breaker.record(breaker.allow(), True, 10.0)
+    assert breaker.state == OPEN
+
+
+def test_open_interval_is_capped(clock):
+    breaker = make_breaker(max_open_seconds=12.0)
+    trip(breaker)
+    for _ in range(4):
+        clock.now += 60
+        breaker.record(breaker.allow(), False, 0.1)
+    assert breaker.stats()["open_for_seconds"] == 12.0
+
+
+def test_outcomes_from_before_a_state_change_are_ignored(clock):
+    breaker = make_breaker()
+    stale = [breaker.allow() for _ in range(3)]
+    trip(breaker)
+
+    clock.now += 5.1
+    probe = breaker.allow()
+    # Calls admitted while closed can neither close nor re-open the half-open breaker.
+    breaker.record(stale[0], True, 0.1)
+    breaker.record(stale[1], False, 0.1)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow() is None
+
+    breaker.record(probe, True, 0.1)
+    assert breaker.state == CLOSED
+    # Nor do they count towards the window of the new closed state.
+    breaker.record(stale[2], False, 0.1)
+    assert breaker.stats()["window_calls"] == 0
+
+
+def test_release_lets_another_probe_go(clock):
+    breaker = make_breaker()
+    trip(breaker)
+    clock.now += 5.1
+    first = breaker.allow()
+    breaker.release(first)
+    second = breaker.allow()
+    assert second is not None and second != first
+    # The released probe's late outcome no longer decides.
+    breaker.record(first, False, 0.1)
+    assert breaker.state == HALF_OPEN
+    breaker.record(second, True, 0.1)
+    assert breaker.state == CLOSED
+
+
+def test_lost_probe_stops_blocking_after_probe_timeout(clock):
+    breaker = make_breaker(probe_timeout=30.0)
+    trip(breaker)
+    clock.now += 5.1
+    lost = breaker.allow()
+    clock.now += 29
+    assert breaker.allow() is None
+    clock.now += 2
+    probe = breaker.allow()
+    assert probe is not None
+    breaker.record(lost, True, 0.1)
+    assert breaker.state == HALF_OPEN
+    breaker.record(probe, False, 0.1)
+    assert breaker.state == OPEN
+
+
+def test_deadline(clock):
+    deadline = Deadline(10.0)
+    assert deadline.timeout(4.0) == 4.0
+    clock.now += 8
+    assert deadline.timeout(4.0) == pytest.approx(2.0)
+    clock.now += 3
+    assert deadline.expired and deadline.remaining == 0.0
+    assert Deadline(None).timeout(4.0) == 4.0 and not Deadline(0).expired
+
+
+def test_deadline_is_unbounded_by_default(monkeypatch):
+    monkeypatch.delenv("HF_DEADLINE", raising=False)
+    assert get_hf_breaker_config()["deadline_seconds"] == 0
+
+
+def test_backoff_delay_is_capped(clock):
+    assert backoff_delay(1, 0.5, 8.0) == 0.5
+    assert backoff_delay(3, 0.5, 8.0) == 2.0
+    assert backoff_delay(10, 0.5, 8.0) == 8.0
@@ -0,0 +1,74 @@
+import json
+import random
+
+from app.config import get_dedup_config
+from app.ingestion.dedup import collapse_near_duplicates, jaccard, near_duplicate_groups, shingles
+
+
+def words(n, seed):
+    rng = random.Random(seed)
+    return [f"w{rng.randrange(5000)}" for _ in range(n)]
+
+
+BASE = words(200, 0)
+# One word changed near the end: shingle Jaccard with BASE is about 0.95.
+NEAR = BASE[:-3] + ["changed"] + BASE[-2:]
+OTHER = words(200, 1)
+
+RECORDS = [
+    {"id": "r0", "source_file": "a.pdf", "chunk_index": 0, "text": " ".join(BASE)},
+    {"id": "r1", "source_file": "a.pdf", "chunk_index": 1, "text": " ".join(OTHER)},
+    {"id": "r2", "source_file": "b.pdf", "chunk_index": 0, "text": " ".join(NEAR)},
+    {"id": "r3", "source_file": "c.pdf", "chunk_index": 4, "text": " ".join(BASE).upper()},
+    {"id": "r4", "source_file": "c.pdf", "chunk_index": 5, "text": " ".join(words(200, 2))},
+    {"id": "r5", "source_file": "d.pdf", "chunk_index": 2, "text": "\n ".join(BASE)},
+]
+
+
+def write_jsonl(path, records):
+    path.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+
+
+def read_jsonl(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_near_duplicate_groups():
+    texts = [r["text"] for r in RECORDS]
+    assert jaccard(shingles(texts[0]), shingles(texts[2])) >= 0.9
+    assert near_duplicate_groups(texts) == [[0, 2, 3, 5]]
+
+
+def test_threshold_above_similarity_keeps_pair_apart():
+    assert near_duplicate_groups([" ".join(BASE), " ".join(NEAR)], threshold=0.99) == []
+
+
+def test_collapse_keeps_first_record_with_back_references(tmp_path):
+    source, target = tmp_path / "corpus.jsonl", tmp_path / "dedup.jsonl"
+    write_jsonl(source, RECORDS)
+
+    assert collapse_near_duplicates(source, target) == (3, 3)
+    kept = read_jsonl(target)
+    assert [r["id"] for r in kept] == ["r0", "r1", "r4"]
+    # Differently worded duplicates keep their text; a whitespace-only difference does not.
+    assert kept[0]["duplicates"] == [
+        {"id": "r2", "source_file": "b.pdf", "chunk_index": 0, "text": RECORDS[2]["text"]},
+        {"id": "r3", "source_file": "c.pdf", "chunk_index": 4, "text": RECORDS[3]["text"]},
+        {"id": "r5", "source_file": "d.pdf", "chunk_index": 2},
+    ]
+    assert kept[0]["text"] == RECORDS[0]["text"]
+    # Records outside any group are copied through untouched.
+    assert kept[1] == RECORDS[1] and kept[2] == RECORDS[4]
+
+
+def test_collapse_without_duplicates_copies_the_file(tmp_path):
+    source, target = tmp_path / "corpus.jsonl", tmp_path / "dedup.jsonl"
+    records = [RECORDS[0], RECORDS[1], RECORDS[4]]
+    write_jsonl(source, records)
+    assert collapse_near_duplicates(source, target) == (3, 0)
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_collapse_is_opt_in(monkeypatch):
+    monkeypatch.delenv("DEDUP_THRESHOLD", raising=False)
+    assert get_dedup_config()["threshold"] == 0
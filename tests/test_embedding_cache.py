@@ -0,0 +1,70 @@
+import sqlite3
+import time
+
+import numpy as np
+
+from app.retrieval.embedding_cache import QueryEmbeddingCache
+
+MODEL = "test/minilm"
+DIM = 4
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, queries):
+        self.calls.append(list(queries))
+        return np.full((len(queries), DIM), len(self.calls), dtype=np.float32)
+
+
+def stored_queries(path):
+    with sqlite3.connect(str(path)) as db:
+        return {row[0] for row in db.execute("SELECT query FROM query_embeddings")}
+
+
+def test_normalized_keys_share_one_encode():
+    cache = QueryEmbeddingCache(MODEL)
+    encoder = CountingEncoder()
+    first = cache.encode(["What is GDPR?"], encoder)
+    second = cache.encode(["  what is   gdpr? "], encoder)
+    np.testing.assert_array_equal(first, second)
+    assert encoder.calls == [["What is GDPR?"]]
+    assert cache.stats()["hits"] == 1
+
+
+def test_zero_ttl_keeps_persisted_entries(tmp_path):
+    path = tmp_path / "queries.sqlite"
+    cache = QueryEmbeddingCache(MODEL, ttl_seconds=0, persist_path=path)
+    cache.encode(["old question"], CountingEncoder())
+    cache._db.execute("UPDATE query_embeddings SET created = ?", (time.time() - 10 * 86400,))
+    cache._db.commit()
+
+    reopened = QueryEmbeddingCache(MODEL, ttl_seconds=0, persist_path=path)
+    encoder = CountingEncoder()
+    reopened.encode(["old question"], encoder)
+    assert encoder.calls == []
+
+
+def test_expired_entries_are_dropped_on_open(tmp_path):
+    path = tmp_path / "queries.sqlite"
+    cache = QueryEmbeddingCache(MODEL, ttl_seconds=60, persist_path=path)
+    cache.encode(["old question"], CountingEncoder())
+    cache._db.execute("UPDATE query_embeddings SET created = ?", (time.time() - 120,))
+    cache._db.commit()
+
+    QueryEmbeddingCache(MODEL, ttl_seconds=60, persist_path=path)
+    assert stored_queries(path) == set()
+
+
+def test_store_is_capped_at_max_entries(tmp_path):
+    path = tmp_path / "queries.sqlite"
+    cache = QueryEmbeddingCache(MODEL, max_entries=2, persist_path=path)
+    for question in ["q1", "q2", "q3"]:
+        cache.encode([question], CountingEncoder())
+        time.sleep(0.01)
+    assert stored_queries(path) == {"q2", "q3"}
+
+    # A smaller cap on reopen trims the file to the newest rows.
+    QueryEmbeddingCache(MODEL, max_entries=1, persist_path=path)
+    assert stored_queries(path) == {"q3"}
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+from app.generation import hf_llm
+
+
+async def pieces(delays):
+    for i, delay in enumerate(delays):
+        await asyncio.sleep(delay)
+        yield f"p{i} "
+
+
+def collect(model, delays, consumer_delay=0.0):
+    async def run():
+        received = []
+        attempts = hf_llm._Attempts(model)
+        async for piece in hf_llm._retrying_stream(lambda timeout: pieces(delays), "stream", attempts):
+            received.append(piece)
+            await asyncio.sleep(consumer_delay)
+        return received
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def short_timeout(monkeypatch):
+    monkeypatch.setattr(hf_llm, "TIMEOUT", 0.05)
+    monkeypatch.delenv("HF_DEADLINE", raising=False)
+
+
+def test_stalled_stream_is_cut_off_after_text_was_sent():
+    with pytest.raises(TimeoutError):
+        collect("test/stalled", [0, 0, 1.0])
+
+
+def test_slow_consumer_is_not_counted_against_the_stream():
+    assert collect("test/slow-consumer", [0, 0, 0], consumer_delay=0.1) == ["p0 ", "p1 ", "p2 "]
@@ -0,0 +1,62 @@
+from app.retrieval.index_update import document_digests, plan_update
+
+
+def row(chunk_id, source, text, **extra):
+    return {"id": chunk_id, "source_file": source, "text": text, **extra}
+
+
+OLD = [
+    row("a0", "a.pdf", "alpha zero"),
+    row("b0", "b.pdf", "beta zero"),
+    row("a1", "a.pdf", "alpha one"),
+    row("c0", "c.pdf", "gamma zero"),
+    row("b1", "b.pdf", "beta one"),
+]
+
+
+def test_unchanged_corpus_keeps_every_row():
+    plan = plan_update(OLD, list(OLD))
+    assert plan.diff.unchanged == ["a.pdf", "b.pdf", "c.pdf"]
+    assert not (plan.diff.added or plan.diff.changed or plan.diff.removed)
+    assert plan.keep.tolist() == [0, 1, 2, 3, 4]
+    assert plan.appended == []
+    assert plan.reuse.tolist() == []
+
+
+def test_changed_added_and_removed_documents():
+    new = [
+        row("a0", "a.pdf", "alpha zero"),
+        row("a1", "a.pdf", "alpha one"),
+        row("b0", "b.pdf", "beta zero"),
+        row("b2", "b.pdf", "beta two"),
+        row("d0", "d.pdf", "delta zero"),
+    ]
+    plan = plan_update(OLD, new)
+    assert plan.diff.unchanged == ["a.pdf"]
+    assert plan.diff.changed == ["b.pdf"]
+    assert plan.diff.added == ["d.pdf"]
+    assert plan.diff.removed == ["c.pdf"]
+    # Kept rows stay in their old order; rows of changed and added documents follow in corpus order.
+    assert plan.keep.tolist() == [0, 2]
+    assert [r["id"] for r in plan.appended] == ["b0", "b2", "d0"]
+    # Chunk texts the old index already embedded point back at their old position.
+    assert plan.reuse.tolist() == [1, -1, -1]
+
+
+def test_reuse_matches_by_text_across_documents():
+    new = [row("x0", "x.pdf", "gamma zero"), row("x1", "x.pdf", "brand new")]
+    plan = plan_update(OLD, new)
+    assert plan.keep.tolist() == []
+    assert sorted(plan.diff.removed) == ["a.pdf", "b.pdf", "c.pdf"]
+    assert plan.reuse.tolist() == [3, -1]
+
+
+def test_new_duplicate_reference_marks_document_changed():
+    new = [dict(r) for r in OLD]
+    new[3]["duplicates"] = [{"id": "z9", "source_file": "z.pdf", "chunk_index": 0}]
+    assert document_digests(new)["c.pdf"] != document_digests(OLD)["c.pdf"]
+    plan = plan_update(OLD, new)
+    assert plan.diff.changed == ["c.pdf"]
+    assert plan.keep.tolist() == [0, 1, 2, 4]
+    assert [r["id"] for r in plan.appended] == ["c0"]
+    assert plan.reuse.tolist() == [3]
@@ -0,0 +1,116 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from app.retrieval.chunk_features import normalize_for_scoring, tokenize
+from app.retrieval.keyword_index import CORPUS_PATH, KeywordIndex, bm25_idf, load_corpus_rows
+
+ROWS = [
+    {"id": "a", "source_file": "lodr.pdf", "text": "Disclosure requirements for listed entities under regulation 30."},
+    {"id": "b", "source_file": "lodr.pdf", "text": "The listed entity shall disclose material events and information."},
+    {"id": "c", "source_file": "mf.pdf", "text": "Disclosure of the portfolio is an obligation of every mutual fund scheme."},
+    {"id": "d", "source_file": "mf.pdf", "text": "1 2 3 4 5 6 7 8 9 10 11 12 13 14 15 listed entity 2019 2020 2021"},
+    {"id": "e", "source_file": "mf.pdf", "text": "Inserted by the Securities and Exchange Board of India w.e.f. 01.04.2020 listed entity"},
+    {"id": "f", "source_file": "icdr.pdf", "text": "Issue of capital: the disclosure shall contain what the regulations require."},
+    {"id": "g", "source_file": "icdr.pdf", "text": "Nothing about the query terms here at all."},
+]
+
+QUERIES = [
+    ("What are disclosure requirements for listed entities?", {"listing", "obligations"}),
+    ("material events listed entity", set()),
+    ("mutual fund portfolio disclosure", {"scheme"}),
+    ("capital issue regulations", {"icdr"}),
+    ("unknown words only", set()),
+]
+
+
+def baseline_search(rows, query, expanded_extra, top_k):
+    """The full-scan scorer keyword retrieval used before the inverted index."""
+    doc_freq = {}
+    for row in rows:
+        for token in tokenize(str(row.get("text", ""))):
+            doc_freq[token] = doc_freq.get(token, 0) + 1
+    idf = {token: bm25_idf(df, max(1, len(rows))) for token, df in doc_freq.items()}
+
+    base = tokenize(query)
+    expanded = base | expanded_extra
+    base_weight = sum(idf.get(t, 1.0) for t in base) or 1.0
+    expanded_weight = sum(idf.get(t, 1.0) for t in expanded) or 1.0
+    phrase_query = "disclosure requirements" in query.lower()
+
+    scored = []
+    for pos, row in enumerate(rows):
+        text = row.get("text", "")
+        text_l = normalize_for_scoring(text).lower()
+        tokens = tokenize(text_l)
+        base_overlap = sum(idf.get(t, 1.0) for t in base & tokens) / base_weight
+        expanded_overlap = sum(idf.get(t, 1.0) for t in expanded & tokens) / expanded_weight
+
+        bonus = 0.0
+        if phrase_query and "disclosure requirements" in text_l:
+            bonus = 0.2
+        elif phrase_query and "disclosure" in text_l and "require" in text_l:
+            bonus = 0.12
+        if phrase_query and re.search(r"disclosure.{0,80}(require|obligation)", text_l):
+            bonus += 0.18
+
+        penalty = min(0.2, len(re.findall(r"(inserted by|substituted by|omitted by|w\.e\.f\.|prior to)", text_l)) * 0.04)
+        if text and sum(ch.isdigit() for ch in text) / float(len(text)) > 0.08:
+            penalty += 0.12
+
+        score = max(0.0, min(1.0, 0.75 * base_overlap + 0.25 * expanded_overlap + bonus - penalty))
+        if score > 0:
+            scored.append((pos, score))
+    scored.sort(key=lambda hit: hit[1], reverse=True)
+    return scored[:top_k]
+
+
+def index_search(index, query, expanded_extra, top_k, filters=None):
+    base = tokenize(query)
+    return index.search(base, base | expanded_extra, "disclosure requirements" in query.lower(), top_k, filters)
+
+
+def assert_same_hits(actual, expected):
+    assert [pos for pos, _ in actual] == [pos for pos, _ in expected]
+    assert [score for _, score in actual] == pytest.approx([score for _, score in expected])
+
+
+@pytest.mark.parametrize("query, expanded_extra", QUERIES)
+def test_search_matches_baseline_scorer(query, expanded_extra):
+    index = KeywordIndex(ROWS)
+    for top_k in (1, 3, len(ROWS)):
+        assert_same_hits(index_search(index, query, expanded_extra, top_k), baseline_search(ROWS, query, expanded_extra, top_k))
+
+
+def test_filtered_search_matches_baseline_on_matching_rows():
+    index = KeywordIndex(ROWS)
+    query, expanded_extra = QUERIES[0]
+    selected = [pos for pos, row in enumerate(ROWS) if row["source_file"] == "mf.pdf"]
+    hits = index_search(index, query, expanded_extra, len(ROWS), {"source_file": "mf.pdf"})
+    assert hits and {pos for pos, _ in hits} <= set(selected)
+    # IDF stays corpus-wide, so compare against the full scan restricted to the same rows.
+    expected = [hit for hit in baseline_search(ROWS, query, expanded_extra, len(ROWS)) if hit[0] in selected]
+    assert_same_hits(hits, expected)
+
+
+def test_saved_index_searches_like_the_built_one(tmp_path: Path):
+    KeywordIndex(ROWS).save(tmp_path / "keyword_index")
+    index = KeywordIndex.load(tmp_path / "keyword_index")
+    for query, expanded_extra in QUERIES:
+        assert_same_hits(index_search(index, query, expanded_extra, 5), baseline_search(ROWS, query, expanded_extra, 5))
+
+
+def test_updated_index_searches_like_a_rebuild():
+    rows = ROWS[1:] + [{"id": "h", "source_file": "new.pdf", "text": "Listed entity disclosure requirements, amended."}]
+    index = KeywordIndex.update(KeywordIndex(ROWS), rows)
+    for query, expanded_extra in QUERIES:
+        assert_same_hits(index_search(index, query, expanded_extra, 5), baseline_search(rows, query, expanded_extra, 5))
+
+
+@pytest.mark.skipif(not CORPUS_PATH.exists(), reason="processed corpus not built")
+def test_search_matches_baseline_scorer_on_corpus():
+    rows = load_corpus_rows(CORPUS_PATH)
+    index = KeywordIndex(rows)
+    for query, expanded_extra in QUERIES:
+        assert_same_hits(index_search(index, query, expanded_extra, 10), baseline_search(rows, query, expanded_extra, 10))
@@ -0,0 +1,30 @@
+import json
+
+import fitz
+
+from app.ingestion import parse_pdfs
+from app.ingestion.build_corpus import document_files
+from app.ingestion.manifest import StageManifest
+
+
+def test_removed_pdf_outputs_are_deleted_when_data_raw_is_empty(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    raw, out = tmp_path / "data_raw", tmp_path / "data_processed"
+    raw.mkdir()
+    out.mkdir()
+    monkeypatch.setattr(parse_pdfs, "RAW_DIR", raw)
+    monkeypatch.setattr(parse_pdfs, "OUT_DIR", out)
+    monkeypatch.setattr("app.ingestion.build_corpus.PROCESSED_DIR", out)
+
+    # A previous run parsed gone.pdf; an older one left a whole-document json.
+    (out / "gone.pages.jsonl").write_text("{}\n", encoding="utf-8")
+    (out / "gone.json").write_text(json.dumps({"source_file": "gone.pdf", "raw_text": "x"}), encoding="utf-8")
+    manifest = StageManifest("parse", {"parser": parse_pdfs.PARSER_VERSION, "pymupdf": fitz.VersionBind})
+    manifest.files["gone.pdf"] = {"sha256": "0", "size": 1, "mtime_ns": 0, "output": "gone.pages.jsonl"}
+    manifest.save()
+
+    parse_pdfs.process_pdfs()
+
+    assert sorted(p.name for p in out.iterdir()) == []
+    assert document_files() == []
+    assert StageManifest("parse", {}).previous == {}
@@ -0,0 +1,112 @@
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from app.retrieval.chunk_features import tokenize
+from app.retrieval.keyword_index import KeywordIndex
+from app.retrieval.shards import FORMAT_VERSION, SHARDS_FILE, ShardSet, write_shard
+
+WORDS = ["listed", "entity", "disclosure", "requirements", "mutual", "fund", "scheme", "capital", "issue", "board"]
+SOURCES = ["a.pdf", "b.pdf", "c.pdf"]
+
+
+def make_corpus(n=60, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = [
+        {
+            "id": f"chunk-{i}",
+            "source_file": SOURCES[i % len(SOURCES)],
+            "doc_type": "master" if i % 2 else "regulation",
+            "chunk_index": i,
+            "text": " ".join(rng.choice(WORDS, size=8)),
+        }
+        for i in range(n)
+    ]
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    # Repeat a vector so the merge has to order equal distances by position.
+    vectors[40] = vectors[3]
+    return rows, vectors
+
+
+@pytest.fixture(scope="module")
+def sharded(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("shards")
+    rows, vectors = make_corpus()
+    groups = {}
+    for pos, row in enumerate(rows):
+        groups.setdefault("src_" + row["source_file"][0], []).append(pos)
+    for name, positions in groups.items():
+        write_shard(directory / name, [rows[p] for p in positions], vectors[positions], "ip", "flat")
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "metric": "ip",
+        "shards": {name: {"num_chunks": len(positions)} for name, positions in groups.items()},
+    }
+    (directory / SHARDS_FILE).write_text(json.dumps(manifest), encoding="utf-8")
+
+    # Global positions run through the shards in name order.
+    order = [pos for name in sorted(groups) for pos in groups[name]]
+    shards = ShardSet(directory, mmap=False, workers=2)
+    yield shards, [rows[p] for p in order], vectors[order]
+    shards.pool.shutdown()
+
+
+def test_positions_follow_shard_order(sharded):
+    shards, rows, _ = sharded
+    assert len(shards) == len(rows)
+    assert [shards[pos]["id"] for pos in range(len(rows))] == [row["id"] for row in rows]
+
+
+@pytest.mark.parametrize("k", [1, 5, 25])
+def test_vector_merge_equals_unsharded_search(sharded, k):
+    shards, _, vectors = sharded
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    queries = np.concatenate([vectors[[3, 17]], np.random.default_rng(1).standard_normal((3, vectors.shape[1]))])
+    queries = queries.astype(np.float32)
+
+    distances, positions = shards.search_vectors(queries, k)
+    expected_d, _ = flat.search(queries, k)
+    np.testing.assert_allclose(distances, expected_d, rtol=1e-5)
+    for q in range(len(queries)):
+        scores = vectors @ queries[q]
+        # Equal scores come back in global position order.
+        expected_p = np.lexsort((np.arange(len(vectors)), -scores))[:k]
+        assert positions[q].tolist() == expected_p.tolist()
+
+
+def test_filtered_vector_merge_stays_inside_the_filter(sharded):
+    shards, rows, vectors = sharded
+    allowed = [pos for pos, row in enumerate(rows) if row["doc_type"] == "master"]
+    _, positions = shards.search_vectors(vectors[:2], 5, {"doc_type": "master"})
+    for q in range(2):
+        scores = vectors[allowed] @ vectors[q]
+        expected = [allowed[i] for i in np.lexsort((allowed, -scores))[:5]]
+        assert positions[q].tolist() == expected
+
+
+def test_vector_merge_pads_when_k_exceeds_corpus(sharded):
+    shards, rows, vectors = sharded
+    _, positions = shards.search_vectors(vectors[:1], len(rows) + 4)
+    assert sorted(positions[0][: len(rows)].tolist()) == list(range(len(rows)))
+    assert positions[0][len(rows):].tolist() == [-1] * 4
+
+
+@pytest.mark.parametrize(
+    "query, filters",
+    [
+        ("listed entity disclosure requirements", None),
+        ("mutual fund scheme", None),
+        ("capital issue board", {"source_file": "b.pdf"}),
+    ],
+)
+def test_keyword_merge_equals_unsharded_index(sharded, query, filters):
+    shards, rows, _ = sharded
+    tokens = tokenize(query)
+    phrase = "disclosure requirements" in query
+    expected = KeywordIndex(rows).search(tokens, tokens, phrase, 10, filters)
+    hits = shards.keyword_search(tokens, tokens, phrase, 10, filters)
+    assert [pos for pos, _ in hits] == [pos for pos, _ in expected]
+    assert [score for _, score in hits] == pytest.approx([score for _, score in expected])